@@ -0,0 +1,105 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""
+Latency of a ctx call made by a script, per proxy transport.
+
+Compares the ctx command (a Python process per call) with the newline
+delimited JSON unix socket proxy used from bash through ctx.sh (requires
+socat) and from Python through client_req.
+
+Usage: python benchmarks/ctx_proxy_latency.py [calls]
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+from cloudify.mocks import MockCloudifyContext
+from cloudify.proxy import client
+from cloudify.proxy.server import HTTPCtxProxy, LineCtxProxy
+
+CTX_SH = os.path.join(os.path.dirname(client.__file__), 'ctx.sh')
+
+
+def _ctx():
+    return MockCloudifyContext(node_id='node_id',
+                               properties={'port': 8080})
+
+
+def _report(name, elapsed, calls):
+    print '{0:<40} {1:>10.3f} ms/call'.format(name, elapsed / calls * 1000)
+
+
+def _time_script(script, socket_url):
+    env = dict(os.environ, CTX_SOCKET_URL=socket_url)
+    start = time.time()
+    subprocess.check_call(['bash', '-c', script], env=env)
+    return time.time() - start
+
+
+def bench_ctx_command(calls):
+    proxy = HTTPCtxProxy(_ctx())
+    try:
+        script = 'for i in $(seq {0}); do ctx node properties port ' \
+                 '>/dev/null; done'.format(calls)
+        _report('ctx command (http)', _time_script(script, proxy.socket_url),
+                calls)
+    finally:
+        proxy.close()
+
+
+def bench_ctx_sh(calls):
+    proxy = LineCtxProxy(_ctx())
+    try:
+        script = ('source {0}; ctx_connect; for i in $(seq {1}); do '
+                  'port=$(ctx_call node properties port); done; '
+                  'ctx_disconnect'.format(CTX_SH, calls))
+        _report('ctx.sh ctx_call (unix lines)',
+                _time_script(script, proxy.socket_url), calls)
+        script = ('source {0}; ctx_connect; for i in $(seq {1}); do '
+                  'ctx_call node properties port >/dev/null; done; '
+                  'ctx_disconnect'.format(CTX_SH, calls))
+        _report('ctx.sh ctx_call, no subshell',
+                _time_script(script, proxy.socket_url), calls)
+    finally:
+        proxy.close()
+
+
+def bench_client_req(proxy_class, name, calls):
+    proxy = proxy_class(_ctx())
+    try:
+        start = time.time()
+        for _ in range(calls):
+            client.client_req(proxy.socket_url, ['node', 'properties', 'port'])
+        _report(name, time.time() - start, calls)
+    finally:
+        proxy.close()
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    bench_ctx_command(max(calls / 10, 1))
+    if subprocess.call(['which', 'socat'], stdout=open(os.devnull, 'w')):
+        print 'socat is not installed, skipping ctx.sh'
+    else:
+        bench_ctx_sh(calls)
+    bench_client_req(HTTPCtxProxy, 'client_req (http)', calls)
+    bench_client_req(LineCtxProxy, 'client_req (unix lines)', calls)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""
+Comparison of the ctx proxy transports of cloudify.proxy.
+
+Every proxy type is started against a MockCloudifyContext and measured
+for:
+
+- startup: creating a proxy, making a call and closing it
+- latency: percentiles of single calls
+- throughput: calls per second of concurrent clients (threads)
+- payload scaling: latency of reading node properties of growing sizes
+
+Everything runs locally (localhost, unix sockets), no network access or
+manager is needed. Transports whose dependencies are missing (ZMQ) are
+skipped.
+
+Usage: python benchmarks/ctx_proxy_transports.py [--calls N] [--clients N]
+       [--transports http,ipc,...] [--sizes 100,10000,...]
+"""
+
+import argparse
+import threading
+import time
+
+from cloudify.mocks import MockCloudifyContext
+from cloudify.proxy import client
+from cloudify.proxy import server
+
+
+class ProxyRunner(object):
+    """Starts a proxy and, for ZMQ proxies, its polling thread"""
+
+    def __init__(self, proxy_class, ctx):
+        self.proxy = proxy_class(ctx)
+        self._stop = False
+        self._thread = None
+        if hasattr(self.proxy, 'poll_and_process'):
+            self._thread = threading.Thread(target=self._poll)
+            self._thread.daemon = True
+            self._thread.start()
+
+    @property
+    def socket_url(self):
+        return self.proxy.socket_url
+
+    def _poll(self):
+        while not self._stop:
+            self.proxy.poll_and_process(timeout=0.1)
+
+    def close(self):
+        if self._thread:
+            self._stop = True
+            self._thread.join()
+        self.proxy.close()
+
+
+TRANSPORTS = [
+    ('http', server.HTTPCtxProxy),
+    ('shared-http', server.SharedHTTPCtxProxy),
+    ('ipc', server.UnixCtxProxy),
+    ('tcp', server.TCPCtxProxy),
+    ('unix-lines', server.LineCtxProxy)
+]
+
+REQUEST = ['node', 'properties', 'port']
+
+
+def _ctx(payload_size=0):
+    properties = {'port': 8080}
+    if payload_size:
+        properties['payload'] = 'x' * payload_size
+    return MockCloudifyContext(node_id='node_id', properties=properties)
+
+
+def _percentile(latencies, percentile):
+    index = int(round(percentile / 100.0 * (len(latencies) - 1)))
+    return latencies[index]
+
+
+def bench_startup(proxy_class, iterations):
+    start = time.time()
+    for _ in range(iterations):
+        runner = ProxyRunner(proxy_class, _ctx())
+        client.client_req(runner.socket_url, REQUEST)
+        runner.close()
+    return (time.time() - start) / iterations
+
+
+def bench_latency(runner, calls):
+    latencies = []
+    for _ in range(calls):
+        start = time.time()
+        client.client_req(runner.socket_url, REQUEST)
+        latencies.append(time.time() - start)
+    latencies.sort()
+    return [_percentile(latencies, p) for p in (50, 90, 99)]
+
+
+def bench_throughput(runner, clients, calls):
+    """:return: calls per second of ``clients`` threads"""
+    calls_per_client = max(calls / clients, 1)
+    errors = []
+
+    def run():
+        try:
+            for _ in range(calls_per_client):
+                client.client_req(runner.socket_url, REQUEST)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run) for _ in range(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    if errors:
+        raise errors[0]
+    return calls_per_client * clients / elapsed
+
+
+def bench_payload(proxy_class, size, calls):
+    runner = ProxyRunner(proxy_class, _ctx(size))
+    try:
+        request = ['node', 'properties', 'payload']
+        start = time.time()
+        for _ in range(calls):
+            client.client_req(runner.socket_url, request)
+        return (time.time() - start) / calls
+    finally:
+        runner.close()
+
+
+def _available(proxy_class):
+    try:
+        ProxyRunner(proxy_class, _ctx()).close()
+        return True
+    except ImportError:
+        return False
+
+
+def _print_table(headers, rows):
+    widths = [max(len(str(row[i])) for row in [headers] + rows)
+              for i in range(len(headers))]
+    line = '  '.join('{{{0}:>{1}}}'.format(i, width)
+                     for i, width in enumerate(widths))
+    print line.format(*headers)
+    print '  '.join('-' * width for width in widths)
+    for row in rows:
+        print line.format(*row)
+    print
+
+
+def _ms(seconds):
+    return '{0:.3f}'.format(seconds * 1000)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Compare the ctx proxy transports')
+    parser.add_argument('--calls', type=int, default=500,
+                        help='calls per latency and throughput measurement')
+    parser.add_argument('--clients', type=int, default=8,
+                        help='concurrent clients of the throughput '
+                             'measurement')
+    parser.add_argument('--startups', type=int, default=20,
+                        help='proxies started by the startup measurement')
+    parser.add_argument('--transports',
+                        default=','.join(name for name, _ in TRANSPORTS))
+    parser.add_argument('--sizes', default='100,10000,1000000',
+                        help='node property sizes (bytes) of the payload '
+                             'measurement')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    selected = args.transports.split(',')
+    transports = []
+    for name, proxy_class in TRANSPORTS:
+        if name not in selected:
+            continue
+        if _available(proxy_class):
+            transports.append((name, proxy_class))
+        else:
+            print '{0}: dependencies missing, skipped'.format(name)
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    rows = []
+    for name, proxy_class in transports:
+        startup = bench_startup(proxy_class, args.startups)
+        runner = ProxyRunner(proxy_class, _ctx())
+        try:
+            p50, p90, p99 = bench_latency(runner, args.calls)
+            throughput = bench_throughput(runner, args.clients, args.calls)
+        finally:
+            runner.close()
+        rows.append([name, _ms(startup), _ms(p50), _ms(p90), _ms(p99),
+                     '{0:.0f}'.format(throughput)])
+    _print_table(['transport', 'startup ms', 'p50 ms', 'p90 ms', 'p99 ms',
+                  'calls/s ({0} clients)'.format(args.clients)], rows)
+
+    rows = []
+    for name, proxy_class in transports:
+        rows.append([name] + [
+            _ms(bench_payload(proxy_class, size,
+                              max(args.calls / max(size / 10000, 1), 5)))
+            for size in sizes])
+    _print_table(['transport'] + ['{0} B ms'.format(size) for size in sizes],
+                 rows)
+
+
+if __name__ == '__main__':
+    main()
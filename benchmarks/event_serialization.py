@@ -0,0 +1,98 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""
+Microbenchmark of the log and event serialization path.
+
+Compares the previous timestamping (strftime + datetime.now() per item)
+with cloudify.serialization, and measures populating, encoding and
+formatting (the stdout path) a typical task event.
+
+Usage: python benchmarks/event_serialization.py [iterations]
+"""
+
+import datetime
+import json
+import sys
+import time
+import timeit
+
+from cloudify import logs
+from cloudify import serialization
+
+
+def _legacy_timestamp():
+    timezone = time.strftime("%z", time.gmtime())
+    return str(datetime.datetime.now())[0:-3] + timezone
+
+
+def _event():
+    return {
+        'event_type': 'task_succeeded',
+        'context': {
+            'blueprint_id': 'blueprint',
+            'deployment_id': 'deployment',
+            'execution_id': '7ab3c2c4-6b4d-4a4f-8d6e-2a3c1e8e4f0b',
+            'workflow_id': 'install',
+            'task_id': 'd5a7e1f2-3c4b-4d5e-8f9a-0b1c2d3e4f5a',
+            'task_name': 'script_runner.tasks.run',
+            'task_queue': 'deployment',
+            'task_target': 'deployment',
+            'operation': 'cloudify.interfaces.lifecycle.create',
+            'plugin': 'script',
+            'node_id': 'vm_a1b2c',
+            'node_name': 'vm',
+            'task_current_retries': 0,
+            'task_total_retries': -1
+        },
+        'message': {
+            'text': "Task succeeded 'script_runner.tasks.run'",
+            'arguments': None
+        }
+    }
+
+
+def _populate_and_encode():
+    event = _event()
+    logs.populate_base_item(event, 'cloudify_event')
+    return serialization.dumps(event)
+
+
+def _populate_and_format():
+    event = _event()
+    logs.populate_base_item(event, 'cloudify_event')
+    return logs.create_event_message_prefix(event)
+
+
+def _run(name, func, iterations):
+    elapsed = min(timeit.repeat(func, number=iterations, repeat=3))
+    print '{0:<32} {1:>8.2f} us/op'.format(
+        name, elapsed / iterations * 1000000)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print 'json encoder: {0}'.format(serialization._json_encoder.__module__)
+    _run('legacy timestamp', _legacy_timestamp, iterations)
+    _run('cached timestamp', serialization.format_timestamp, iterations)
+    _run('build event', _event, iterations)
+    _run('json.dumps event', lambda: json.dumps(_event()), iterations)
+    _run('populate + encode event', _populate_and_encode, iterations)
+    _run('populate + stdout format event', _populate_and_format,
+         iterations)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,7 +14,7 @@
 #    * limitations under the License.
 
 
-import json
+import threading
 
 import pika
 
@@ -22,6 +22,7 @@ from cloudify.utils import (
     get_manager_ip,
     internal,
 )
+from cloudify import serialization
 
 
 class AMQPClient(object):
@@ -29,17 +30,25 @@ class AMQPClient(object):
     events_queue_name = 'cloudify-events'
     logs_queue_name = 'cloudify-logs'
 
+    # number of broker connections currently opened by this process
+    open_connections = 0
+    _connections_lock = threading.Lock()
+
     def __init__(self,
                  amqp_user='guest',
                  amqp_pass='guest',
                  amqp_host=None,
                  ssl_enabled=False,
-                 ssl_cert_path=''):
+                 ssl_cert_path='',
+                 compress_threshold=None):
         if amqp_host is None:
             amqp_host = get_manager_ip()
 
         self.events_queue = None
         self.logs_queue = None
+        # message bodies larger than this are compressed, see
+        # cloudify.serialization.encode_message
+        self.compress_threshold = compress_threshold
 
         credentials = pika.credentials.PlainCredentials(
             username=amqp_user,
@@ -60,15 +69,23 @@ class AMQPClient(object):
                 ssl_options=ssl_options,
             )
         )
+        self._closed = False
+        self._track_connection(1)
         settings = {
             'auto_delete': True,
             'durable': True,
             'exclusive': False
         }
-        self.logs_queue = self.connection.channel()
-        self.logs_queue.queue_declare(queue=self.logs_queue_name, **settings)
-        self.events_queue = self.connection.channel()
-        self.events_queue.queue_declare(queue=self.logs_queue_name, **settings)
+        try:
+            self.logs_queue = self.connection.channel()
+            self.logs_queue.queue_declare(queue=self.logs_queue_name,
+                                          **settings)
+            self.events_queue = self.connection.channel()
+            self.events_queue.queue_declare(queue=self.logs_queue_name,
+                                            **settings)
+        except BaseException:
+            self.close()
+            raise
 
     def publish_log(self, log):
         self._publish(log, self.logs_queue_name)
@@ -77,23 +94,44 @@ class AMQPClient(object):
         self._publish(event, self.events_queue_name)
 
     def close(self):
-        self.connection.close()
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.connection.close()
+        finally:
+            self._track_connection(-1)
+
+    @classmethod
+    def _track_connection(cls, delta):
+        with cls._connections_lock:
+            cls.open_connections += delta
 
     def _publish(self, item, queue):
+        body, content_encoding = serialization.encode_message(
+            item, self.compress_threshold)
+        properties = None
+        if content_encoding is not None:
+            properties = pika.BasicProperties(
+                content_type=serialization.JSON_CONTENT_TYPE,
+                content_encoding=content_encoding)
         self.events_queue.basic_publish(exchange='',
                                         routing_key=queue,
-                                        body=json.dumps(item))
+                                        body=body,
+                                        properties=properties)
 
 
 def create_client(amqp_user='guest',
                   amqp_pass='guest',
                   amqp_host=None,
                   ssl_enabled=False,
-                  ssl_cert_path=''):
+                  ssl_cert_path='',
+                  compress_threshold=None):
     return AMQPClient(
         amqp_host=amqp_host,
         amqp_user=amqp_user,
         amqp_pass=amqp_pass,
         ssl_enabled=ssl_enabled,
         ssl_cert_path=ssl_cert_path,
+        compress_threshold=compress_threshold,
     )
@@ -0,0 +1,376 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+
+import collections
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from cloudify import serialization
+
+DEFAULT_BUFFER_SIZE = 10000
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 0.5
+DEFAULT_PUBLISH_RETRIES = 3
+DEFAULT_RECONNECT_INTERVAL = 1
+
+# what to do with a message published while the buffer is full
+FULL_POLICY_BLOCK = 'block'
+FULL_POLICY_DROP_DEBUG = 'drop_debug'
+FULL_POLICY_SPILL = 'spill'
+FULL_POLICIES = (FULL_POLICY_BLOCK, FULL_POLICY_DROP_DEBUG, FULL_POLICY_SPILL)
+
+LOG = 'log'
+EVENT = 'event'
+
+
+class BufferedPublisher(object):
+    """
+    Publishes logs and events to RabbitMQ from a background thread.
+
+    Messages are appended to a bounded in-memory buffer and returned
+    immediately, a flusher thread publishes them in batches (every
+    ``batch_size`` messages or ``flush_interval`` seconds, whichever comes
+    first) using a client created by ``client_factory``.
+
+    When the buffer is full, the ``full_policy`` decides what happens:
+
+    - ``block``: the caller waits for the flusher to make room.
+    - ``drop_debug``: debug logs are dropped (counted in ``dropped``),
+      other messages wait like ``block``.
+    - ``spill``: messages are appended to a spill file on disk and
+      published, in order and ``batch_size`` messages at a time, once the
+      buffer is drained. The file is truncated once all of it was
+      published.
+
+    When ``spool_directory`` is set, messages are appended to a durable
+    on-disk spool (see ``cloudify.amqp_spool``) instead of the in-memory
+    buffer, and the flusher thread drains the spool in order, consuming
+    messages only once they were published. Messages which fail to publish
+    stay in the spool and are retried, and messages left by a process that
+    died are published by the next process using the spool directory. In
+    this mode ``flush`` only waits for the messages to be written to disk,
+    so callers never wait on the broker.
+
+    All messages are published by the flusher thread over a single client
+    (i.e. a single broker connection per process). When publishing fails,
+    the client is closed and a new one is created, waiting
+    ``reconnect_interval`` seconds (doubled on every attempt) between
+    attempts. Messages of a batch which could not be published after
+    ``publish_retries`` reconnections are dropped.
+
+    :param client_factory: a function returning an object with
+                           ``publish_log``, ``publish_event`` and ``close``
+                           methods (e.g. an ``AMQPClient``). Called on the
+                           flusher thread.
+    :param buffer_size: maximum number of messages held in memory
+    :param batch_size: maximum number of messages published per batch
+    :param flush_interval: maximum seconds a message waits in the buffer
+    :param full_policy: one of ``FULL_POLICIES``
+    :param spill_path: the spill file path (default: a temporary file)
+    :param publish_retries: reconnections attempted before dropping
+                            messages which failed to publish
+    :param reconnect_interval: seconds to wait before the first
+                               reconnection attempt
+    :param spool_directory: a directory for durable spools (default: do
+                            not spool)
+    :param spool_segment_size: the size in bytes of spool segment files
+    """
+
+    def __init__(self,
+                 client_factory,
+                 buffer_size=DEFAULT_BUFFER_SIZE,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 full_policy=FULL_POLICY_BLOCK,
+                 spill_path=None,
+                 publish_retries=DEFAULT_PUBLISH_RETRIES,
+                 reconnect_interval=DEFAULT_RECONNECT_INTERVAL,
+                 spool_directory=None,
+                 spool_segment_size=None):
+        if full_policy not in FULL_POLICIES:
+            raise ValueError('Unknown full buffer policy: {0} (expected one '
+                             'of {1})'.format(full_policy, FULL_POLICIES))
+        self.client_factory = client_factory
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.full_policy = full_policy
+        self.spill_path = spill_path
+        self.publish_retries = publish_retries
+        self.reconnect_interval = reconnect_interval
+        self.spool_directory = spool_directory
+        self.spool_segment_size = spool_segment_size
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # a new lock in forked processes too, as the parent's may have been
+        # held by its flusher thread when forking
+        self._cond = threading.Condition()
+        self._client = None
+        self._buffer = collections.deque()
+        self._spill_file = None
+        self._spilled = 0
+        # offset of the first spilled message not published yet, and the
+        # end offset of the spilled messages being published
+        self._spill_offset = 0
+        self._spill_batch_end = None
+        self._spool = None
+        # number of messages accepted for publishing, and number of those
+        # already processed (published or failed to publish)
+        self._accepted = 0
+        self._processed = 0
+        self._flush_requests = 0
+        self._closed = False
+        self._thread = None
+        self.dropped = 0
+        self.failed = 0
+        self.connections = 0
+        self.reconnects = 0
+
+    def publish_log(self, log):
+        self._put(LOG, log)
+
+    def publish_event(self, event):
+        self._put(EVENT, event)
+
+    def flush(self, timeout=None):
+        """
+        Wait until all messages published so far were sent.
+
+        :param timeout: maximum seconds to wait (default: no limit)
+        :return: True if all messages were sent, False on timeout
+        """
+        if self._pid != os.getpid():
+            # forked: nothing published by this process yet
+            return True
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            if self._thread is None:
+                return True
+            if self._spool is not None:
+                self._spool.sync()
+                return True
+            target = self._accepted
+            self._flush_requests += 1
+            self._cond.notify_all()
+            try:
+                while self._processed < target:
+                    if deadline is None:
+                        self._cond.wait()
+                    else:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            return False
+                        self._cond.wait(remaining)
+            finally:
+                self._flush_requests -= 1
+        return True
+
+    def close(self, timeout=None):
+        """Flush pending messages and stop the flusher thread"""
+        if self._pid != os.getpid():
+            # forked: the flusher thread and spool are the parent's
+            return
+        self.flush(timeout)
+        with self._cond:
+            thread = self._thread
+            self._closed = True
+            self._cond.notify_all()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+        if self._spool is not None and not (thread and thread.is_alive()):
+            self._spool.close()
+
+    def _put(self, message_type, message):
+        if self._pid != os.getpid():
+            # forked: the flusher thread was not inherited, and the lock
+            # is not taken before it is replaced
+            self._reset()
+        with self._cond:
+            if self._thread is None:
+                if self.spool_directory is not None:
+                    self._open_spool()
+                self._start()
+            if self._spool is not None:
+                self._spool.append(
+                    serialization.dumps([message_type, message]))
+                self._accepted += 1
+                if self._spool.pending >= self.batch_size:
+                    self._cond.notify_all()
+                return
+            if self._spilled or len(self._buffer) >= self.buffer_size:
+                if self.full_policy == FULL_POLICY_SPILL:
+                    self._spill(message_type, message)
+                    return
+                if (self.full_policy == FULL_POLICY_DROP_DEBUG and
+                        _is_debug_log(message_type, message)):
+                    self.dropped += 1
+                    return
+                while len(self._buffer) >= self.buffer_size:
+                    self._cond.wait()
+            self._buffer.append((message_type, message))
+            self._accepted += 1
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify_all()
+
+    def _open_spool(self):
+        # imported here as spooling is optional and not supported on all
+        # platforms
+        from cloudify import amqp_spool
+        kwargs = {}
+        if self.spool_segment_size is not None:
+            kwargs['segment_size'] = self.spool_segment_size
+        self._spool = amqp_spool.open_spool(self.spool_directory, **kwargs)
+
+    def _start(self):
+        thread = threading.Thread(target=self._run,
+                                  name='cloudify-amqp-publisher')
+        thread.daemon = True
+        thread.start()
+        self._thread = thread
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if (not self._closed and
+                        not self._flush_requests and
+                        self._pending() < self.batch_size and
+                        not self._spilled):
+                    self._cond.wait(self.flush_interval)
+                if self._spool is not None:
+                    records = self._spool.read(self.batch_size)
+                    batch = [tuple(json.loads(record))
+                             for record, _ in records]
+                else:
+                    batch = self._take_batch()
+                if not batch and self._closed:
+                    self._close_client()
+                    return
+            if batch:
+                published = self._publish(batch)
+                if self._spool is not None:
+                    if published:
+                        self._spool.consume(records[published - 1][1])
+                    if published < len(batch) and self._closed:
+                        # left in the spool for the next process
+                        self._close_client()
+                        return
+                else:
+                    self.failed += len(batch) - published
+                with self._cond:
+                    if self._spill_batch_end is not None:
+                        self._spilled_batch_done(len(batch))
+                    self._processed += len(batch)
+                    self._cond.notify_all()
+
+    def _pending(self):
+        if self._spool is not None:
+            return self._spool.pending
+        return len(self._buffer)
+
+    def _take_batch(self):
+        batch = []
+        while self._buffer and len(batch) < self.batch_size:
+            batch.append(self._buffer.popleft())
+        if not batch and self._spilled:
+            batch = self._read_spilled()
+        if batch:
+            # wake up callers blocked on a full buffer
+            self._cond.notify_all()
+        return batch
+
+    def _publish(self, batch):
+        published = 0
+        attempt = 0
+        while True:
+            try:
+                if self._client is None:
+                    self._client = self.client_factory()
+                    self.connections += 1
+                for message_type, message in batch[published:]:
+                    if message_type == LOG:
+                        self._client.publish_log(message)
+                    else:
+                        self._client.publish_event(message)
+                    published += 1
+                return published
+            except BaseException as e:
+                self._close_client()
+                if attempt >= self.publish_retries or self._closed:
+                    logging.getLogger('cloudify_events').warning(
+                        'Error publishing {0} messages to RabbitMQ '
+                        '[message={1}]'.format(len(batch) - published, e))
+                    return published
+                time.sleep(self.reconnect_interval * 2 ** attempt)
+                attempt += 1
+                self.reconnects += 1
+
+    def _close_client(self):
+        client, self._client = self._client, None
+        if client is not None:
+            try:
+                client.close()
+            except BaseException:
+                pass
+
+    def _spill(self, message_type, message):
+        if self._spill_file is None:
+            if self.spill_path is None:
+                fd, self.spill_path = tempfile.mkstemp(
+                    prefix='cloudify-amqp-spill-')
+                os.close(fd)
+            self._spill_file = open(self.spill_path, 'w+')
+        self._spill_file.seek(0, os.SEEK_END)
+        self._spill_file.write(serialization.dumps([message_type, message]))
+        self._spill_file.write('\n')
+        self._spilled += 1
+        self._accepted += 1
+
+    def _read_spilled(self):
+        """Read the next ``batch_size`` spilled messages"""
+        self._spill_file.flush()
+        self._spill_file.seek(self._spill_offset)
+        batch = []
+        while len(batch) < self.batch_size:
+            line = self._spill_file.readline()
+            if not line:
+                break
+            batch.append(tuple(json.loads(line)))
+        self._spill_batch_end = self._spill_file.tell()
+        return batch
+
+    def _spilled_batch_done(self, count):
+        """
+        Drop the spilled messages of the last batch read by
+        ``_read_spilled`` from the spill file, once they were published
+        (or failed to publish, as buffered messages).
+        """
+        self._spill_offset = self._spill_batch_end
+        self._spill_batch_end = None
+        self._spilled -= count
+        if not self._spilled:
+            self._spill_file.seek(0)
+            self._spill_file.truncate()
+            self._spill_offset = 0
+
+
+def _is_debug_log(message_type, message):
+    return message_type == LOG and message.get('level') == 'debug'
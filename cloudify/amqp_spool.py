@@ -0,0 +1,246 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+
+import errno
+import fcntl
+import itertools
+import json
+import mmap
+import os
+import struct
+import threading
+
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+
+SEGMENT_FILE_FORMAT = 'segment-{0:010d}'
+SEGMENT_FILE_PREFIX = 'segment-'
+CHECKPOINT_FILE = 'checkpoint'
+LOCK_FILE = 'lock'
+
+# records are stored as a 4 bytes big endian length followed by the
+# payload. A zero length marks the end of the written part of a segment.
+_HEADER = struct.Struct('>I')
+
+
+class SpoolLockedError(Exception):
+    """The spool directory is used by another process"""
+    pass
+
+
+class DiskSpool(object):
+    """
+    An append-only on-disk queue of records.
+
+    Records are appended to memory mapped segment files of
+    ``segment_size`` bytes. When a record does not fit in the current
+    segment a new segment is started. The position of the first record
+    not consumed yet is kept in a checkpoint file, so records appended by a
+    process which died before they were consumed are consumed by the next
+    process opening the spool. Fully consumed segments are deleted.
+
+    A spool directory is locked by the process using it.
+
+    :param path: the spool directory (created if missing)
+    :param segment_size: the size in bytes of new segment files
+    """
+
+    def __init__(self, path, segment_size=DEFAULT_SEGMENT_SIZE):
+        self.path = path
+        self.segment_size = segment_size
+        self._lock = threading.Lock()
+        _makedirs(path)
+        self._lock_file = open(os.path.join(path, LOCK_FILE), 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            self._lock_file.close()
+            raise SpoolLockedError('Spool {0} is locked by another process'
+                                   .format(path))
+        self._segments = {}
+        for name in os.listdir(path):
+            if name.startswith(SEGMENT_FILE_PREFIX):
+                index = int(name[len(SEGMENT_FILE_PREFIX):])
+                self._segments[index] = _Segment(self._segment_path(index))
+        self._read_index, self._read_offset = self._load_checkpoint()
+        if self._segments:
+            self._write_index = max(self._segments)
+            self._write_offset = self._segments[self._write_index].end()
+        else:
+            self._write_index = self._read_index
+            self._write_offset = 0
+        self.pending = sum(1 for _ in self._iter_records())
+
+    def append(self, record):
+        """
+        :param record: the record to append (a non empty string)
+        """
+        with self._lock:
+            size = _HEADER.size + len(record)
+            segment = self._segments.get(self._write_index)
+            if (segment is None or
+                    self._write_offset + size > segment.size):
+                if segment is not None:
+                    self._write_index += 1
+                segment = _Segment(self._segment_path(self._write_index),
+                                   size=max(self.segment_size,
+                                            size + _HEADER.size))
+                self._segments[self._write_index] = segment
+                self._write_offset = 0
+            offset = self._write_offset
+            # the header is written last so a partially written record is
+            # never read
+            segment.mmap[offset + _HEADER.size:offset + size] = record
+            segment.mmap[offset:offset + _HEADER.size] = \
+                _HEADER.pack(len(record))
+            self._write_offset += size
+            self.pending += 1
+
+    def read(self, max_records):
+        """
+        Read records from the first record not consumed yet, without
+        consuming them.
+
+        :param max_records: maximum number of records to read
+        :return: a list of (record, position) tuples, position being the
+                 position to pass to ``consume`` once the record (and all
+                 records before it) was handled
+        """
+        with self._lock:
+            return list(itertools.islice(self._iter_records(), max_records))
+
+    def consume(self, position):
+        """
+        Mark records up to position (as returned by ``read``) as consumed.
+        """
+        with self._lock:
+            index, offset, count = position
+            self._read_index, self._read_offset = index, offset
+            self.pending -= count
+            self._save_checkpoint()
+            for segment_index in sorted(self._segments):
+                if segment_index >= index:
+                    break
+                self._segments.pop(segment_index).close(delete=True)
+
+    def sync(self):
+        """Flush the appended records to disk"""
+        with self._lock:
+            segment = self._segments.get(self._write_index)
+            if segment is not None:
+                segment.mmap.flush()
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments.values():
+                segment.close()
+            self._segments = {}
+            self._lock_file.close()
+
+    def _iter_records(self):
+        index, offset = self._read_index, self._read_offset
+        count = 0
+        while index in self._segments:
+            segment = self._segments[index]
+            length = 0
+            if offset + _HEADER.size <= segment.size:
+                length = _HEADER.unpack_from(segment.mmap, offset)[0]
+            if length == 0:
+                if index == self._write_index:
+                    return
+                # the rest of the segment is unused, continue with the next
+                index, offset = index + 1, 0
+                continue
+            start = offset + _HEADER.size
+            offset = start + length
+            count += 1
+            yield segment.mmap[start:offset], (index, offset, count)
+
+    def _segment_path(self, index):
+        return os.path.join(self.path, SEGMENT_FILE_FORMAT.format(index))
+
+    def _load_checkpoint(self):
+        try:
+            with open(os.path.join(self.path, CHECKPOINT_FILE)) as f:
+                checkpoint = json.load(f)
+            index, offset = checkpoint['segment'], checkpoint['offset']
+        except (IOError, ValueError, KeyError):
+            index, offset = (min(self._segments) if self._segments else 0), 0
+        if self._segments and index < min(self._segments):
+            index, offset = min(self._segments), 0
+        return index, offset
+
+    def _save_checkpoint(self):
+        path = os.path.join(self.path, CHECKPOINT_FILE)
+        tmp_path = '{0}.tmp'.format(path)
+        with open(tmp_path, 'w') as f:
+            json.dump({'segment': self._read_index,
+                       'offset': self._read_offset}, f)
+        os.rename(tmp_path, path)
+
+
+def open_spool(directory, segment_size=DEFAULT_SEGMENT_SIZE):
+    """
+    Open a spool under ``directory`` not used by another process.
+
+    Every process uses its own spool (a numbered sub directory). Spools
+    left by processes that are gone are reused, so their records are
+    eventually consumed.
+
+    :param directory: the spools directory
+    :param segment_size: the size in bytes of new segment files
+    :return: a DiskSpool
+    """
+    for slot in itertools.count():
+        try:
+            return DiskSpool(os.path.join(directory, str(slot)),
+                             segment_size=segment_size)
+        except SpoolLockedError:
+            continue
+
+
+class _Segment(object):
+
+    def __init__(self, path, size=None):
+        self.path = path
+        if size is not None:
+            with open(path, 'wb') as f:
+                f.truncate(size)
+        self.file = open(path, 'r+b')
+        self.size = os.path.getsize(path)
+        self.mmap = mmap.mmap(self.file.fileno(), self.size)
+
+    def end(self):
+        offset = 0
+        while offset + _HEADER.size <= self.size:
+            length = _HEADER.unpack_from(self.mmap, offset)[0]
+            if length == 0:
+                break
+            offset += _HEADER.size + length
+        return offset
+
+    def close(self, delete=False):
+        self.mmap.close()
+        self.file.close()
+        if delete:
+            os.remove(self.path)
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
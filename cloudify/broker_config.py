@@ -25,6 +25,21 @@ broker_cert_path = config.get('broker_cert_path', '')
 broker_username = config.get('broker_username', 'guest')
 broker_password = config.get('broker_password', 'guest')
 broker_hostname = config.get('broker_hostname', 'localhost')
+# logs and events larger than this (in bytes) are published compressed
+# (see cloudify.serialization.decode_message), None to never compress
+broker_compress_threshold = config.get('broker_compress_threshold')
+
+# Buffering of logs and events published to the broker
+# (see cloudify.amqp_publisher)
+publisher_buffer_size = config.get('publisher_buffer_size', 10000)
+publisher_batch_size = config.get('publisher_batch_size', 100)
+publisher_flush_interval = config.get('publisher_flush_interval', 0.5)
+publisher_full_policy = config.get('publisher_full_policy', 'block')
+publisher_spill_path = config.get('publisher_spill_path')
+publisher_publish_retries = config.get('publisher_publish_retries', 3)
+publisher_reconnect_interval = config.get('publisher_reconnect_interval', 1)
+publisher_spool_directory = config.get('publisher_spool_directory')
+publisher_spool_segment_size = config.get('publisher_spool_segment_size')
 
 if broker_ssl_enabled:
     BROKER_USE_SSL = {
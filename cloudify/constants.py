@@ -41,3 +41,13 @@ COMPUTE_NODE_TYPE = 'cloudify.nodes.Compute'
 
 BROKER_PORT_NO_SSL = 5672
 BROKER_PORT_SSL = 5671
+
+# workflow context key enabling prefetching the data of the nodes of
+# operations, and the operation context key of the prefetched nodes (node
+# dicts by node id, used before fetching nodes from the manager)
+PREFETCH_CONTEXT_KEY = 'prefetch_context'
+PREFETCHED_NODES_CONTEXT_KEY = 'prefetched_nodes'
+# the node keys prefetched (node data which does not change during workflows)
+PREFETCHED_NODE_KEYS = ['id', 'deployment_id', 'blueprint_id', 'type',
+                        'type_hierarchy', 'properties', 'relationships',
+                        'host_id']
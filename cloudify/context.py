@@ -16,7 +16,9 @@
 import warnings
 
 from cloudify.endpoint import ManagerEndpoint, LocalEndpoint
-from cloudify.logs import init_cloudify_logger
+from cloudify.logs import (init_cloudify_logger,
+                           logger_settings,
+                           release_cloudify_logger)
 from cloudify import constants
 from cloudify import exceptions
 from cloudify import utils
@@ -91,7 +93,8 @@ class CommonContext(object):
             # there are times when this instance is instantiated merely for
             # accessing the attributes so we can tolerate no storage (such is
             # the case in logging)
-            self._endpoint = LocalEndpoint(self, ctx.get('storage'))
+            self._endpoint = LocalEndpoint(self, ctx.get('storage'),
+                                           ctx.get('event_sink'))
         else:
             self._endpoint = ManagerEndpoint(self)
 
@@ -339,8 +342,31 @@ class NodeInstanceContext(EntityContext):
         automatically invoked as soon as the task execution is over.
         """
         if self._node_instance is not None and self._node_instance.dirty:
-            self._endpoint.update_node_instance(self._node_instance)
-            self._node_instance = None
+            try:
+                version = self._endpoint.update_node_instance(
+                    self._node_instance)
+            except Exception as e:
+                if self._endpoint.is_version_conflict(e):
+                    # the node instance was changed since it was fetched,
+                    # it is fetched again on its next use
+                    self._node_instance = None
+                raise
+            if version is None:
+                self._node_instance = None
+            else:
+                # the updated node instance is kept, so it is not fetched
+                # again on its next use
+                self._node_instance.set_updated(version)
+
+    def refresh(self):
+        """
+        Discard the node instance data read from Cloudify's storage, so it
+        is fetched again on its next use. Changes not stored by ``update``
+        are lost.
+        """
+        self._node_instance = None
+        self._host_ip = None
+        self._relationships = None
 
     def _get_node_instance_ip_if_needed(self):
         self._get_node_instance_if_needed()
@@ -780,7 +806,12 @@ class CloudifyContext(CommonContext):
         logger_name = self.task_id if self.task_id is not None \
             else 'cloudify_plugin'
         handler = self._endpoint.get_logging_handler()
-        return init_cloudify_logger(handler, logger_name)
+        return init_cloudify_logger(handler, logger_name,
+                                    **logger_settings(self._context))
+
+    def _release_logger(self):
+        logger, self._logger = self._logger, None
+        release_cloudify_logger(logger)
 
     def _add_context_to_template_variables(self, template_variables):
 
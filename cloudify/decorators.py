@@ -16,6 +16,7 @@
 
 import traceback
 import copy
+import logging
 import sys
 import Queue
 from threading import Thread
@@ -23,11 +24,13 @@ from StringIO import StringIO
 from functools import wraps
 
 from cloudify import context
+from cloudify import logs
 from cloudify.workflows.workflow_context import (
     CloudifyWorkflowContext,
     CloudifySystemWideWorkflowContext)
 from cloudify.manager import update_execution_status, get_rest_client
 from cloudify.workflows import api
+from cloudify.workflows import events
 from cloudify_rest_client.executions import Execution
 from cloudify import exceptions
 from cloudify.state import current_ctx, current_workflow_ctx
@@ -38,6 +41,7 @@ def _stub_task(fn):
 try:
     from cloudify_agent.app import app as _app
     _task = _app.task
+    events.connect_routed_task_events(_app)
 except ImportError as e:
     _app = None
     _task = _stub_task
@@ -166,11 +170,15 @@ def operation(func=None, **arguments):
 
             finally:
                 current_ctx.clear()
-                if ctx.type == context.NODE_INSTANCE:
-                    ctx.instance.update()
-                elif ctx.type == context.RELATIONSHIP_INSTANCE:
-                    ctx.source.instance.update()
-                    ctx.target.instance.update()
+                try:
+                    if ctx.type == context.NODE_INSTANCE:
+                        ctx.instance.update()
+                    elif ctx.type == context.RELATIONSHIP_INSTANCE:
+                        ctx.source.instance.update()
+                        ctx.target.instance.update()
+                finally:
+                    ctx._release_logger()
+                    _flush_amqp_out()
             if ctx.operation._operation_retry:
                 raise ctx.operation._operation_retry
             return result
@@ -181,6 +189,18 @@ def operation(func=None, **arguments):
         return partial_wrapper
 
 
+def _flush_amqp_out():
+    """
+    Wait for the logs and events of an ending operation or workflow, so its
+    result is not held back for long when the broker is not reachable.
+    """
+    if not logs.flush_amqp_out(timeout=logs.END_FLUSH_TIMEOUT):
+        logging.getLogger('cloudify_events').warning(
+            'Not all logs and events were published to RabbitMQ after {0} '
+            'seconds, they are published in the background'
+            .format(logs.END_FLUSH_TIMEOUT))
+
+
 def workflow(func=None, system_wide=False, **arguments):
     """
     Decorate workflow functions with this decorator.
@@ -231,7 +251,11 @@ def workflow(func=None, system_wide=False, **arguments):
             else:
                 workflow_wrapper = _remote_workflow
 
-            return workflow_wrapper(ctx, func, args, kwargs)
+            try:
+                return workflow_wrapper(ctx, func, args, kwargs)
+            finally:
+                ctx.internal.release_loggers()
+                _flush_amqp_out()
         return _process_wrapper(wrapper, arguments)
     else:
         def partial_wrapper(fn):
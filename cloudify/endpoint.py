@@ -13,8 +13,13 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
+import copy
+
 import jinja2
+from cloudify_rest_client.exceptions import CloudifyClientError
+from cloudify_rest_client.nodes import Node
 
+from cloudify import constants
 from cloudify import manager
 from cloudify import logs
 from cloudify.logs import CloudifyPluginLoggingHandler
@@ -29,12 +34,36 @@ class Endpoint(object):
     def get_node(self, node_id):
         raise NotImplementedError('Implemented by subclasses')
 
+    def _get_prefetched_node(self, node_id):
+        """
+        The node prefetched by the workflow for the operation (see
+        ``CloudifyWorkflowContext._prefetched_nodes``), None if it was not
+        prefetched.
+        """
+        nodes = self.ctx._context.get(constants.PREFETCHED_NODES_CONTEXT_KEY)
+        if not nodes or node_id not in nodes:
+            return None
+        # a copy, as nodes fetched from storage are copies too
+        return Node(copy.deepcopy(nodes[node_id]))
+
     def get_node_instance(self, node_instance_id):
         raise NotImplementedError('Implemented by subclasses')
 
     def update_node_instance(self, node_instance):
+        """
+        Store the node instance changes.
+
+        :return: the node instance version after the update
+        """
         raise NotImplementedError('Implemented by subclasses')
 
+    def is_version_conflict(self, error):
+        """
+        Whether ``error``, raised by ``update_node_instance``, means the
+        stored node instance version is not the updated instance version.
+        """
+        return False
+
     def get_blueprint_resource(self,
                                blueprint_id,
                                resource_path,
@@ -141,6 +170,9 @@ class ManagerEndpoint(Endpoint):
         super(ManagerEndpoint, self).__init__(ctx)
 
     def get_node(self, node_id):
+        node = self._get_prefetched_node(node_id)
+        if node is not None:
+            return node
         client = manager.get_rest_client()
         return client.nodes.get(self.ctx.deployment.id, node_id)
 
@@ -148,7 +180,12 @@ class ManagerEndpoint(Endpoint):
         return manager.get_node_instance(node_instance_id)
 
     def update_node_instance(self, node_instance):
-        return manager.update_node_instance(node_instance)
+        # the REST API replaces the runtime properties as a whole
+        return manager.update_node_instance(node_instance).version
+
+    def is_version_conflict(self, error):
+        return (isinstance(error, CloudifyClientError) and
+                error.status_code == 409)
 
     def get_blueprint_resource(self,
                                blueprint_id,
@@ -209,11 +246,16 @@ class ManagerEndpoint(Endpoint):
 
 class LocalEndpoint(Endpoint):
 
-    def __init__(self, ctx, storage):
+    def __init__(self, ctx, storage, event_sink=None):
         super(LocalEndpoint, self).__init__(ctx)
         self.storage = storage
+        self.event_sink = event_sink
+        self._log_out, self._event_out = logs.local_out_funcs(event_sink)
 
     def get_node(self, node_id):
+        node = self._get_prefetched_node(node_id)
+        if node is not None:
+            return node
         return self.storage.get_node(node_id)
 
     def get_node_instance(self, node_instance_id):
@@ -228,11 +270,25 @@ class LocalEndpoint(Endpoint):
             relationships=instance.relationships)
 
     def update_node_instance(self, node_instance):
-        return self.storage.update_node_instance(
+        patch_node_instance = getattr(self.storage, 'patch_node_instance',
+                                      None)
+        if patch_node_instance is None:
+            return self.storage.update_node_instance(
+                node_instance.id,
+                runtime_properties=node_instance.runtime_properties,
+                state=None,
+                version=node_instance.version).version
+        # only the changed runtime properties are sent
+        changed, deleted = node_instance.runtime_properties.changes
+        return patch_node_instance(
             node_instance.id,
-            runtime_properties=node_instance.runtime_properties,
-            state=None,
-            version=node_instance.version)
+            version=node_instance.version,
+            changed_runtime_properties=changed,
+            deleted_runtime_properties=deleted).version
+
+    def is_version_conflict(self, error):
+        from cloudify.workflows.local import StorageConflictError
+        return isinstance(error, StorageConflictError)
 
     def get_blueprint_resource(self,
                                blueprint_id,
@@ -264,7 +320,7 @@ class LocalEndpoint(Endpoint):
 
     def get_logging_handler(self):
         return CloudifyPluginLoggingHandler(self.ctx,
-                                            out_func=logs.stdout_log_out)
+                                            out_func=self._log_out)
 
     def send_plugin_event(self,
                           message=None,
@@ -274,7 +330,7 @@ class LocalEndpoint(Endpoint):
                                message,
                                args,
                                additional_context,
-                               out_func=logs.stdout_event_out)
+                               out_func=self._event_out)
 
     def evaluate_functions(self, payload):
         def evaluate_functions_method(deployment_id, context, payload):
@@ -16,19 +16,40 @@
 
 import sys
 import time
+import atexit
 import threading
 import logging
 import json
-import datetime
+import weakref
 
 from cloudify.amqp_client import create_client
+from cloudify.amqp_publisher import BufferedPublisher
 from cloudify.event import Event
 from cloudify import broker_config
+from cloudify import serialization
 
 EVENT_CLASS = Event
 
-# A thread local for storing a separate amqp client for each thread
-clients = threading.local()
+# The process wide publisher of logs and events to RabbitMQ
+_publisher = None
+_publisher_lock = threading.Lock()
+# Seconds to wait for pending logs and events when the process exits
+EXIT_FLUSH_TIMEOUT = 10
+# Seconds an operation or a workflow waits for its pending logs and events
+# when it ends
+END_FLUSH_TIMEOUT = 10
+
+# Message contexts built once per context object, copied for every event
+_message_context_templates = weakref.WeakKeyDictionary()
+
+# Execution/operation context keys configuring cloudify loggers
+LOGGING_LEVEL_CONTEXT_KEY = 'logging_level'
+LOGGING_RATE_LIMIT_CONTEXT_KEY = 'logging_rate_limit'
+LOGGING_RATE_LIMIT_BURST_CONTEXT_KEY = 'logging_rate_limit_burst'
+LOGGING_CONTEXT_KEYS = (LOGGING_LEVEL_CONTEXT_KEY,
+                        LOGGING_RATE_LIMIT_CONTEXT_KEY,
+                        LOGGING_RATE_LIMIT_BURST_CONTEXT_KEY)
+DEFAULT_LOGGING_LEVEL = logging.INFO
 
 
 def message_context_from_cloudify_context(ctx):
@@ -59,6 +80,14 @@ def message_context_from_cloudify_context(ctx):
     return context
 
 
+def message_context_from_task_context(cloudify_context):
+    """Build a message context from a __cloudify_context struct"""
+    # import here to avoid cyclic dependencies
+    from cloudify.context import CloudifyContext
+    return message_context_from_cloudify_context(
+        CloudifyContext(cloudify_context))
+
+
 def message_context_from_workflow_context(ctx):
     """Build a message context from a CloudifyWorkflowContext instance"""
     return {
@@ -89,6 +118,71 @@ def message_context_from_workflow_node_instance_context(ctx):
     return message_context
 
 
+def parse_logging_level(level):
+    """
+    Convert a logging level given by name (e.g. 'debug') or number to
+    a logging level number.
+
+    :param level: the level name or number (None for the default level)
+    :return: the logging level number
+    """
+    if level is None:
+        return DEFAULT_LOGGING_LEVEL
+    if isinstance(level, basestring):
+        number = logging.getLevelName(level.upper())
+        if not isinstance(number, int):
+            raise ValueError('Invalid logging level: {0}'.format(level))
+        return number
+    return int(level)
+
+
+def logger_settings(context):
+    """
+    Read the logging settings of an execution/operation context.
+
+    :param context: the execution context or __cloudify_context dict
+    :return: keyword arguments for ``init_cloudify_logger``
+    """
+    return {
+        'logging_level': parse_logging_level(
+            context.get(LOGGING_LEVEL_CONTEXT_KEY)),
+        'rate_limit': context.get(LOGGING_RATE_LIMIT_CONTEXT_KEY),
+        'rate_limit_burst': context.get(LOGGING_RATE_LIMIT_BURST_CONTEXT_KEY)
+    }
+
+
+class LogRateLimiter(object):
+    """
+    A token bucket: tokens are added at ``rate`` tokens per second, up to
+    ``burst`` tokens, and every message takes one token.
+
+    :param rate: messages allowed per second on average
+    :param burst: messages allowed at once (default: ``rate``)
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self._tokens = self.burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        :return: True if a message may be sent, False if it should be
+                 suppressed
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
 class CloudifyBaseLoggingHandler(logging.Handler):
     """A base handler class for writing log messages to RabbitMQ"""
 
@@ -103,16 +197,41 @@ class CloudifyBaseLoggingHandler(logging.Handler):
             out_func = amqp_log_out
 
         self.out_func = out_func
+        # set by init_cloudify_logger when rate limiting is configured
+        self.rate_limiter = None
+        self.suppressed = 0
+        self._suppressed_logger = None
 
     def flush(self):
-        pass
+        self.acquire()
+        try:
+            self._send_suppressed()
+        finally:
+            self.release()
 
     def emit(self, record):
-        message = self.format(record)
+        if self.rate_limiter is not None:
+            if not self.rate_limiter.acquire():
+                self.suppressed += 1
+                self._suppressed_logger = record.name
+                return
+            self._send_suppressed()
+        self._send(record.name, record.levelname.lower(), self.format(record))
+
+    def _send_suppressed(self):
+        if not self.suppressed:
+            return
+        suppressed, self.suppressed = self.suppressed, 0
+        self._send(self._suppressed_logger, 'warning',
+                   '{0} log messages suppressed (more than {1} messages '
+                   'per second)'.format(suppressed,
+                                        self.rate_limiter.rate))
+
+    def _send(self, logger_name, level, message):
         log = {
             'context': self.context,
-            'logger': record.name,
-            'level': record.levelname.lower(),
+            'logger': logger_name,
+            'level': level,
             'message': {
                 'text': message
             }
@@ -151,29 +270,58 @@ class CloudifyWorkflowNodeLoggingHandler(CloudifyBaseLoggingHandler):
 
 
 def init_cloudify_logger(handler, logger_name,
-                         logging_level=logging.INFO):
+                         logging_level=DEFAULT_LOGGING_LEVEL,
+                         rate_limit=None,
+                         rate_limit_burst=None):
     """
     Instantiate an amqp backed logger based on the provided handler
     for sending log messages to RabbitMQ
 
+    The logger is not registered in the logging module (i.e. it is not
+    returned by ``logging.getLogger(logger_name)``), so it does not outlive
+    the context it was created for. Its records still propagate to the root
+    logger handlers. Call ``release_cloudify_logger`` once the context is
+    done with it.
+
     :param handler: A logger handler based on the context
     :param logger_name: The logger name
-    :param logging_level: The logging level
+    :param logging_level: The logging level (number or name)
+    :param rate_limit: Maximum messages per second sent by the logger,
+                       messages above the limit are suppressed and counted
+                       in a summary message (default: no limit)
+    :param rate_limit_burst: Maximum messages sent at once when rate
+                             limiting (default: rate_limit)
     :return: An amqp backed logger
     """
 
-    # TODO: somehow inject logging level (no one currently passes
-    # logging_level)
-    logger = logging.getLogger(logger_name)
-    logger.setLevel(logging_level)
-    for h in logger.handlers:
-        logger.removeHandler(h)
+    logger = logging.getLoggerClass()(logger_name)
+    logger.parent = logging.root
+    logger.setLevel(parse_logging_level(logging_level))
     handler.setFormatter(logging.Formatter("%(message)s"))
+    if rate_limit and isinstance(handler, CloudifyBaseLoggingHandler):
+        handler.rate_limiter = LogRateLimiter(rate_limit, rate_limit_burst)
     logger.propagate = True
     logger.addHandler(handler)
     return logger
 
 
+def release_cloudify_logger(logger):
+    """
+    Flush and close the handlers of a logger created by
+    ``init_cloudify_logger``, dropping their references to the context.
+
+    :param logger: the logger to release (None is ignored)
+    """
+    if logger is None:
+        return
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        try:
+            handler.flush()
+        finally:
+            handler.close()
+
+
 def send_workflow_event(ctx, event_type,
                         message=None,
                         args=None,
@@ -243,7 +391,8 @@ def send_task_event(cloudify_context,
                     message=None,
                     args=None,
                     additional_context=None,
-                    out_func=None):
+                    out_func=None,
+                    message_context=None):
     """Send a task event to RabbitMQ
 
     :param cloudify_context: a __cloudify_context struct as passed to
@@ -252,36 +401,55 @@ def send_task_event(cloudify_context,
     :param message: The message
     :param args: additional arguments that may be added to the message
     :param additional_context: additional context to be added to the context
+    :param message_context: the task message context, if already built
+                            (see ``message_context_from_task_context``)
     """
-    # import here to avoid cyclic dependencies
-    from cloudify.context import CloudifyContext
-    _send_event(CloudifyContext(cloudify_context),
-                'task', event_type, message, args,
+    if message_context is None:
+        message_context = message_context_from_task_context(
+            cloudify_context)
+    _send_event(None, 'task', event_type, message, args,
                 additional_context,
-                out_func)
+                out_func,
+                message_context=message_context)
+
+
+_message_context_builders = {
+    'plugin': message_context_from_cloudify_context,
+    'workflow': message_context_from_workflow_context,
+    'workflow_node': message_context_from_workflow_node_instance_context,
+    'system_wide_workflow': message_context_from_sys_wide_wf_context
+}
+
+
+def _cached_message_context(ctx, context_type):
+    try:
+        builder = _message_context_builders[context_type]
+    except KeyError:
+        raise RuntimeError('Invalid context_type: {0}'.format(context_type))
+    try:
+        template = _message_context_templates.get(ctx)
+    except TypeError:
+        # ctx can not be weakly referenced
+        return builder(ctx)
+    if template is None:
+        template = builder(ctx)
+        _message_context_templates[ctx] = template
+    return dict(template)
 
 
 def _send_event(ctx, context_type, event_type,
                 message, args, additional_context,
-                out_func):
-    if _is_system_workflow(ctx):
+                out_func, message_context=None):
+    if message_context is None:
+        message_context = _cached_message_context(ctx, context_type)
+    else:
+        message_context = dict(message_context)
+
+    if _is_system_workflow_id(message_context['workflow_id']):
         out_func = stdout_event_out
     elif out_func is None:
         out_func = amqp_event_out
 
-    if context_type in ['plugin', 'task']:
-        message_context = message_context_from_cloudify_context(
-            ctx)
-    elif context_type == 'workflow':
-        message_context = message_context_from_workflow_context(ctx)
-    elif context_type == 'workflow_node':
-        message_context = message_context_from_workflow_node_instance_context(
-            ctx)
-    elif context_type == 'system_wide_workflow':
-        message_context = message_context_from_sys_wide_wf_context(ctx)
-    else:
-        raise RuntimeError('Invalid context_type: {0}'.format(context_type))
-
     additional_context = additional_context or {}
     message_context.update(additional_context)
 
@@ -298,9 +466,7 @@ def _send_event(ctx, context_type, event_type,
 
 
 def populate_base_item(item, message_type):
-    timezone = time.strftime("%z", time.gmtime())
-    timestamp = str(datetime.datetime.now())[0:-3] + timezone
-    item['timestamp'] = timestamp
+    item['timestamp'] = serialization.format_timestamp()
     item['message_code'] = None
     item['type'] = message_type
 
@@ -308,7 +474,7 @@ def populate_base_item(item, message_type):
 def amqp_event_out(event, ctx):
     try:
         populate_base_item(event, 'cloudify_event')
-        _amqp_client(ctx).publish_event(event)
+        _amqp_publisher().publish_event(event)
     except BaseException as e:
         error_logger = logging.getLogger('cloudify_events')
         error_logger.warning('Error publishing event to RabbitMQ ['
@@ -319,7 +485,7 @@ def amqp_event_out(event, ctx):
 def amqp_log_out(log, ctx):
     try:
         populate_base_item(log, 'cloudify_log')
-        _amqp_client(ctx).publish_log(log)
+        _amqp_publisher().publish_log(log)
     except BaseException as e:
         error_logger = logging.getLogger('cloudify_celery')
         error_logger.warning('Error publishing log to RabbitMQ ['
@@ -341,6 +507,20 @@ def stdout_log_out(log, ctx=None):
     sys.stdout.write('{0}\n'.format(create_event_message_prefix(log)))
 
 
+def local_out_funcs(event_sink=None):
+    """
+    The log and event output functions of local executions.
+
+    :param event_sink: the event sink of the execution (see
+                       ``cloudify.workflows.local.JsonLinesEventSink``),
+                       None to print logs and events to stdout
+    :return: a (log output function, event output function) tuple
+    """
+    if event_sink is not None:
+        return event_sink.log_out, event_sink.event_out
+    return stdout_log_out, stdout_event_out
+
+
 def create_event_message_prefix(event):
     return str(EVENT_CLASS(event))
 
@@ -352,26 +532,68 @@ def _is_system_workflow(ctx):
     # depending on the context of the log/event
     workflow_id = ctx.workflow_id if hasattr(ctx, 'workflow_id') \
         else ctx.ctx.workflow_id
+    return _is_system_workflow_id(workflow_id)
+
+
+def _is_system_workflow_id(workflow_id):
     return workflow_id in (
         '_start_deployment_environment', '_stop_deployment_environment')
 
 
-def _amqp_client(ctx):
+def _amqp_client():
+    """
+    Create an AMQPClient using the broker configuration (credentials, SSL
+    and compression settings).
+
+    :return: A new AMQPClient. Only the process wide publisher's thread
+             creates and uses it, so the process holds a single broker
+             connection regardless of the number of logging threads.
     """
-    Get an AMQPClient for the current thread. If non currently exists,
-    create one.
+    return create_client(
+        amqp_host=broker_config.broker_hostname,
+        amqp_user=broker_config.broker_username,
+        amqp_pass=broker_config.broker_password,
+        ssl_enabled=broker_config.broker_ssl_enabled,
+        ssl_cert_path=broker_config.broker_cert_path,
+        compress_threshold=broker_config.broker_compress_threshold)
+
 
-    :param ctx: The context, used to get AMQP credentials and SSL settings.
+def _amqp_publisher():
+    """
+    Get the process wide BufferedPublisher. If non currently exists,
+    create one. Its messages are published by a background thread over a
+    single AMQPClient which is recreated when publishing fails.
+    """
+    global _publisher
+    if _publisher is None:
+        with _publisher_lock:
+            if _publisher is None:
+                _publisher = BufferedPublisher(
+                    client_factory=_amqp_client,
+                    buffer_size=broker_config.publisher_buffer_size,
+                    batch_size=broker_config.publisher_batch_size,
+                    flush_interval=broker_config.publisher_flush_interval,
+                    full_policy=broker_config.publisher_full_policy,
+                    spill_path=broker_config.publisher_spill_path,
+                    publish_retries=broker_config.publisher_publish_retries,
+                    reconnect_interval=(
+                        broker_config.publisher_reconnect_interval),
+                    spool_directory=broker_config.publisher_spool_directory,
+                    spool_segment_size=(
+                        broker_config.publisher_spool_segment_size))
+                atexit.register(_publisher.close, EXIT_FLUSH_TIMEOUT)
+    return _publisher
+
+
+def flush_amqp_out(timeout=None):
+    """
+    Wait until all logs and events written by ``amqp_log_out`` and
+    ``amqp_event_out`` so far were published to RabbitMQ.
+    Called when an operation or a workflow ends.
 
-    :return: An AMQPClient belonging to the current thread.
-             Will return a pre-existing one without re-initialising even if
-             called with new arguments a second or subsequent time.
+    :param timeout: maximum seconds to wait (default: no limit)
+    :return: True if everything was published, False on timeout
     """
-    if not hasattr(clients, 'amqp_client'):
-        clients.amqp_client = create_client(
-            amqp_host=broker_config.broker_hostname,
-            amqp_user=broker_config.broker_username,
-            amqp_pass=broker_config.broker_password,
-            ssl_enabled=broker_config.broker_ssl_enabled,
-            ssl_cert_path=broker_config.broker_cert_path)
-    return clients.amqp_client
+    if _publisher is None:
+        return True
+    return _publisher.flush(timeout)
@@ -94,6 +94,15 @@ class NodeInstance(object):
     def dirty(self):
         return self._runtime_properties.dirty
 
+    def set_updated(self, version):
+        """
+        Mark the node instance changes as stored in Cloudify's storage.
+
+        :param version: the node instance version after the update
+        """
+        self._version = version
+        self._runtime_properties.reset_changes()
+
     @property
     def host_id(self):
         return self._host_id
@@ -214,9 +223,10 @@ def update_node_instance(node_instance):
     Update node instance data changes in the storage.
 
     :param node_instance: the node instance with the updated data
+    :return: the updated node instance (rest client response model)
     """
     client = get_rest_client()
-    client.node_instances.update(
+    return client.node_instances.update(
         node_instance.id,
         state=node_instance.state,
         runtime_properties=node_instance.runtime_properties,
@@ -273,45 +283,127 @@ def get_provider_context():
 
 
 class DirtyTrackingDict(dict):
+    """
+    A dict recording whether it was changed (``dirty``) and which keys were
+    changed or deleted (``changes``), so only those are sent on updates.
+
+    Mutable values (dicts, lists, sets) read from the dict may be changed
+    in place, so their keys count as changed once read.
+    """
 
     def __init__(self, *args, **kwargs):
         super(DirtyTrackingDict, self).__init__(*args, **kwargs)
         self.modifiable = True
         self.dirty = False
+        self._changed_keys = set()
+        self._deleted_keys = set()
+
+    def __getitem__(self, key):
+        value = super(DirtyTrackingDict, self).__getitem__(key)
+        self._value_read(key, value)
+        return value
+
+    def get(self, key, d=None):
+        value = super(DirtyTrackingDict, self).get(key, d)
+        if key in self:
+            self._value_read(key, value)
+        return value
+
+    def setdefault(self, key, d=None):
+        if key not in self:
+            self[key] = d
+        return self[key]
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def copy(self):
+        return dict(self.items())
 
     def __setitem__(self, key, value):
         r = super(DirtyTrackingDict, self).__setitem__(key, value)
-        self._set_changed()
+        self._set_changed(changed=[key])
         return r
 
     def __delitem__(self, key):
         r = super(DirtyTrackingDict, self).__delitem__(key)
-        self._set_changed()
+        self._set_changed(deleted=[key])
         return r
 
     def update(self, E=None, **F):
-        r = super(DirtyTrackingDict, self).update(E, **F)
-        self._set_changed()
+        keys = []
+        if E is not None:
+            if hasattr(E, 'keys'):
+                keys.extend(E.keys())
+            else:
+                E = list(E)
+                keys.extend(key for key, _ in E)
+            r = super(DirtyTrackingDict, self).update(E, **F)
+        else:
+            r = super(DirtyTrackingDict, self).update(**F)
+        keys.extend(F.keys())
+        self._set_changed(changed=keys)
         return r
 
     def clear(self):
+        keys = self.keys()
         r = super(DirtyTrackingDict, self).clear()
-        self._set_changed()
+        self._set_changed(deleted=keys)
         return r
 
     def pop(self, k, d=None):
+        existed = k in self
         r = super(DirtyTrackingDict, self).pop(k, d)
-        self._set_changed()
+        self._set_changed(deleted=[k] if existed else [])
         return r
 
     def popitem(self):
         r = super(DirtyTrackingDict, self).popitem()
-        self._set_changed()
+        self._set_changed(deleted=[r[0]])
         return r
 
-    def _set_changed(self):
+    @property
+    def changes(self):
+        """
+        The changes since the dict was created or ``reset_changes`` was
+        called.
+
+        :return: a (changed values by key, deleted keys) tuple
+        """
+        changed = dict(
+            (key, super(DirtyTrackingDict, self).__getitem__(key))
+            for key in self._changed_keys if key in self)
+        return changed, list(self._deleted_keys)
+
+    def reset_changes(self):
+        """Mark the dict as unchanged (e.g. after its changes are stored)"""
+        self.dirty = False
+        self._changed_keys = set()
+        self._deleted_keys = set()
+
+    def _value_read(self, key, value):
+        # python 2.6 doesn't have the attributes during copy.deepcopy
+        if isinstance(value, (dict, list, set)) and \
+                hasattr(self, '_changed_keys'):
+            self._changed_keys.add(key)
+
+    def _set_changed(self, changed=(), deleted=()):
         # python 2.6 doesn't have modifiable during copy.deepcopy
         if hasattr(self, 'modifiable') and not self.modifiable:
             raise NonRecoverableError('Cannot modify runtime properties of'
                                       ' relationship node instances')
         self.dirty = True
+        if hasattr(self, '_changed_keys'):
+            self._changed_keys.update(changed)
+            self._changed_keys.difference_update(deleted)
+            self._deleted_keys.update(deleted)
+            self._deleted_keys.difference_update(changed)
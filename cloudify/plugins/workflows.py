@@ -252,7 +252,7 @@ def install_new_agents(ctx, install_agent_timeout, node_ids,
             host.send_event('New agent installed.'),
             *lifecycle.prepare_running_agent(host)
         )
-        for subnode in host.get_contained_subgraph():
+        for subnode in host.get_contained_subgraph_list():
             seq.add(subnode.execute_operation(
                 'cloudify.interfaces.monitoring.start'))
     graph.execute()
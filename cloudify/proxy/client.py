@@ -15,26 +15,45 @@
 #  * limitations under the License.
 
 import os
+import re
 import urllib2
 import json
 import argparse
+import shlex
+import socket
 import sys
 
 
 # Environment variable for the socket url
-# (used by clients to locate the socket [http, zmq(unix, tcp)])
+# (used by clients to locate the socket [http, zmq(unix, tcp), unix])
 CTX_SOCKET_URL = 'CTX_SOCKET_URL'
 
+# Environment variables for the ctx snapshot files written by the proxy
+# (see CtxProxy.write_snapshot): requests reading data of the JSON snapshot
+# are answered without a round trip to the proxy, the shell snapshot may be
+# sourced by scripts
+CTX_SNAPSHOT = 'CTX_SNAPSHOT'
+CTX_SNAPSHOT_SH = 'CTX_SNAPSHOT_SH'
+
+# Snapshot entries holding dicts accessed by path (see PathDictAccess)
+SNAPSHOT_DICT_KEYS = ('properties',)
+
+# Request type carrying a list of args vectors (see CtxProxy.process)
+BATCH_REQUEST_TYPE = 'batch'
+
 
 class RequestError(RuntimeError):
 
-    def __init__(self, ex_message, ex_type, ex_traceback):
+    def __init__(self, ex_message, ex_type, ex_traceback, results=None):
         super(RequestError, self).__init__(
             self,
             '{0}: {1}'.format(ex_type, ex_message))
         self.ex_type = ex_type
         self.ex_message = ex_message
         self.ex_traceback = ex_traceback
+        # for batch requests, the results of the requests processed before
+        # the failed one
+        self.results = results
 
 
 def zmq_client_req(socket_url, request, timeout):
@@ -62,16 +81,44 @@ def http_client_req(socket_url, request, timeout):
     return json.loads(response.read())
 
 
-def client_req(socket_url, args, timeout=5):
+def unix_client_req(socket_url, request, timeout):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_url[len('unix://'):])
+        sock.sendall('{0}\n'.format(json.dumps(request)))
+        response = sock.makefile().readline()
+    finally:
+        sock.close()
+    if not response:
+        raise RuntimeError('Connection closed while waiting for response')
+    return json.loads(response)
+
+
+def client_req(socket_url, args, timeout=5, batch=False):
+    """
+    Send a request to a ctx proxy.
+
+    :param socket_url: the ctx proxy socket url
+    :param args: the request args, or a list of args vectors if batch
+    :param timeout: seconds to wait for the response
+    :param batch: process a list of requests in a single round trip
+    :return: the request result, or the list of the requests results if
+             batch
+    """
     request = {
         'args': args
     }
+    if batch:
+        request['type'] = BATCH_REQUEST_TYPE
 
     schema, _ = socket_url.split('://')
     if schema in ['ipc', 'tcp']:
         request_method = zmq_client_req
     elif schema in ['http']:
         request_method = http_client_req
+    elif schema in ['unix']:
+        request_method = unix_client_req
     else:
         raise RuntimeError('Unsupported protocol: {0}'.format(schema))
 
@@ -83,17 +130,91 @@ def client_req(socket_url, args, timeout=5):
         ex_traceback = payload['traceback']
         raise RequestError(ex_message,
                            ex_type,
-                           ex_traceback)
+                           ex_traceback,
+                           payload.get('results'))
     else:
         return payload
 
 
+def load_snapshot(path):
+    """Load a ctx snapshot file, None if it is missing or invalid"""
+    if not path:
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def lookup_snapshot(snapshot, args):
+    """
+    Answer a request reading data of a ctx snapshot.
+
+    :param snapshot: the snapshot (see ``load_snapshot``), may be None
+    :param args: the request args
+    :return: a (found, value) tuple, found being False for requests which
+             have to be sent to the proxy (e.g. updates, runtime properties
+             and data missing from the snapshot)
+    """
+    if not snapshot or not args:
+        return False, None
+    current = snapshot
+    for index, arg in enumerate(args):
+        if not isinstance(current, dict) or not isinstance(arg, basestring):
+            return False, None
+        key = arg if arg in current else arg.replace('-', '_')
+        if key not in current:
+            return False, None
+        current = current[key]
+        if key in SNAPSHOT_DICT_KEYS:
+            remaining_args = args[index + 1:]
+            if not remaining_args:
+                return True, current
+            if len(remaining_args) == 1:
+                return _lookup_snapshot_path(current, remaining_args[0])
+            return False, None
+    if isinstance(current, dict):
+        # objects are not returned by the proxy as they are
+        return False, None
+    return True, current
+
+
+_path_index_pattern = re.compile('(.+)\[(\d+)\]')
+
+
+def _lookup_snapshot_path(obj, path):
+    if not isinstance(path, basestring):
+        return False, None
+    current = obj
+    for segment in path.split('.'):
+        if not isinstance(current, dict):
+            return False, None
+        match = _path_index_pattern.match(segment)
+        if match:
+            name, index = match.group(1), int(match.group(2))
+            value = current.get(name)
+            if not isinstance(value, list) or index >= len(value):
+                return False, None
+            current = value[index]
+        elif segment in current:
+            current = current[segment]
+        else:
+            return False, None
+    return True, current
+
+
 def parse_args(args=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('-t', '--timeout', type=int, default=30)
     parser.add_argument('--socket-url', default=os.environ.get(CTX_SOCKET_URL))
+    parser.add_argument('--snapshot', default=os.environ.get(CTX_SNAPSHOT))
     parser.add_argument('--json-arg-prefix', default='@')
     parser.add_argument('-j', '--json-output', action='store_true')
+    parser.add_argument('--batch', action='store_true',
+                        help='Read commands from stdin, one per line (with '
+                             'shell like quoting), send them in a single '
+                             'request and write one result per line')
     parser.add_argument('args', nargs='*')
     args = parser.parse_args(args)
     if not args.socket_url:
@@ -111,19 +232,74 @@ def process_args(json_prefix, args):
     return processed_args
 
 
+def read_batch_args(json_prefix, lines):
+    batch_args = []
+    for line in lines:
+        line_args = shlex.split(line, comments=True)
+        if line_args:
+            batch_args.append(process_args(json_prefix, line_args))
+    return batch_args
+
+
+def format_response(response, json_output):
+    if json_output:
+        return json.dumps(response)
+    if not response:
+        return ''
+    return str(response)
+
+
 def main(args=None):
     args = parse_args(args)
-    response = client_req(args.socket_url,
-                          process_args(args.json_arg_prefix,
-                                       args.args),
-                          args.timeout)
-    if args.json_output:
-        response = json.dumps(response)
-    else:
-        if not response:
-            response = ''
-        response = str(response)
-    sys.stdout.write(response)
+    if args.batch:
+        return batch_main(args)
+    request_args = process_args(args.json_arg_prefix, args.args)
+    found, response = lookup_snapshot(load_snapshot(args.snapshot),
+                                      request_args)
+    if not found:
+        response = client_req(args.socket_url,
+                              request_args,
+                              args.timeout)
+    sys.stdout.write(format_response(response, args.json_output))
+
+
+def batch_main(args):
+    batch_args = read_batch_args(args.json_arg_prefix, sys.stdin)
+    snapshot = load_snapshot(args.snapshot)
+    local_responses = [lookup_snapshot(snapshot, request_args)
+                       for request_args in batch_args]
+    remote_args = [request_args for request_args, (found, _)
+                   in zip(batch_args, local_responses) if not found]
+    error = None
+    remote_responses = []
+    if remote_args:
+        try:
+            remote_responses = client_req(args.socket_url,
+                                          remote_args,
+                                          args.timeout,
+                                          batch=True)
+        except RequestError as e:
+            error = e
+            remote_responses = e.results or []
+    # merge the responses in the commands order, up to the failed command
+    responses = []
+    remote_responses = iter(remote_responses)
+    for found, response in local_responses:
+        if not found:
+            try:
+                response = next(remote_responses)
+            except StopIteration:
+                break
+        responses.append(response)
+    write_batch_responses(responses, args.json_output)
+    if error:
+        raise error
+
+
+def write_batch_responses(responses, json_output):
+    for response in responses:
+        sys.stdout.write('{0}\n'.format(
+            format_response(response, json_output)))
 
 
 if __name__ == '__main__':
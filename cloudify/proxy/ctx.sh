@@ -0,0 +1,111 @@
+#########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#  * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  * See the License for the specific language governing permissions and
+#  * limitations under the License.
+
+# Bash helpers for the newline delimited JSON ctx proxy
+# (cloudify.proxy.server.LineCtxProxy, CTX_SOCKET_URL=unix://<path>).
+#
+# Usage:
+#
+#   source ctx.sh
+#   ctx_connect
+#   port=$(ctx_call node properties port)
+#   ctx_call instance runtime-properties ip "${ip}"
+#   ctx_call logger info '@"a json string argument"'
+#
+# Arguments are the same as those of the ctx command (arguments prefixed
+# with @ are passed as JSON). ctx_connect opens a connection to the proxy
+# with socat, which is kept open (as a coprocess) and used by the
+# following calls, including calls made in subshells, so no process is
+# started per call. Calls made before ctx_connect open a connection
+# themselves.
+
+# Set CTX_ARGS_JSON to the JSON array of the given ctx arguments
+# (without subshells, as they are comparatively slow)
+_ctx_args_json() {
+    local arg s c code hex separator=''
+    CTX_ARGS_JSON='['
+    for arg in "$@"; do
+        if [[ ${arg} == @* ]]; then
+            s=${arg:1}
+        else
+            s=${arg//\\/\\\\}
+            s=${s//\"/\\\"}
+            s=${s//$'\n'/\\n}
+            s=${s//$'\r'/\\r}
+            s=${s//$'\t'/\\t}
+            if [[ ${s} == *[[:cntrl:]]* ]]; then
+                # other control characters are only valid JSON as \u00XX
+                for code in {1..31}; do
+                    printf -v hex '%02x' "${code}"
+                    printf -v c "\\x${hex}"
+                    s=${s//"${c}"/\\u00${hex}}
+                done
+            fi
+            s="\"${s}\""
+        fi
+        CTX_ARGS_JSON+="${separator}${s}"
+        separator=', '
+    done
+    CTX_ARGS_JSON+=']'
+}
+
+# Open the connection to the ctx proxy (done by the first call)
+ctx_connect() {
+    local socket_path=${CTX_SOCKET_URL#unix://}
+    if [[ ${socket_path} == "${CTX_SOCKET_URL}" ]]; then
+        echo "ctx.sh: CTX_SOCKET_URL is not a unix:// url" >&2
+        return 1
+    fi
+    coproc CTX_PROXY { exec socat - "UNIX-CONNECT:${socket_path}"; }
+}
+
+# Close the connection to the ctx proxy
+ctx_disconnect() {
+    if [[ -n ${CTX_PROXY_PID} ]]; then
+        eval "exec ${CTX_PROXY[1]}>&-"
+        wait "${CTX_PROXY_PID}" 2>/dev/null
+    fi
+}
+
+# Run a ctx request and print its result as the ctx command does.
+# On error, print the error to stderr and return 1.
+ctx_call() {
+    local reply
+    if [[ -z ${CTX_PROXY_PID} ]]; then
+        ctx_connect || return 1
+    fi
+    _ctx_args_json "$@"
+    printf '{"format": "text", "args": %s}\n' "${CTX_ARGS_JSON}" \
+        >&"${CTX_PROXY[1]}"
+    IFS= read -r -d '' -u "${CTX_PROXY[0]}" reply
+    if [[ ${reply%%$'\t'*} == result ]]; then
+        printf '%s' "${reply#*$'\t'}"
+    else
+        printf 'ctx: %s\n' "${reply#*$'\t'}" >&2
+        return 1
+    fi
+}
+
+# Run a ctx request and print the JSON response line
+ctx_json() {
+    local reply
+    if [[ -z ${CTX_PROXY_PID} ]]; then
+        ctx_connect || return 1
+    fi
+    _ctx_args_json "$@"
+    printf '%s\n' "${CTX_ARGS_JSON}" >&"${CTX_PROXY[1]}"
+    IFS= read -r -u "${CTX_PROXY[0]}" reply
+    printf '%s\n' "${reply}"
+}
@@ -13,6 +13,8 @@
 #  * See the License for the specific language governing permissions and
 #  * limitations under the License.
 
+import atexit
+import os
 import traceback
 import tempfile
 import re
@@ -20,30 +22,162 @@ import collections
 import json
 import threading
 import socket
+import time
+import uuid
 from Queue import Queue
+from SocketServer import (ThreadingMixIn,
+                          ThreadingUnixStreamServer,
+                          StreamRequestHandler)
 from StringIO import StringIO
 from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
 from wsgiref.simple_server import make_server as make_wsgi_server
 
 import bottle
 
+from cloudify.proxy.client import (format_response,
+                                   CTX_SNAPSHOT,
+                                   CTX_SNAPSHOT_SH)
+
+
+# Request type carrying a list of args vectors, processed in order
+BATCH_REQUEST_TYPE = 'batch'
+
+# Number of threads processing requests of ZMQ proxies
+DEFAULT_WORKERS = 4
+# Number of recent request latencies kept for percentiles
+LATENCY_SAMPLES = 1000
+
+# Listen backlog of line proxies (pending connections of concurrent clients)
+LINE_PROXY_BACKLOG = 128
+
+# Maximum number of cached read request results of a proxy and of parsed
+# dict paths
+READ_CACHE_SIZE = 1000
+PARSED_PATHS_CACHE_SIZE = 1000
+# Request paths (leading args, '-' read as '_') of values not changing
+# during an operation, the only reads whose results are cached. Paths of
+# relationship operations are also matched after a 'source' or 'target'
+# arg.
+CACHEABLE_READ_PATHS = (('node',),
+                        ('instance', 'id'),
+                        ('deployment', 'id'),
+                        ('blueprint', 'id'),
+                        ('execution_id',),
+                        ('workflow_id',),
+                        ('task_id',),
+                        ('task_name',))
+
+# File names of the ctx snapshot files (see CtxProxy.write_snapshot)
+SNAPSHOT_FILE_NAME = 'ctx-snapshot.json'
+SNAPSHOT_SHELL_FILE_NAME = 'ctx-snapshot.sh'
+# Node attributes included in ctx snapshots
+SNAPSHOT_NODE_ATTRIBUTES = ('id', 'name', 'type', 'type_hierarchy',
+                            'properties')
+
+
+class RequestMetrics(object):
+    """Request count and latency (in seconds) of a ctx proxy"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self._latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_ended(self, latency, error=False):
+        with self._lock:
+            self.in_flight -= 1
+            self.requests += 1
+            if error:
+                self.errors += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self._latencies.append(latency)
+
+    @property
+    def mean_latency(self):
+        with self._lock:
+            if not self.requests:
+                return 0.0
+            return self.total_latency / self.requests
+
+    def latency_percentile(self, percentile):
+        """
+        :param percentile: a number between 0 and 100
+        :return: the latency percentile of the recent requests
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return 0.0
+        index = int(round(percentile / 100.0 * (len(latencies) - 1)))
+        return latencies[index]
+
 
 class CtxProxy(object):
+    """
+    Processes ctx requests sent by ``cloudify.proxy.client``.
+
+    Requests may be processed concurrently by the proxy server threads,
+    ``ctx`` is accessed by one request at a time.
+    """
 
     def __init__(self, ctx, socket_url):
         self.ctx = ctx
         self.socket_url = socket_url
+        self.metrics = RequestMetrics()
+        self._ctx_lock = threading.RLock()
+        self._snapshot_paths = []
+        self._snapshot_directory = None
+        # serialized results of read requests by their args (see
+        # _process_args)
+        self._read_cache = {}
 
     def process(self, request):
+        """
+        :param request: the JSON request, or the request already parsed
+        :return: the JSON response
+        """
+        start = time.time()
+        self.metrics.request_started()
+        error = True
+        try:
+            # results are serialized under the lock too, as they may
+            # reference ctx objects modified by other requests
+            with self._ctx_lock:
+                result, error = self._process(request)
+            return result
+        finally:
+            self.metrics.request_ended(time.time() - start, error=error)
+
+    def _process(self, request):
+        results = None
+        error = False
         try:
-            typed_request = json.loads(request)
+            if isinstance(request, basestring):
+                typed_request = json.loads(request)
+            else:
+                typed_request = request
             args = typed_request['args']
-            payload = process_ctx_request(self.ctx, args)
-            result = json.dumps({
-                'type': 'result',
-                'payload': payload
-            })
+            if typed_request.get('type') == BATCH_REQUEST_TYPE:
+                # processing stops on the first failed request, the results
+                # of the requests before it are returned with the error
+                results = []
+                for request_args in args:
+                    results.append(self._process_args(request_args))
+                payload = '[{0}]'.format(', '.join(results))
+            else:
+                payload = self._process_args(args)
+            result = '{{"type": "result", "payload": {0}}}'.format(payload)
         except Exception, e:
+            error = True
             tb = StringIO()
             traceback.print_exc(file=tb)
             payload = {
@@ -51,111 +185,358 @@ class CtxProxy(object):
                 'message': str(e),
                 'traceback': tb.getvalue()
             }
+            if results is not None:
+                payload['results'] = [json.loads(value) for value in results]
             result = json.dumps({
                 'type': 'error',
                 'payload': payload
             })
+        return result, error
+
+    def _process_args(self, args):
+        """
+        Process the args of a request.
+
+        Results of requests reading values which do not change during an
+        operation (see ``CACHEABLE_READ_PATHS``) are cached.
+
+        :return: the serialized result
+        """
+        key = _read_cache_key(args)
+        if key is not None:
+            cached = self._read_cache.get(key)
+            if cached is not None:
+                return cached
+        value, read_only = _process_ctx_request(self.ctx, args)
+        result = json.dumps(value)
+        if key is not None and read_only:
+            if len(self._read_cache) >= READ_CACHE_SIZE:
+                self._read_cache.clear()
+            self._read_cache[key] = result
         return result
 
+    def write_snapshot(self, directory=None):
+        """
+        Write the read-only data of ``ctx`` (see ``ctx_snapshot``) to a JSON
+        file, read by ``cloudify.proxy.client`` to answer requests reading
+        it without a round trip to the proxy, and to a shell script
+        exporting it (e.g. ``CTX_NODE_PROPERTIES_PORT``).
+
+        The snapshot files are removed when the proxy is closed.
+
+        :param directory: the directory to write the snapshot files to
+                          (default: a new temporary directory)
+        :return: the environment variables locating the snapshot files,
+                 to be set for the operation script with CTX_SOCKET_URL
+        """
+        with self._ctx_lock:
+            snapshot = ctx_snapshot(self.ctx)
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix='ctx-snapshot-')
+            self._snapshot_directory = directory
+        json_path = os.path.join(directory, SNAPSHOT_FILE_NAME)
+        shell_path = os.path.join(directory, SNAPSHOT_SHELL_FILE_NAME)
+        self._snapshot_paths = [json_path, shell_path]
+        with open(json_path, 'w') as f:
+            json.dump(snapshot, f)
+        with open(shell_path, 'w') as f:
+            for name, value in snapshot_shell_variables(snapshot):
+                f.write("export {0}='{1}'\n".format(
+                    name, value.replace("'", "'\\''").encode('utf-8')))
+        return {
+            CTX_SNAPSHOT: json_path,
+            CTX_SNAPSHOT_SH: shell_path
+        }
+
     def close(self):
-        pass
+        for path in self._snapshot_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        if self._snapshot_directory:
+            os.rmdir(self._snapshot_directory)
+        self._snapshot_paths = []
+        self._snapshot_directory = None
 
 
 class HTTPCtxProxy(CtxProxy):
+    """A ctx proxy handling every HTTP request in its own thread"""
 
     def __init__(self, ctx, port=None):
         port = port or get_unused_port()
         socket_url = 'http://localhost:{0}'.format(port)
         super(HTTPCtxProxy, self).__init__(ctx, socket_url)
         self.port = port
-        self._started = Queue(1)
-        self.thread = self._start_server()
-        self._started.get(timeout=5)
-
-    def _start_server(self):
-
-        proxy = self
-
-        class BottleServerAdapter(bottle.ServerAdapter):
-
-            def run(self, app):
-
-                class Server(WSGIServer):
-                    allow_reuse_address = True
-
-                    def handle_error(self, request, client_address):
-                        pass
-
-                class Handler(WSGIRequestHandler):
-                    def address_string(self):
-                        return self.client_address[0]
-
-                    def log_request(*args, **kwargs):
-                        if not self.quiet:
-                            return WSGIRequestHandler.log_request(
-                                *args, **kwargs)
-
-                self.srv = make_wsgi_server(
-                    self.host,
-                    self.port,
-                    app,
-                    Server,
-                    Handler)
-                proxy.server = self.srv
-                self.port = self.srv.server_port
-                proxy._started.put(True)
-                self.srv.serve_forever(poll_interval=0.1)
-
-        bottle.post('/', callback=self._request_handler)
-
-        def serve():
-            bottle.run(
-                host='localhost',
-                port=self.port,
-                quiet=True,
-                server=BottleServerAdapter)
-        thread = threading.Thread(target=serve)
-        thread.daemon = True
-        thread.start()
-        return thread
+        # an application per proxy, so proxies of concurrent operations
+        # do not share routes
+        app = bottle.Bottle()
+        app.post('/', callback=self._request_handler)
+        self.server, self.thread = _start_http_server(app, self.port)
 
     def close(self):
         self.server.shutdown()
         self.server.server_close()
+        super(HTTPCtxProxy, self).close()
 
     def _request_handler(self):
         request = bottle.request.body.read()
         response = self.process(request)
-        return bottle.LocalResponse(
-            body=response,
-            status=200,
-            headers={'content-type': 'application/json'})
+        return _json_response(response)
+
+
+class CtxProxyServer(object):
+    """
+    An HTTP server serving the ctx proxies of any number of operations,
+    so operations do not start (and stop) a server each.
+
+    Every proxy gets a random token, its socket url being
+    ``http://localhost:<port>/<token>``, requests are processed by the
+    proxy of the token in their path.
+    """
+
+    def __init__(self, port=None):
+        self.port = port or get_unused_port()
+        self._proxies = {}
+        self._lock = threading.Lock()
+        app = bottle.Bottle()
+        app.post('/<token>', callback=self._request_handler)
+        self.server, self.thread = _start_http_server(app, self.port)
+
+    def create_proxy(self, ctx):
+        """
+        :param ctx: the operation context
+        :return: a proxy of ``ctx`` served by this server, to be closed
+                 when the operation ends
+        """
+        return RoutedCtxProxy(ctx, self)
+
+    def add_proxy(self, proxy):
+        with self._lock:
+            self._proxies[proxy.token] = proxy
+
+    def remove_proxy(self, token):
+        with self._lock:
+            self._proxies.pop(token, None)
+
+    @property
+    def proxies(self):
+        """The number of proxies served"""
+        with self._lock:
+            return len(self._proxies)
+
+    def _request_handler(self, token):
+        with self._lock:
+            proxy = self._proxies.get(token)
+        if proxy is None:
+            response = json.dumps({
+                'type': 'error',
+                'payload': {
+                    'type': 'RuntimeError',
+                    'message': 'No ctx proxy for token: {0} (the operation '
+                               'has ended)'.format(token),
+                    'traceback': ''
+                }
+            })
+        else:
+            response = proxy.process(bottle.request.body.read())
+        return _json_response(response)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class RoutedCtxProxy(CtxProxy):
+    """A ctx proxy served by a ``CtxProxyServer``"""
+
+    def __init__(self, ctx, server):
+        self.token = uuid.uuid4().hex
+        socket_url = 'http://localhost:{0}/{1}'.format(server.port,
+                                                       self.token)
+        super(RoutedCtxProxy, self).__init__(ctx, socket_url)
+        self.proxy_server = server
+        server.add_proxy(self)
+
+    def close(self):
+        self.proxy_server.remove_proxy(self.token)
+        super(RoutedCtxProxy, self).close()
+
+
+_ctx_proxy_server = None
+_ctx_proxy_server_lock = threading.Lock()
+# the process the ctx proxy server was started by, forked processes do not
+# inherit its serving thread
+_ctx_proxy_server_pid = None
+
+
+def get_ctx_proxy_server():
+    """The process wide ctx proxy server, started on first use"""
+    global _ctx_proxy_server, _ctx_proxy_server_pid
+    with _ctx_proxy_server_lock:
+        if _ctx_proxy_server_pid != os.getpid():
+            # not served in this process (left by the parent process)
+            _ctx_proxy_server = None
+        if _ctx_proxy_server is None:
+            _ctx_proxy_server = CtxProxyServer()
+            _ctx_proxy_server_pid = os.getpid()
+            atexit.register(close_ctx_proxy_server)
+        return _ctx_proxy_server
+
+
+def close_ctx_proxy_server():
+    """Stop the process wide ctx proxy server, if started"""
+    global _ctx_proxy_server
+    with _ctx_proxy_server_lock:
+        if (_ctx_proxy_server is not None and
+                _ctx_proxy_server_pid == os.getpid()):
+            _ctx_proxy_server.close()
+        _ctx_proxy_server = None
+
+
+class SharedHTTPCtxProxy(RoutedCtxProxy):
+    """
+    A ctx proxy served by the process wide ctx proxy server, used as
+    ``HTTPCtxProxy`` without starting a server per operation.
+    """
+
+    def __init__(self, ctx):
+        super(SharedHTTPCtxProxy, self).__init__(ctx, get_ctx_proxy_server())
+
+
+def _start_http_server(app, port):
+    """
+    Serve a bottle app on localhost, handling every request in its own
+    thread.
+
+    :return: a (server, serving thread) tuple
+    """
+    started = Queue(1)
+
+    class BottleServerAdapter(bottle.ServerAdapter):
+
+        def run(self, app):
+
+            class Server(ThreadingMixIn, WSGIServer):
+                allow_reuse_address = True
+                daemon_threads = True
+
+                def handle_error(self, request, client_address):
+                    pass
+
+            class Handler(WSGIRequestHandler):
+                def address_string(self):
+                    return self.client_address[0]
+
+                def log_request(*args, **kwargs):
+                    if not self.quiet:
+                        return WSGIRequestHandler.log_request(
+                            *args, **kwargs)
+
+            srv = make_wsgi_server(
+                self.host,
+                self.port,
+                app,
+                Server,
+                Handler)
+            self.port = srv.server_port
+            started.put(srv)
+            srv.serve_forever(poll_interval=0.1)
+
+    def serve():
+        bottle.run(
+            app=app,
+            host='localhost',
+            port=port,
+            quiet=True,
+            server=BottleServerAdapter)
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+    return started.get(timeout=5), thread
+
+
+def _json_response(response):
+    # the body is returned as a string, so bottle sets its length and writes
+    # it at once (a returned response object is written character by
+    # character)
+    bottle.response.content_type = 'application/json'
+    return response
 
 
 class ZMQCtxProxy(CtxProxy):
+    """
+    A ctx proxy receiving requests on a ZMQ ROUTER socket.
 
-    def __init__(self, ctx, socket_url):
+    ``poll_and_process`` receives requests and hands them to a pool of
+    ``workers`` threads, and sends the responses of processed requests, so
+    a slow request does not delay the others.
+    """
+
+    def __init__(self, ctx, socket_url, workers=DEFAULT_WORKERS):
         super(ZMQCtxProxy, self).__init__(ctx, socket_url)
         import zmq
         self.z_context = zmq.Context(io_threads=1)
-        self.sock = self.z_context.socket(zmq.REP)
+        self.sock = self.z_context.socket(zmq.ROUTER)
         self.sock.bind(self.socket_url)
+        # workers send responses to the polling thread over this socket,
+        # as ZMQ sockets may not be shared between threads
+        self._responses_url = 'inproc://ctx-proxy-responses-{0}'.format(
+            id(self))
+        self._responses = self.z_context.socket(zmq.PULL)
+        self._responses.bind(self._responses_url)
         self.poller = zmq.Poller()
         self.poller.register(self.sock, zmq.POLLIN)
+        self.poller.register(self._responses, zmq.POLLIN)
+        self._requests = Queue()
+        self._workers = []
+        for _ in range(workers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
 
     def poll_and_process(self, timeout=1):
+        """
+        Wait up to ``timeout`` seconds for requests or responses.
+
+        :return: True if a request was received or a response was sent
+        """
         import zmq
-        state = dict(self.poller.poll(1000*timeout)).get(self.sock)
-        if not state == zmq.POLLIN:
-            return False
-        request = self.sock.recv()
-        response = self.process(request)
-        self.sock.send(response)
-        return True
+        events = dict(self.poller.poll(1000*timeout))
+        handled = False
+        if events.get(self._responses) == zmq.POLLIN:
+            while self._responses.poll(0):
+                self.sock.send_multipart(self._responses.recv_multipart())
+            handled = True
+        if events.get(self.sock) == zmq.POLLIN:
+            while self.sock.poll(0):
+                self._requests.put(self.sock.recv_multipart())
+            handled = True
+        return handled
+
+    def _work(self):
+        import zmq
+        responses = self.z_context.socket(zmq.PUSH)
+        responses.connect(self._responses_url)
+        try:
+            while True:
+                message = self._requests.get()
+                if message is None:
+                    return
+                # [client identity, empty delimiter, request]
+                envelope, request = message[:-1], message[-1]
+                responses.send_multipart(envelope + [self.process(request)])
+        finally:
+            responses.close(linger=0)
 
     def close(self):
+        for _ in self._workers:
+            self._requests.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._responses.close()
         self.sock.close()
         self.z_context.term()
+        super(ZMQCtxProxy, self).close()
 
 
 class UnixCtxProxy(ZMQCtxProxy):
@@ -167,6 +548,93 @@ class UnixCtxProxy(ZMQCtxProxy):
         super(UnixCtxProxy, self).__init__(ctx, socket_url)
 
 
+class LineCtxProxy(CtxProxy):
+    """
+    A ctx proxy speaking newline delimited JSON over a unix socket
+    (socket url: ``unix://<socket path>``), simple enough to be used from
+    shell scripts without starting a Python process (see ``ctx.sh``).
+
+    Every line sent by a client is a request: either a request object as
+    sent by ``cloudify.proxy.client`` or just the JSON array of its args.
+    Clients may send any number of requests over a connection, each
+    connection is served by its own thread.
+
+    Responses are JSON lines, unless the request object has
+    ``"format": "text"``. Text responses are ``result`` or ``error``,
+    a tab, the result as printed by the ``ctx`` command (or the error
+    message), and a NUL character.
+    """
+
+    def __init__(self, ctx, socket_path=None):
+        if not socket_path:
+            socket_path = tempfile.mktemp(prefix='ctx-', suffix='.socket')
+        socket_url = 'unix://{0}'.format(socket_path)
+        super(LineCtxProxy, self).__init__(ctx, socket_url)
+        self.socket_path = socket_path
+        self.server = self._create_server()
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs={'poll_interval': 0.1})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _create_server(self):
+
+        proxy = self
+
+        class Handler(StreamRequestHandler):
+
+            def handle(self):
+                for line in iter(self.rfile.readline, ''):
+                    line = line.strip()
+                    if line:
+                        self.wfile.write(proxy.process_line(line))
+                        self.wfile.flush()
+
+        class Server(ThreadingUnixStreamServer):
+            daemon_threads = True
+            # connecting to a unix socket with a full backlog fails
+            # (rather than being retried as with tcp)
+            request_queue_size = LINE_PROXY_BACKLOG
+
+            def handle_error(self, request, client_address):
+                pass
+
+        return Server(self.socket_path, Handler)
+
+    def process_line(self, line):
+        text_format = False
+        try:
+            request = json.loads(line)
+        except ValueError:
+            # answered with the parsing error
+            request = line
+        if isinstance(request, list):
+            request = {'args': request}
+        elif isinstance(request, dict):
+            text_format = request.pop('format', None) == 'text'
+        response = self.process(request)
+        if not text_format:
+            return '{0}\n'.format(response)
+        response = json.loads(response)
+        payload = response['payload']
+        if response['type'] == 'error':
+            text = u'{0}: {1}'.format(payload['type'], payload['message'])
+        elif isinstance(payload, unicode):
+            text = payload
+        else:
+            text = format_response(payload, json_output=False)
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        return '{0}\t{1}\0'.format(response['type'], text)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        super(LineCtxProxy, self).close()
+
+
 class TCPCtxProxy(ZMQCtxProxy):
 
     def __init__(self, ctx, ip='127.0.0.1', port=None):
@@ -183,10 +651,105 @@ class StubCtxProxy(object):
         pass
 
 
+def ctx_snapshot(ctx):
+    """
+    The data of ``ctx`` which does not change during an operation: ids,
+    names, types and node properties, in the layout of the requests reading
+    them (e.g. ``snapshot['node']['properties']`` for
+    ``ctx node properties``). Runtime properties are not included.
+
+    Data which cannot be read (e.g. node data in deployment contexts) is
+    left out, requests reading it are sent to the proxy.
+    """
+    snapshot = _read_attributes(ctx, ('type', 'execution_id', 'workflow_id',
+                                      'task_id', 'task_name', 'task_target',
+                                      'task_queue', 'plugin'))
+    for entity in ('blueprint', 'deployment'):
+        _add_snapshot_entity(snapshot, entity, ctx, ('id',))
+    _add_snapshot_entity(snapshot, 'operation', ctx, ('name',))
+    _add_snapshot_entity(snapshot, 'node', ctx, SNAPSHOT_NODE_ATTRIBUTES)
+    _add_snapshot_entity(snapshot, 'instance', ctx, ('id',))
+    for subject in ('source', 'target'):
+        try:
+            subject_ctx = getattr(ctx, subject)
+        except Exception:
+            continue
+        subject_snapshot = {}
+        _add_snapshot_entity(subject_snapshot, 'node', subject_ctx,
+                             SNAPSHOT_NODE_ATTRIBUTES)
+        _add_snapshot_entity(subject_snapshot, 'instance', subject_ctx,
+                             ('id',))
+        if subject_snapshot:
+            snapshot[subject] = subject_snapshot
+    return snapshot
+
+
+def _add_snapshot_entity(snapshot, name, ctx, attributes):
+    try:
+        entity = getattr(ctx, name)
+    except Exception:
+        return
+    if entity is None:
+        return
+    entity_snapshot = _read_attributes(entity, attributes)
+    if entity_snapshot:
+        snapshot[name] = entity_snapshot
+
+
+def _read_attributes(obj, attributes):
+    values = {}
+    for attribute in attributes:
+        try:
+            value = getattr(obj, attribute)
+            # only values the proxy would return as they are
+            json.dumps(value)
+        except Exception:
+            continue
+        if isinstance(value, dict):
+            value = dict(value)
+        values[attribute] = value
+    return values
+
+
+def snapshot_shell_variables(snapshot, prefix='CTX'):
+    """
+    Flatten a ctx snapshot to a list of (name, value) shell variables, e.g.
+    ``CTX_NODE_PROPERTIES_PORT``. Lists and dicts are also written as JSON
+    (e.g. ``CTX_NODE_PROPERTIES`` holds all node properties).
+    """
+    variables = []
+
+    def add(name, value):
+        if isinstance(value, dict):
+            if name != prefix:
+                variables.append((name, unicode(json.dumps(value))))
+            for key in sorted(value):
+                add('{0}_{1}'.format(
+                    name, re.sub('[^A-Za-z0-9]', '_', key).upper()),
+                    value[key])
+        elif isinstance(value, list):
+            variables.append((name, unicode(json.dumps(value))))
+        elif isinstance(value, bool):
+            variables.append((name, u'true' if value else u'false'))
+        elif value is None:
+            variables.append((name, u''))
+        else:
+            variables.append((name, unicode(value)))
+    add(prefix, snapshot)
+    return variables
+
+
 def process_ctx_request(ctx, args):
+    value, _ = _process_ctx_request(ctx, args)
+    return value
+
+
+def _process_ctx_request(ctx, args):
+    """:return: a (value, read only request) tuple"""
     current = ctx
     num_args = len(args)
     index = 0
+    read_only = True
     while index < num_args:
         arg = args[index]
         desugared_attr = _desugar_attr(current, arg)
@@ -202,6 +765,7 @@ def process_ctx_request(ctx, args):
             elif index + 2 == num_args:
                 # set dict prop by path
                 value = args[index+1]
+                read_only = False
                 current = path_dict.set(key, value)
             else:
                 raise RuntimeError('Illegal argument while accessing dict')
@@ -212,6 +776,7 @@ def process_ctx_request(ctx, args):
             if isinstance(remaining_args[-1], collections.MutableMapping):
                 kwargs = remaining_args[-1]
                 remaining_args = remaining_args[:-1]
+            read_only = False
             current = current(*remaining_args, **kwargs)
             break
         else:
@@ -220,19 +785,47 @@ def process_ctx_request(ctx, args):
         index += 1
 
     if callable(current):
+        read_only = False
         current = current()
 
-    return current
+    return current, read_only
+
+
+def _read_cache_key(args):
+    """
+    The read cache key of request args, None if their result may change
+    (see ``CACHEABLE_READ_PATHS``).
+    """
+    for arg in args:
+        if not isinstance(arg, basestring):
+            return None
+    path = tuple(arg.replace('-', '_') for arg in args[:3])
+    if path[:1] in (('source',), ('target',)):
+        path = path[1:]
+    for cacheable_path in CACHEABLE_READ_PATHS:
+        if path[:len(cacheable_path)] == cacheable_path:
+            return tuple(args)
+    return None
+
+
+# attribute names of request args by (class, arg), for args naming class
+# attributes (properties and methods)
+_class_attributes = {}
 
 
 def _desugar_attr(obj, attr):
     if not isinstance(attr, basestring):
         return None
-    if hasattr(obj, attr):
-        return attr
-    attr = attr.replace('-', '_')
-    if hasattr(obj, attr):
-        return attr
+    key = (type(obj), attr)
+    desugared_attr = _class_attributes.get(key)
+    if desugared_attr:
+        return desugared_attr
+    for desugared_attr in (attr, attr.replace('-', '_')):
+        if hasattr(type(obj), desugared_attr):
+            _class_attributes[key] = desugared_attr
+            return desugared_attr
+        if hasattr(obj, desugared_attr):
+            return desugared_attr
     return None
 
 
@@ -240,6 +833,9 @@ class PathDictAccess(object):
 
     pattern = re.compile("(.+)\[(\d+)\]")
 
+    # (segment, property name, list index or None) tuples by path
+    _parsed_paths = {}
+
     def __init__(self, obj):
         self.obj = obj
 
@@ -251,13 +847,31 @@ class PathDictAccess(object):
         value = self._get_object_by_path(prop_path)
         return value
 
-    def _get_object_by_path(self, prop_path):
+    @classmethod
+    def _parse_path(cls, prop_path):
+        segments = cls._parsed_paths.get(prop_path)
+        if segments is None:
+            segments = []
+            for prop_segment in prop_path.split('.'):
+                match = cls.pattern.match(prop_segment)
+                if match:
+                    segments.append((prop_segment,
+                                     match.group(1),
+                                     int(match.group(2))))
+                else:
+                    segments.append((prop_segment, prop_segment, None))
+            segments = tuple(segments)
+            if len(cls._parsed_paths) >= PARSED_PATHS_CACHE_SIZE:
+                cls._parsed_paths.clear()
+            cls._parsed_paths[prop_path] = segments
+        return segments
+
+    def _get_object_by_path(self, prop_path, segments=None):
         current = self.obj
-        for prop_segment in prop_path.split('.'):
-            match = self.pattern.match(prop_segment)
-            if match:
-                index = int(match.group(2))
-                property_name = match.group(1)
+        if segments is None:
+            segments = self._parse_path(prop_path)
+        for prop_segment, property_name, index in segments:
+            if index is not None:
                 if property_name not in current:
                     self._raise_illegal(prop_path)
                 if type(current[property_name]) != list:
@@ -270,12 +884,11 @@ class PathDictAccess(object):
         return current
 
     def _get_parent_obj_prop_name_by_path(self, prop_path):
-        split = prop_path.split('.')
-        if len(split) == 1:
+        segments = self._parse_path(prop_path)
+        if len(segments) == 1:
             return self.obj, prop_path
-        parent_path = '.'.join(split[:-1])
-        parent_obj = self._get_object_by_path(parent_path)
-        prop_name = split[-1]
+        parent_obj = self._get_object_by_path(prop_path, segments[:-1])
+        prop_name = segments[-1][0]
         return parent_obj, prop_name
 
     @staticmethod
@@ -0,0 +1,134 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+"""Serialization and timestamping of logs and events"""
+
+import json
+import time
+import zlib
+
+JSON_CONTENT_TYPE = 'application/json'
+# content encoding of compressed message bodies (zlib format, as the HTTP
+# 'deflate' content coding)
+DEFLATE_CONTENT_ENCODING = 'deflate'
+
+
+def _default_json_encoder():
+    try:
+        import ujson
+        return ujson.dumps
+    except ImportError:
+        return json.dumps
+
+
+# the function used to encode logs and events, see set_json_encoder
+_json_encoder = _default_json_encoder()
+
+
+def set_json_encoder(encoder=None):
+    """
+    Set the function used to encode logs and events to JSON.
+
+    :param encoder: a function taking an object and returning its JSON
+                    string (default: ``ujson.dumps`` when ujson is installed,
+                    ``json.dumps`` otherwise)
+    """
+    global _json_encoder
+    _json_encoder = encoder or _default_json_encoder()
+
+
+def dumps(obj):
+    """Encode a log or event to JSON using the configured encoder"""
+    return _json_encoder(obj)
+
+
+def encode_message(item, compress_threshold=None):
+    """
+    Encode a log or event to a message body, compressing bodies larger than
+    ``compress_threshold`` bytes.
+
+    :param item: the log or event
+    :param compress_threshold: minimum size in bytes of compressed bodies
+                               (default: never compress)
+    :return: a (body, content_encoding) tuple, content_encoding being None
+             for plain JSON bodies
+    """
+    body = dumps(item)
+    if compress_threshold is not None and len(body) > compress_threshold:
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        return zlib.compress(body), DEFLATE_CONTENT_ENCODING
+    return body, None
+
+
+def decode_message(body, content_encoding=None):
+    """
+    Decode a message body encoded by ``encode_message``.
+
+    :param body: the message body
+    :param content_encoding: the message content encoding property
+    :return: the log or event
+    """
+    if content_encoding == DEFLATE_CONTENT_ENCODING:
+        body = zlib.decompress(body)
+    elif content_encoding:
+        raise ValueError('Unsupported content encoding: {0}'
+                         .format(content_encoding))
+    return json.loads(body)
+
+
+class TimestampFormatter(object):
+    """
+    Formats timestamps as 'YYYY-MM-DD HH:MM:SS.mmm+ZZZZ' (local time).
+
+    The date and time part is formatted once per second and the timezone
+    suffix once per hour, so most calls only format the milliseconds.
+    """
+
+    def __init__(self):
+        # (second, formatted second) and (hour, timezone suffix), replaced
+        # as a whole so concurrent callers never see a partial update
+        self._second = (None, None)
+        self._timezone = (None, None)
+
+    def __call__(self, now=None):
+        """
+        :param now: seconds since the epoch (default: the current time)
+        :return: the formatted timestamp
+        """
+        if now is None:
+            now = time.time()
+        second = int(now)
+        cached_second, formatted = self._second
+        if cached_second != second:
+            formatted = '{0}.%03d{1}'.format(
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second)),
+                self.timezone_suffix(second))
+            self._second = (second, formatted)
+        return formatted % int((now - second) * 1000)
+
+    def timezone_suffix(self, now=None):
+        """The timezone suffix (e.g. '+0200'), refreshed every hour"""
+        if now is None:
+            now = time.time()
+        hour = int(now) // 3600
+        cached_hour, suffix = self._timezone
+        if cached_hour != hour:
+            suffix = time.strftime('%z', time.gmtime(now))
+            self._timezone = (hour, suffix)
+        return suffix
+
+
+format_timestamp = TimestampFormatter()
@@ -0,0 +1,366 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+
+import testtools
+from mock import patch
+
+from cloudify import amqp_client
+from cloudify import amqp_publisher
+from cloudify import decorators
+from cloudify import logs
+
+
+class MockClient(object):
+
+    def __init__(self, publish_delay=0, fail=False, fail_after=None):
+        self.publish_delay = publish_delay
+        self.fail = fail
+        self.fail_after = fail_after
+        self.closed = False
+        self.published = []
+        self.publishing_threads = set()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def publish_log(self, log):
+        self._publish(('log', log))
+
+    def publish_event(self, event):
+        self._publish(('event', event))
+
+    def _publish(self, message):
+        self.gate.wait()
+        if self.fail or len(self.published) == self.fail_after:
+            self.fail_after = None
+            raise RuntimeError('publish failed')
+        time.sleep(self.publish_delay)
+        self.publishing_threads.add(threading.current_thread())
+        self.published.append(message)
+
+    def close(self):
+        self.closed = True
+
+
+def _log(i, level='info'):
+    return {'level': level, 'message': {'text': str(i)}}
+
+
+class BufferedPublisherTest(testtools.TestCase):
+
+    def _publisher(self, client, **kwargs):
+        publisher = amqp_publisher.BufferedPublisher(lambda: client,
+                                                     **kwargs)
+        self.addCleanup(publisher.close, 10)
+        return publisher
+
+    def test_publish_in_background(self):
+        client = MockClient(publish_delay=0.01)
+        publisher = self._publisher(client, batch_size=10)
+        started = time.time()
+        for i in range(20):
+            publisher.publish_log(_log(i))
+        publisher.publish_event({'event_type': 'e'})
+        self.assertLess(time.time() - started, 0.1)
+        self.assertTrue(publisher.flush(10))
+        self.assertEqual([('log', _log(i)) for i in range(20)] +
+                         [('event', {'event_type': 'e'})],
+                         client.published)
+        self.assertNotIn(threading.current_thread(),
+                         client.publishing_threads)
+
+    def test_flush_interval(self):
+        client = MockClient()
+        publisher = self._publisher(client, flush_interval=0.05)
+        publisher.publish_log(_log(0))
+        deadline = time.time() + 10
+        while not client.published:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def test_flush_timeout(self):
+        client = MockClient()
+        client.gate.clear()
+        publisher = self._publisher(client)
+        publisher.publish_log(_log(0))
+        self.assertFalse(publisher.flush(0.1))
+        client.gate.set()
+        self.assertTrue(publisher.flush(10))
+
+    def test_full_buffer_block(self):
+        client = MockClient()
+        client.gate.clear()
+        publisher = self._publisher(client, buffer_size=2, batch_size=1)
+        publisher.publish_log(_log(0))
+        # wait for the flusher to take the first message
+        deadline = time.time() + 10
+        while publisher._buffer:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        publisher.publish_log(_log(1))
+        publisher.publish_log(_log(2))
+        blocked = threading.Thread(target=publisher.publish_log,
+                                   args=(_log(3),))
+        blocked.start()
+        blocked.join(0.1)
+        self.assertTrue(blocked.is_alive())
+        client.gate.set()
+        blocked.join(10)
+        self.assertTrue(publisher.flush(10))
+        self.assertEqual([('log', _log(i)) for i in range(4)],
+                         client.published)
+
+    def test_full_buffer_drop_debug(self):
+        client = MockClient()
+        client.gate.clear()
+        publisher = self._publisher(
+            client, buffer_size=2,
+            full_policy=amqp_publisher.FULL_POLICY_DROP_DEBUG)
+        publisher.publish_log(_log(0))
+        publisher.publish_log(_log(1))
+        publisher.publish_log(_log(2, level='debug'))
+        self.assertEqual(1, publisher.dropped)
+        client.gate.set()
+        self.assertTrue(publisher.flush(10))
+        self.assertEqual([('log', _log(i)) for i in range(2)],
+                         client.published)
+
+    def test_full_buffer_spill(self):
+        fd, spill_path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, spill_path)
+        client = MockClient()
+        client.gate.clear()
+        publisher = self._publisher(
+            client, buffer_size=2, batch_size=1,
+            full_policy=amqp_publisher.FULL_POLICY_SPILL,
+            spill_path=spill_path)
+        for i in range(10):
+            publisher.publish_log(_log(i))
+        self.assertGreater(publisher._spilled, 0)
+        client.gate.set()
+        self.assertTrue(publisher.flush(10))
+        self.assertEqual([('log', _log(i)) for i in range(10)],
+                         client.published)
+        self.assertEqual(0, os.path.getsize(spill_path))
+
+    def test_spill_published_in_batches(self):
+        fd, spill_path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, spill_path)
+        # publishing the fourth message fails, only the batch it is in is
+        # lost
+        client = MockClient(fail_after=3)
+        publisher = self._publisher(
+            client, buffer_size=1, batch_size=2, publish_retries=0,
+            full_policy=amqp_publisher.FULL_POLICY_SPILL,
+            spill_path=spill_path)
+        for i in range(8):
+            publisher.publish_log(_log(i))
+        self.assertTrue(publisher.flush(10))
+        self.assertEqual(2, publisher.failed)
+        self.assertEqual(6, len(client.published))
+        published = [int(log['message']['text'])
+                     for _, log in client.published]
+        self.assertEqual(sorted(published), published)
+        self.assertEqual(7, published[-1])
+        self.assertEqual(0, os.path.getsize(spill_path))
+
+    def test_publish_failure(self):
+        client = MockClient(fail=True)
+        publisher = self._publisher(client, publish_retries=0)
+        publisher.publish_log(_log(0))
+        self.assertTrue(publisher.flush(10))
+        self.assertEqual(1, publisher.failed)
+        client.fail = False
+        publisher.publish_log(_log(1))
+        self.assertTrue(publisher.flush(10))
+        self.assertEqual([('log', _log(1))], client.published)
+
+    def test_reconnect(self):
+        clients = []
+
+        def client_factory():
+            # the first connection fails after publishing two messages
+            clients.append(MockClient(fail_after=2 if not clients else None))
+            return clients[-1]
+        publisher = amqp_publisher.BufferedPublisher(client_factory,
+                                                     reconnect_interval=0)
+        for i in range(5):
+            publisher.publish_log(_log(i))
+        self.assertTrue(publisher.flush(10))
+        publisher.close(10)
+        self.assertEqual(2, publisher.connections)
+        self.assertEqual(1, publisher.reconnects)
+        self.assertEqual(0, publisher.failed)
+        self.assertEqual([('log', _log(i)) for i in range(2)],
+                         clients[0].published)
+        self.assertEqual([('log', _log(i)) for i in range(2, 5)],
+                         clients[1].published)
+        self.assertTrue(clients[0].closed)
+        self.assertTrue(clients[1].closed)
+
+    def test_single_connection_for_all_threads(self):
+        clients = []
+
+        def client_factory():
+            clients.append(MockClient())
+            return clients[-1]
+        publisher = amqp_publisher.BufferedPublisher(client_factory)
+        self.addCleanup(publisher.close, 10)
+        threads = [threading.Thread(target=publisher.publish_log,
+                                    args=(_log(i),))
+                   for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(publisher.flush(10))
+        self.assertEqual(1, len(clients))
+        self.assertEqual(10, len(clients[0].published))
+
+    def test_fork_while_locked(self):
+        if not hasattr(os, 'fork'):
+            self.skipTest('fork is not supported')
+        client = MockClient()
+        publisher = self._publisher(client)
+        publisher.publish_log(_log(0))
+        self.assertTrue(publisher.flush(10))
+        # fork while another thread (as the flusher thread) holds the lock
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold_lock():
+            with publisher._cond:
+                locked.set()
+                release.wait()
+        thread = threading.Thread(target=hold_lock)
+        thread.start()
+        locked.wait()
+        pid = os.fork()
+        if not pid:
+            status = 1
+            try:
+                signal.alarm(10)
+                publisher.publish_log(_log(1))
+                if (publisher.flush(5) and
+                        client.published[-1] == ('log', _log(1))):
+                    status = 0
+            finally:
+                os._exit(status)
+        release.set()
+        thread.join()
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, status)
+        self.assertEqual([('log', _log(0))], client.published)
+
+    def test_invalid_policy(self):
+        self.assertRaises(ValueError, amqp_publisher.BufferedPublisher,
+                          lambda: None, full_policy='unknown')
+
+    def test_flush_amqp_out(self):
+        client = MockClient()
+        client.gate.clear()
+        publisher = self._publisher(client)
+        with patch('cloudify.logs._publisher', publisher):
+            logs.amqp_log_out(_log(0), ctx=None)
+            self.assertFalse(logs.flush_amqp_out(timeout=0.1))
+            client.gate.set()
+            self.assertTrue(logs.flush_amqp_out())
+        self.assertEqual(1, len(client.published))
+
+    @patch('cloudify.decorators.logging')
+    @patch('cloudify.logs.flush_amqp_out', return_value=False)
+    def test_operation_end_flush_timeout(self, flush_amqp_out, logging):
+        decorators._flush_amqp_out()
+        flush_amqp_out.assert_called_once_with(
+            timeout=logs.END_FLUSH_TIMEOUT)
+        self.assertEqual(
+            1, logging.getLogger.return_value.warning.call_count)
+
+
+class SpoolingPublisherTest(testtools.TestCase):
+
+    def setUp(self):
+        super(SpoolingPublisherTest, self).setUp()
+        self.spool_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_directory)
+
+    def _publisher(self, client_factory):
+        publisher = amqp_publisher.BufferedPublisher(
+            client_factory,
+            flush_interval=0.01,
+            publish_retries=0,
+            spool_directory=self.spool_directory)
+        self.addCleanup(publisher.close, 10)
+        return publisher
+
+    def _wait_for(self, predicate):
+        deadline = time.time() + 10
+        while not predicate():
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def test_broker_down(self):
+        client = MockClient(fail=True)
+        publisher = self._publisher(lambda: client)
+        for i in range(5):
+            publisher.publish_log(_log(i))
+        # flushing does not wait for the broker
+        self.assertTrue(publisher.flush(0.1))
+        self._wait_for(lambda: publisher.reconnects or publisher.connections)
+        client.fail = False
+        self._wait_for(lambda: len(client.published) == 5)
+        self.assertEqual([('log', _log(i)) for i in range(5)],
+                         client.published)
+        self.assertEqual(0, publisher.failed)
+        self._wait_for(lambda: publisher._spool.pending == 0)
+
+    def test_spooled_messages_published_by_next_process(self):
+        client = MockClient(fail=True)
+        publisher = amqp_publisher.BufferedPublisher(
+            lambda: client, publish_retries=0,
+            spool_directory=self.spool_directory)
+        publisher.publish_log(_log(0))
+        publisher.publish_event({'event_type': 'e'})
+        publisher.close(10)
+
+        client = MockClient()
+        publisher = self._publisher(lambda: client)
+        publisher.publish_log(_log(1))
+        self._wait_for(lambda: len(client.published) == 3)
+        self.assertEqual([('log', _log(0)),
+                          ('event', {'event_type': 'e'}),
+                          ('log', _log(1))], client.published)
+
+
+class AMQPClientConnectionCountTest(testtools.TestCase):
+
+    @patch('cloudify.amqp_client.pika.BlockingConnection')
+    def test_open_connections(self, _):
+        open_connections = amqp_client.AMQPClient.open_connections
+        client = amqp_client.create_client(amqp_host='localhost')
+        self.assertEqual(open_connections + 1,
+                         amqp_client.AMQPClient.open_connections)
+        client.close()
+        client.close()
+        self.assertEqual(open_connections,
+                         amqp_client.AMQPClient.open_connections)
@@ -0,0 +1,108 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+import testtools
+
+from cloudify import amqp_spool
+
+
+class DiskSpoolTest(testtools.TestCase):
+
+    def setUp(self):
+        super(DiskSpoolTest, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def _spool(self, segment_size=64):
+        spool = amqp_spool.DiskSpool(self.path, segment_size=segment_size)
+        self.addCleanup(spool.close)
+        return spool
+
+    def _segments(self):
+        return sorted(name for name in os.listdir(self.path)
+                      if name.startswith(amqp_spool.SEGMENT_FILE_PREFIX))
+
+    def test_append_read_consume(self):
+        spool = self._spool()
+        for i in range(3):
+            spool.append('record{0}'.format(i))
+        self.assertEqual(3, spool.pending)
+        records = spool.read(2)
+        self.assertEqual(['record0', 'record1'],
+                         [record for record, _ in records])
+        # reading does not consume
+        self.assertEqual(records, spool.read(2))
+        spool.consume(records[-1][1])
+        self.assertEqual(1, spool.pending)
+        self.assertEqual(['record2'],
+                         [record for record, _ in spool.read(10)])
+
+    def test_segment_rotation(self):
+        spool = self._spool(segment_size=64)
+        records = ['{0:020d}'.format(i) for i in range(10)]
+        for record in records:
+            spool.append(record)
+        self.assertGreater(len(self._segments()), 1)
+        read = spool.read(100)
+        self.assertEqual(records, [record for record, _ in read])
+        spool.consume(read[-1][1])
+        self.assertEqual(1, len(self._segments()))
+        self.assertEqual(0, spool.pending)
+
+    def test_record_bigger_than_segment(self):
+        spool = self._spool(segment_size=16)
+        spool.append('x' * 100)
+        spool.append('y')
+        self.assertEqual(['x' * 100, 'y'],
+                         [record for record, _ in spool.read(10)])
+
+    def test_reopen(self):
+        spool = amqp_spool.DiskSpool(self.path, segment_size=64)
+        for i in range(10):
+            spool.append('{0:020d}'.format(i))
+        records = spool.read(4)
+        spool.consume(records[-1][1])
+        spool.close()
+
+        spool = self._spool()
+        self.assertEqual(6, spool.pending)
+        spool.append('new')
+        self.assertEqual(['{0:020d}'.format(i) for i in range(4, 10)] +
+                         ['new'],
+                         [record for record, _ in spool.read(100)])
+
+    def test_locked(self):
+        self._spool()
+        self.assertRaises(amqp_spool.SpoolLockedError,
+                          amqp_spool.DiskSpool, self.path)
+
+    def test_open_spool_slots(self):
+        first = amqp_spool.open_spool(self.path)
+        self.addCleanup(first.close)
+        second = amqp_spool.open_spool(self.path)
+        self.addCleanup(second.close)
+        self.assertEqual(os.path.join(self.path, '0'), first.path)
+        self.assertEqual(os.path.join(self.path, '1'), second.path)
+        first.append('record')
+        first.close()
+        # a released spool is reused with its records
+        third = amqp_spool.open_spool(self.path)
+        self.addCleanup(third.close)
+        self.assertEqual(['record'],
+                         [record for record, _ in third.read(10)])
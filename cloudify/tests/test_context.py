@@ -20,6 +20,8 @@ import testtools
 
 from cloudify import constants
 from cloudify import context
+from cloudify import endpoint
+from cloudify import manager
 from cloudify import exceptions
 from cloudify.utils import create_temp_folder
 from cloudify.decorators import operation
@@ -161,6 +163,70 @@ class NodeContextTests(testtools.TestCase):
                              instance.runtime_properties['type_hierarchy'])
 
 
+class NodeInstanceContextTests(testtools.TestCase):
+
+    class MockEndpoint(endpoint.Endpoint):
+
+        def __init__(self):
+            super(NodeInstanceContextTests.MockEndpoint, self).__init__(None)
+            self.version = 1
+            self.gets = 0
+            self.updates = []
+
+        def get_node_instance(self, node_instance_id):
+            self.gets += 1
+            return manager.NodeInstance(node_instance_id, 'node',
+                                        runtime_properties={'key': 'value'},
+                                        version=self.version)
+
+        def update_node_instance(self, node_instance):
+            if node_instance.version != self.version:
+                raise local.StorageConflictError('conflict')
+            self.updates.append(dict(node_instance.runtime_properties))
+            self.version += 1
+            return self.version
+
+        def is_version_conflict(self, error):
+            return isinstance(error, local.StorageConflictError)
+
+    def setUp(self):
+        super(NodeInstanceContextTests, self).setUp()
+        self.endpoint = self.MockEndpoint()
+        self.instance = context.NodeInstanceContext({'node_id': 'node_1'},
+                                                    endpoint=self.endpoint,
+                                                    node=None,
+                                                    modifiable=True)
+
+    def test_update_keeps_node_instance(self):
+        for i in range(3):
+            self.instance.runtime_properties['counter'] = i
+            self.instance.update()
+            self.assertEqual(i, self.instance.runtime_properties['counter'])
+        self.assertEqual(1, self.endpoint.gets)
+        self.assertEqual([0, 1, 2], [update['counter']
+                                     for update in self.endpoint.updates])
+        # nothing to update
+        self.instance.update()
+        self.assertEqual(3, len(self.endpoint.updates))
+
+    def test_refresh(self):
+        self.instance.runtime_properties['key'] = 'changed'
+        self.instance.refresh()
+        self.assertEqual('value', self.instance.runtime_properties['key'])
+        self.assertEqual(2, self.endpoint.gets)
+
+    def test_version_conflict(self):
+        self.instance.runtime_properties['key'] = 'changed'
+        # updated by someone else
+        self.endpoint.version += 1
+        self.assertRaises(local.StorageConflictError, self.instance.update)
+        self.assertEqual('value', self.instance.runtime_properties['key'])
+        self.assertEqual(2, self.endpoint.gets)
+        self.instance.runtime_properties['key'] = 'changed'
+        self.instance.update()
+        self.assertEqual([{'key': 'changed'}], self.endpoint.updates)
+
+
 class GetResourceTemplateTests(testtools.TestCase):
 
     def __init__(self, *args, **kwargs):
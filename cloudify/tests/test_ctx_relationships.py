@@ -18,6 +18,7 @@ import copy
 from os import path
 
 import testtools
+from mock import patch
 
 from cloudify import context
 from cloudify.decorators import operation
@@ -106,7 +107,9 @@ class TestContextRelationship(testtools.TestCase):
     def _assert_relationships(self, cfy_local, rel):
         for node in ['node1', 'node2', 'node3']:
             self._run(cfy_local, 'assert_relationships', rel, node=node)
+        return self._relationships_result(cfy_local, rel)
 
+    def _relationships_result(self, cfy_local, rel):
         instances = cfy_local.storage.get_node_instances()
         instance1 = [i for i in instances if i.node_id == 'node1'][0]
         instance2 = [i for i in instances if i.node_id == 'node2'][0]
@@ -221,12 +224,31 @@ class TestContextRelationship(testtools.TestCase):
         instance = [i for i in node_instances if i.node_id == 'node1'][0]
         self._assert_node2_rel(instance.runtime_properties['result'])
 
-    def _run(self, cfy_local, op, rel, node='node1', kwargs=None):
+    @workflow_test(context_blueprint_path)
+    def test_prefetched_nodes(self, cfy_local):
+        self._update_runtime_properties(cfy_local)
+        with patch.object(cfy_local.storage, 'get_node',
+                          wraps=cfy_local.storage.get_node) as get_node:
+            for rel in ['', 'source', 'target']:
+                for node in ['node1', 'node2', 'node3']:
+                    self._run(cfy_local, 'assert_relationships', rel,
+                              node=node, prefetch_context=True)
+                self._test_relationships(
+                    self._relationships_result(cfy_local, rel), rel)
+            self.assertEqual(0, get_node.call_count)
+        with testtools.ExpectedException(exceptions.NonRecoverableError,
+                                         '.*read only properties.*'):
+            self._run(cfy_local, 'assert_immutable_properties', '',
+                      prefetch_context=True)
+
+    def _run(self, cfy_local, op, rel, node='node1', kwargs=None,
+             **execute_kwargs):
         kwargs = kwargs or {}
         cfy_local.execute('execute_operation',
                           task_retries=0,
                           parameters={'op': op, 'rel': rel, 'node': node,
-                                      'kwargs': kwargs})
+                                      'kwargs': kwargs},
+                          **execute_kwargs)
 
 
 @workflow
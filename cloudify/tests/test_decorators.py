@@ -138,6 +138,8 @@ class OperationTest(testtools.TestCase):
 
     @patch('cloudify.logs.amqp_log_out', logs.stdout_log_out)
     @patch('cloudify.logs.amqp_event_out', logs.stdout_event_out)
+    # Prevents from asking amqp for msgs.
+    @patch('cloudify.workflows.events.Monitor', MagicMock())
     def test_workflow_error_delegation(self):
         try:
             workflow_context.get_rest_client = \
@@ -147,9 +149,6 @@ class OperationTest(testtools.TestCase):
             manager.get_rest_client = \
                 lambda: rest_client_mock.MockRestclient()
 
-            # Prevents from asking amqp for msgs.
-            workflow_context.events.Monitor = MagicMock()
-
             kwargs = {'__cloudify_context': {}}
             try:
                 error_workflow(picklable=False, **kwargs)
@@ -0,0 +1,77 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import time
+
+import testtools
+from mock import MagicMock, patch
+
+from cloudify.workflows import events
+from cloudify.workflows import tasks as tasks_api
+
+
+class MonitorEventsHandlingTest(testtools.TestCase):
+
+    def setUp(self):
+        super(MonitorEventsHandlingTest, self).setUp()
+        self.states = []
+        self.task = MagicMock()
+        self.task.set_state.side_effect = self.states.append
+        tasks_graph = MagicMock()
+        tasks_graph.get_task.return_value = self.task
+        self.monitor = events.Monitor(tasks_graph)
+
+    def _wait_for_handled_events(self, count):
+        deadline = time.time() + 10
+        while self.monitor.handled_events < count:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    @patch('cloudify.workflows.events.send_task_event')
+    def test_events_handled_on_separate_thread(self, send_task_event):
+        send_task_event.side_effect = lambda *args: time.sleep(0.05)
+        started = time.time()
+        for i in range(5):
+            self.monitor.task_started({'uuid': str(i)})
+        self.monitor.task_succeeded({'uuid': '5', 'result': None})
+        # receiving is not held back by the slow event publishing
+        self.assertLess(time.time() - started, 0.05)
+        self.assertEqual(6, self.monitor.pending_events)
+
+        self.monitor._start_events_handler()
+        self._wait_for_handled_events(6)
+        self.assertEqual([tasks_api.TASK_STARTED] * 5 +
+                         [tasks_api.TASK_SUCCEEDED], self.states)
+        self.assertEqual(0, self.monitor.pending_events)
+        self.assertGreaterEqual(self.monitor.max_queue_lag, 0.25)
+        self.assertGreaterEqual(self.monitor.max_queue_lag,
+                                self.monitor.last_queue_lag)
+
+    @patch('cloudify.workflows.events.send_task_event')
+    def test_handling_error_does_not_stop_handler(self, send_task_event):
+        send_task_event.side_effect = [RuntimeError('publish failed'), None]
+        self.monitor._start_events_handler()
+        self.monitor.task_started({'uuid': '1'})
+        self.monitor.task_started({'uuid': '2'})
+        self._wait_for_handled_events(2)
+        # the state is set although its event could not be published
+        self.assertEqual([tasks_api.TASK_STARTED] * 2, self.states)
+
+    def test_stop_ends_handler(self):
+        self.monitor._receiver = MagicMock()
+        self.monitor._start_events_handler()
+        self.monitor.stop()
+        self.monitor._events_handler_thread.join(10)
+        self.assertFalse(self.monitor._events_handler_thread.is_alive())
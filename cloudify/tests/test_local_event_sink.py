@@ -0,0 +1,135 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+from os import path
+from StringIO import StringIO
+
+import testtools
+from mock import patch
+
+from cloudify import decorators
+from cloudify import exceptions
+from cloudify.test_utils import workflow_test
+from cloudify.workflows import local
+
+
+@decorators.operation
+def op(ctx, fail, **_):
+    ctx.logger.info('operation log')
+    ctx.send_event('operation event')
+    if fail:
+        raise exceptions.NonRecoverableError('failed')
+
+
+@decorators.workflow
+def execute_operation(ctx, fail, **_):
+    ctx.logger.info('workflow log')
+    instance = next(next(ctx.nodes).instances)
+    instance.execute_operation('test.op', kwargs={'fail': fail}).get()
+
+
+class JsonLinesEventSinkTest(testtools.TestCase):
+
+    blueprint_path = path.join('resources', 'blueprints',
+                               'test-event-sink-blueprint.yaml')
+
+    def setUp(self):
+        super(JsonLinesEventSinkTest, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.events_path = os.path.join(self.tmp_dir, 'events.jsonl')
+
+    def _read(self, events_path=None):
+        with open(events_path or self.events_path) as f:
+            return [json.loads(line) for line in f]
+
+    def _execute(self, cfy_local, sink, fail=False):
+        with patch('cloudify.logs.stdout_event_out') as event_out, \
+                patch('cloudify.logs.stdout_log_out') as log_out:
+            cfy_local.execute('execute_operation',
+                              task_retries=0,
+                              event_sink=sink,
+                              parameters={'fail': fail})
+        self.assertFalse(event_out.called)
+        self.assertFalse(log_out.called)
+
+    @workflow_test(blueprint_path)
+    def test_events_written_on_completion(self, cfy_local):
+        sink = local.JsonLinesEventSink(self.events_path)
+        self._execute(cfy_local, sink)
+        items = self._read()
+        event_types = [item.get('event_type') for item in items]
+        for event_type in ['workflow_started', 'sending_task',
+                           'task_started', 'task_succeeded',
+                           'workflow_succeeded']:
+            self.assertIn(event_type, event_types)
+        messages = [item['message']['text'] for item in items]
+        self.assertIn('workflow log', messages)
+        self.assertIn('operation log', messages)
+        self.assertIn('operation event', messages)
+        for item in items:
+            self.assertIn(item['type'], ['cloudify_event', 'cloudify_log'])
+            self.assertIn('timestamp', item)
+
+    @workflow_test(blueprint_path)
+    def test_events_written_on_failure(self, cfy_local):
+        sink = local.JsonLinesEventSink(self.events_path)
+        self.assertRaises(exceptions.NonRecoverableError, self._execute,
+                          cfy_local, sink, fail=True)
+        event_types = [item.get('event_type') for item in self._read()]
+        self.assertIn('task_failed', event_types)
+        self.assertEqual('workflow_failed', event_types[-1])
+
+    @workflow_test(blueprint_path)
+    def test_human_readable(self, cfy_local):
+        stream = StringIO()
+        sink = local.JsonLinesEventSink(self.events_path,
+                                        human_readable=True,
+                                        stream=stream)
+        self._execute(cfy_local, sink)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(self._read()), len(lines))
+        self.assertTrue(any("'execute_operation' workflow execution "
+                            "succeeded" in line for line in lines))
+
+    def test_buffering_and_rotation(self):
+        sink = local.JsonLinesEventSink(self.events_path,
+                                        max_bytes=1000,
+                                        backup_count=2,
+                                        buffer_size=2)
+        self.addCleanup(sink.close)
+
+        def event(i):
+            return {'event_type': 'event', 'index': i,
+                    'context': {}, 'message': {'text': 'x' * 50}}
+        sink.event_out(event(0))
+        self.assertFalse(os.path.exists(self.events_path))
+        for i in range(1, 20):
+            sink.event_out(event(i))
+        sink.flush()
+        self.assertEqual(
+            ['events.jsonl', 'events.jsonl.1', 'events.jsonl.2'],
+            sorted(os.listdir(self.tmp_dir)))
+        indexes = [item['index']
+                   for events_path in [self.events_path + '.2',
+                                       self.events_path + '.1',
+                                       self.events_path]
+                   for item in self._read(events_path)]
+        self.assertEqual(range(indexes[0], 20), indexes)
+        self.assertLessEqual(os.path.getsize(self.events_path), 1000)
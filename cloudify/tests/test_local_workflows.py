@@ -820,6 +820,51 @@ class LocalWorkflowTest(BaseWorkflowTest):
 
         self._execute_workflow(flow, operation_methods=[op0, op1, op2])
 
+    def test_node_instance_update_stores_copy(self):
+        def flow(ctx, **_):
+            pass
+        self._execute_workflow(flow)
+        storage = self.env.storage
+        instance = storage.get_node_instances()[0]
+        runtime_properties = {'key': 'value'}
+        updated = storage.update_node_instance(
+            instance.id,
+            runtime_properties=runtime_properties,
+            version=instance.version)
+        self.assertEqual(instance.version + 1, updated.version)
+        # changes made after the update are not stored
+        runtime_properties['key'] = 'changed'
+        self.assertEqual('value', storage.get_node_instance(
+            instance.id).runtime_properties['key'])
+
+    def test_node_instance_patch(self):
+        def flow(ctx, **_):
+            pass
+        self._execute_workflow(flow)
+        storage = self.env.storage
+        instance = storage.get_node_instances()[0]
+        storage.update_node_instance(
+            instance.id,
+            runtime_properties={'kept': 1, 'changed': 2, 'deleted': 3},
+            version=instance.version)
+        changed = {'changed': 20, 'added': 4}
+        patched = storage.patch_node_instance(
+            instance.id,
+            version=instance.version + 1,
+            changed_runtime_properties=changed,
+            deleted_runtime_properties=['deleted'])
+        self.assertEqual(instance.version + 2, patched.version)
+        expected = {'kept': 1, 'changed': 20, 'added': 4}
+        self.assertEqual(expected, patched.runtime_properties)
+        changed['added'] = 40
+        self.assertEqual(expected, storage.get_node_instance(
+            instance.id).runtime_properties)
+        self.assertRaises(local.StorageConflictError,
+                          storage.patch_node_instance,
+                          instance.id,
+                          version=instance.version,
+                          changed_runtime_properties={'kept': 10})
+
     def test_node_instance_version_conflict(self):
         def flow(ctx, **_):
             pass
@@ -1251,6 +1296,21 @@ class LocalWorkflowEnvironmentTest(BaseWorkflowTest):
                 node.contained_instances
             )
 
+            subgraph_list = node_host.get_contained_subgraph_list()
+            self.assertEqual(node_host, subgraph_list[0])
+            self.assertEqual(full_contained_subgraph, set(subgraph_list))
+            self.assertEqual(len(full_contained_subgraph),
+                             len(subgraph_list))
+
+            self.assertIsNone(node_host.contained_in)
+            self.assertEqual(node2, node.contained_in)
+            self.assertTrue(node.is_contained_in(node2))
+            self.assertTrue(node.is_contained_in(node_host))
+            self.assertTrue(node_host.is_contained_in(node_host))
+            self.assertFalse(node_host.is_contained_in(node))
+            self.assertFalse(node.is_contained_in(node3))
+            self.assertFalse(node3.is_contained_in(node2))
+
         self._execute_workflow(
             check_subgraph,
             create_blueprint_func=self._blueprint_3
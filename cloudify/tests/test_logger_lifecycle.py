@@ -0,0 +1,93 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import gc
+import logging
+
+import testtools
+from mock import patch
+
+from cloudify import decorators
+from cloudify import logs
+
+
+@decorators.operation
+def log_operation(ctx, **_):
+    ctx.logger.info('operation {0}'.format(ctx.task_id))
+
+
+class LoggerLifecycleTest(testtools.TestCase):
+
+    def setUp(self):
+        super(LoggerLifecycleTest, self).setUp()
+        self.logs = []
+        patcher = patch('cloudify.logs.amqp_log_out', self._out)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _out(self, log, ctx=None):
+        self.logs.append(log)
+
+    def _run_operations(self, count, start=0):
+        for i in range(start, start + count):
+            log_operation(__cloudify_context={
+                'task_id': 'lifecycle-task-{0}'.format(i),
+                'execution_id': 'execution',
+                'workflow_id': 'workflow',
+                'operation': {'name': 'op'}
+            })
+
+    def test_logger_not_registered(self):
+        handler = logs.CloudifyBaseLoggingHandler(
+            _MockContext(), self._out, lambda ctx: {})
+        logger = logs.init_cloudify_logger(handler, 'unregistered-logger')
+        self.assertNotIn('unregistered-logger',
+                         logging.Logger.manager.loggerDict)
+        logger.info('message')
+        self.assertEqual('unregistered-logger', self.logs[0]['logger'])
+
+        logs.release_cloudify_logger(logger)
+        self.assertEqual([], logger.handlers)
+        logger.info('message after release')
+        self.assertEqual(1, len(self.logs))
+
+    def test_operation_releases_logger(self):
+        self._run_operations(1)
+        self.assertEqual(1, len(self.logs))
+        self.assertNotIn('lifecycle-task-0',
+                         logging.Logger.manager.loggerDict)
+
+    def test_memory_soak(self):
+        # warm up (lazy imports, caches), then check that running more
+        # operations does not grow the logging module state or the heap
+        # (an object kept per operation is over the allowed growth)
+        self._run_operations(500)
+        del self.logs[:]
+        gc.collect()
+        loggers = len(logging.Logger.manager.loggerDict)
+        handlers = len(logging._handlerList)
+        objects = len(gc.get_objects())
+
+        self._run_operations(3000, start=500)
+        self.assertEqual(3000, len(self.logs))
+        del self.logs[:]
+        gc.collect()
+        self.assertEqual(loggers, len(logging.Logger.manager.loggerDict))
+        self.assertLessEqual(len(logging._handlerList), handlers)
+        self.assertLess(len(gc.get_objects()) - objects, 1000)
+
+
+class _MockContext(object):
+    workflow_id = 'workflow'
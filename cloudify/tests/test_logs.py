@@ -0,0 +1,180 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import logging
+
+import testtools
+from mock import MagicMock, patch
+
+from cloudify import context
+from cloudify import logs
+from cloudify.workflows import events
+from cloudify.workflows import tasks as tasks_api
+from cloudify.workflows.tasks import RemoteWorkflowTask
+
+
+class MessageContextTemplatesTest(testtools.TestCase):
+
+    def setUp(self):
+        super(MessageContextTemplatesTest, self).setUp()
+        self.events = []
+
+    def _out(self, event, ctx=None):
+        self.events.append(event)
+
+    def _task(self):
+        cloudify_context = {
+            'task_id': 'task1',
+            'task_name': 'plugin.tasks.op',
+            'task_queue': 'queue',
+            'task_target': 'target',
+            'execution_id': 'execution',
+            'workflow_id': 'workflow',
+            'blueprint_id': 'blueprint',
+            'deployment_id': 'deployment',
+            'node_id': 'node_1',
+            'node_name': 'node',
+            'plugin': 'plugin',
+            'operation': {'name': 'op'}
+        }
+        workflow_context = MagicMock(task_events_verbosity='full')
+        workflow_context.internal.task_events_progress = None
+        return RemoteWorkflowTask(kwargs={},
+                                  cloudify_context=cloudify_context,
+                                  workflow_context=workflow_context,
+                                  task_id='task1',
+                                  total_retries=2)
+
+    def test_task_message_context_built_once(self):
+        task = self._task()
+
+        def send_event_func(task, event_type, message,
+                            additional_context=None):
+            events._send_task_event_func(task, event_type, message,
+                                         out_func=self._out,
+                                         additional_context=(
+                                             additional_context))
+        with patch('cloudify.logs.message_context_from_task_context',
+                   wraps=logs.message_context_from_task_context) as builder:
+            for state in (tasks_api.TASK_SENDING, tasks_api.TASK_STARTED):
+                events.send_task_event(state, task, send_event_func, None)
+            events.send_task_event(tasks_api.TASK_SUCCEEDED, task,
+                                   send_event_func, {'result': None})
+            self.assertEqual(1, builder.call_count)
+
+        self.assertEqual(['sending_task', 'task_started', 'task_succeeded'],
+                         [event['event_type'] for event in self.events])
+        for event in self.events:
+            context = event['context']
+            self.assertEqual('task1', context['task_id'])
+            self.assertEqual('node_1', context['node_id'])
+            self.assertEqual('node', context['node_name'])
+            self.assertEqual('op', context['operation'])
+            self.assertEqual(2, context['task_total_retries'])
+        # every event gets its own context
+        self.assertIsNot(self.events[0]['context'],
+                         self.events[1]['context'])
+
+    def test_node_event_message_context_cached(self):
+        node_instance = MagicMock(id='node_1', node_id='node')
+        node_instance.ctx.workflow_id = 'workflow'
+        node_instance.ctx.blueprint.id = 'blueprint'
+        builder = MagicMock(
+            wraps=logs.message_context_from_workflow_node_instance_context)
+        with patch.dict(logs._message_context_builders,
+                        {'workflow_node': builder}):
+            logs.send_workflow_node_event(
+                node_instance, 'workflow_node_event', 'first',
+                additional_context={'extra': 1}, out_func=self._out)
+            logs.send_workflow_node_event(
+                node_instance, 'workflow_node_event', 'second',
+                out_func=self._out)
+        self.assertEqual(1, builder.call_count)
+        self.assertEqual(1, self.events[0]['context']['extra'])
+        self.assertNotIn('extra', self.events[1]['context'])
+        self.assertEqual('node_1', self.events[1]['context']['node_id'])
+        self.assertEqual('blueprint',
+                         self.events[1]['context']['blueprint_id'])
+
+
+class LoggerSettingsTest(testtools.TestCase):
+
+    def setUp(self):
+        super(LoggerSettingsTest, self).setUp()
+        self.logs = []
+
+    def _out(self, log, ctx=None):
+        self.logs.append(log)
+
+    def _logger(self, name, **kwargs):
+        ctx = MagicMock(workflow_id='workflow')
+        handler = logs.CloudifyBaseLoggingHandler(ctx, self._out,
+                                                  lambda ctx: {})
+        return logs.init_cloudify_logger(handler, name, **kwargs)
+
+    def test_parse_logging_level(self):
+        self.assertEqual(logging.DEBUG, logs.parse_logging_level('debug'))
+        self.assertEqual(logging.WARNING, logs.parse_logging_level('WARNING'))
+        self.assertEqual(logging.ERROR, logs.parse_logging_level(40))
+        self.assertEqual(logging.INFO, logs.parse_logging_level(None))
+        self.assertRaises(ValueError, logs.parse_logging_level, 'verbose')
+
+    def test_logging_level_from_context(self):
+        logger = self._logger('test-logging-level', **logs.logger_settings(
+            {logs.LOGGING_LEVEL_CONTEXT_KEY: 'debug'}))
+        logger.debug('debug message')
+        self.assertEqual(['debug'], [log['level'] for log in self.logs])
+
+        ctx = context.CloudifyContext({'task_id': 'test-operation-level',
+                                       'logging_level': 'warning'})
+        self.assertEqual(logging.WARNING, ctx.logger.level)
+
+    @patch('cloudify.logs.time.time')
+    def test_rate_limit(self, mock_time):
+        mock_time.return_value = 1000
+        logger = self._logger('test-rate-limit',
+                              rate_limit=1, rate_limit_burst=2)
+        for i in range(5):
+            logger.info('message {0}'.format(i))
+        self.assertEqual(['message 0', 'message 1'],
+                         [log['message']['text'] for log in self.logs])
+
+        mock_time.return_value = 1001
+        logger.info('message 5')
+        self.assertEqual(4, len(self.logs))
+        summary = self.logs[2]
+        self.assertEqual('warning', summary['level'])
+        self.assertEqual('test-rate-limit', summary['logger'])
+        self.assertIn('3 log messages suppressed',
+                      summary['message']['text'])
+        self.assertEqual('message 5', self.logs[3]['message']['text'])
+
+        # messages suppressed last are summarized on flush
+        logger.info('message 6')
+        logger.handlers[0].flush()
+        self.assertIn('1 log messages suppressed',
+                      self.logs[4]['message']['text'])
+        logger.handlers[0].flush()
+        self.assertEqual(5, len(self.logs))
+
+
+class LocalOutFuncsTest(testtools.TestCase):
+
+    def test_local_out_funcs(self):
+        self.assertEqual((logs.stdout_log_out, logs.stdout_event_out),
+                         logs.local_out_funcs())
+        event_sink = MagicMock()
+        self.assertEqual((event_sink.log_out, event_sink.event_out),
+                         logs.local_out_funcs(event_sink))
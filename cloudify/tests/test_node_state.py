@@ -91,3 +91,33 @@ class NodeStateTest(testtools.TestCase):
         self.assertFalse(node.dirty)
         del(node['preexisting-key'])
         self.assertTrue(node.dirty)
+
+    def test_changes(self):
+        node = NodeInstance('instance_id', 'node_id',
+                            runtime_properties={'a': 1, 'b': 2, 'c': {}})
+        self.assertEqual(({}, []), node.runtime_properties.changes)
+        node['a'] = 10
+        del node['b']
+        node.runtime_properties.update(d=4)
+        changed, deleted = node.runtime_properties.changes
+        self.assertEqual({'a': 10, 'd': 4}, changed)
+        self.assertEqual(['b'], deleted)
+        # a deleted key set again is changed, a changed key deleted again
+        # is deleted
+        node['b'] = 3
+        node.runtime_properties.pop('d')
+        changed, deleted = node.runtime_properties.changes
+        self.assertEqual({'a': 10, 'b': 3}, changed)
+        self.assertEqual(['d'], deleted)
+        node.runtime_properties.reset_changes()
+        self.assertFalse(node.dirty)
+        self.assertEqual(({}, []), node.runtime_properties.changes)
+
+    def test_changes_of_mutable_values(self):
+        node = NodeInstance('instance_id', 'node_id',
+                            runtime_properties={'a': 1, 'c': {}})
+        self.assertEqual(1, node['a'])
+        node['c']['key'] = 'value'
+        changed, deleted = node.runtime_properties.changes
+        self.assertEqual({'c': {'key': 'value'}}, changed)
+        self.assertEqual([], deleted)
@@ -15,23 +15,37 @@
 
 
 import unittest
+import json
 import os
+import shutil
+import tempfile
+import socket
 import threading
 import time
 import sys
 import subprocess
+import urllib2
 from StringIO import StringIO
 
 import testtools
+from mock import patch
 from nose.tools import nottest, istest
 
 from cloudify.mocks import MockCloudifyContext
 from cloudify.proxy import client
-from cloudify.proxy.server import (UnixCtxProxy,
+from cloudify.proxy import server
+from cloudify.proxy.server import (CtxProxy,
+                                   PathDictAccess,
+                                   UnixCtxProxy,
                                    TCPCtxProxy,
-                                   HTTPCtxProxy)
+                                   HTTPCtxProxy,
+                                   LineCtxProxy,
+                                   SharedHTTPCtxProxy,
+                                   CtxProxyServer,
+                                   get_ctx_proxy_server)
 
 IS_WINDOWS = os.name == 'nt'
+CTX_SH = os.path.join(os.path.dirname(client.__file__), 'ctx.sh')
 
 
 @nottest
@@ -194,6 +208,54 @@ class TestCtxProxy(testtools.TestCase):
         response = self.request(*args)
         self.assertEqual(args[1:], response)
 
+    def test_concurrent_requests(self):
+        responses = {}
+
+        def request(i):
+            responses[i] = self.request('stub-method', i)
+        threads = [threading.Thread(target=request, args=(i,))
+                   for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(dict((i, [i]) for i in range(10)), responses)
+        metrics = self.server.metrics
+        self.assertEqual(10, metrics.requests)
+        self.assertEqual(0, metrics.errors)
+        self.assertEqual(0, metrics.in_flight)
+        self.assertGreater(metrics.mean_latency, 0)
+        self.assertLessEqual(metrics.latency_percentile(50),
+                             metrics.max_latency)
+
+    def test_error_metrics(self):
+        self.assertRaises(client.RequestError,
+                          self.request, 'property_that_does_not_exist')
+        self.request('stub-method')
+        self.assertEqual(2, self.server.metrics.requests)
+        self.assertEqual(1, self.server.metrics.errors)
+
+    def test_batch(self):
+        response = client.client_req(self.server.socket_url, [
+            ['node', 'properties', 'prop1'],
+            ['node', 'properties', 'prop4.key', 'new_value'],
+            ['node', 'properties', 'prop4.key'],
+            ['stub-method', 1, 2]
+        ], batch=True)
+        self.assertEqual(['value1', None, 'new_value', [1, 2]], response)
+
+    def test_batch_error(self):
+        e = self.assertRaises(client.RequestError,
+                              client.client_req,
+                              self.server.socket_url,
+                              [['node', 'properties', 'prop1'],
+                               ['property_that_does_not_exist'],
+                               ['node', 'properties', 'prop4.key', 'new']],
+                              batch=True)
+        self.assertEqual(['value1'], e.results)
+        # processing stopped on the failed request
+        self.assertEqual('value', self.ctx.node.properties['prop4']['key'])
+
 
 @istest
 class TestUnixCtxProxy(TestCtxProxy):
@@ -230,6 +292,206 @@ class TestHTTPCtxProxy(TestCtxProxy):
         self.expected_exception = IOError
         super(TestHTTPCtxProxy, self).test_client_request_timeout()
 
+    def test_stalled_client(self):
+        # a client which does not complete its request does not block others
+        sock = socket.create_connection(('localhost', self.server.port))
+        self.addCleanup(sock.close)
+        sock.sendall('POST / HTTP/1.1\r\n')
+        response = client.client_req(self.server.socket_url,
+                                     ['stub_attr', 'some_property'],
+                                     timeout=2)
+        self.assertEqual('some_value', response)
+
+    def test_response_length(self):
+        # responses are written at once, with their length
+        response = urllib2.urlopen(self.server.socket_url, data=json.dumps({
+            'args': ['node', 'properties', 'prop1']}), timeout=5)
+        body = response.read()
+        self.assertEqual(str(len(body)),
+                         response.info().getheader('Content-Length'))
+        self.assertEqual('application/json',
+                         response.info().getheader('Content-Type'))
+
+
+@istest
+class TestSharedHTTPCtxProxy(TestCtxProxy):
+
+    def setUp(self):
+        self.proxy_server_class = SharedHTTPCtxProxy
+        super(TestSharedHTTPCtxProxy, self).setUp()
+
+    def start_server(self):
+        pass
+
+    def stop_server_now(self):
+        self.server.close()
+
+    def test_client_request_timeout(self):
+        self.expected_exception = IOError
+        super(TestSharedHTTPCtxProxy, self).test_client_request_timeout()
+
+    def test_server_reused(self):
+        other = SharedHTTPCtxProxy(MockCloudifyContext(node_id='other'))
+        self.addCleanup(other.close)
+        self.assertIs(self.server.proxy_server, other.proxy_server)
+        self.assertIs(get_ctx_proxy_server(), other.proxy_server)
+        self.assertNotEqual(self.server.socket_url, other.socket_url)
+        self.assertEqual('other', client.client_req(other.socket_url,
+                                                    ['instance', 'id']))
+        self.assertEqual('instance_id', self.request('instance', 'id'))
+
+    def test_forked_process(self):
+        if IS_WINDOWS:
+            self.skipTest('Test skipped on windows')
+        parent_server = get_ctx_proxy_server()
+        pid = os.fork()
+        if not pid:
+            status = 1
+            try:
+                proxy = SharedHTTPCtxProxy(MockCloudifyContext(
+                    node_id='child'))
+                if (proxy.proxy_server is not parent_server and
+                        client.client_req(proxy.socket_url,
+                                          ['instance', 'id'],
+                                          timeout=5) == 'child'):
+                    status = 0
+                proxy.close()
+            finally:
+                os._exit(status)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, status)
+        self.assertIs(parent_server, get_ctx_proxy_server())
+
+
+class TestCtxProxyServer(testtools.TestCase):
+
+    def setUp(self):
+        super(TestCtxProxyServer, self).setUp()
+        self.proxy_server = CtxProxyServer()
+        self.addCleanup(self.proxy_server.close)
+
+    def test_routing(self):
+        proxies = [self.proxy_server.create_proxy(
+            MockCloudifyContext(node_id='instance_{0}'.format(i)))
+            for i in range(3)]
+        self.assertEqual(3, self.proxy_server.proxies)
+        for i, proxy in enumerate(proxies):
+            self.assertEqual('instance_{0}'.format(i),
+                             client.client_req(proxy.socket_url,
+                                               ['instance', 'id']))
+            proxy.close()
+        self.assertEqual(0, self.proxy_server.proxies)
+
+    def test_closed_proxy(self):
+        proxy = self.proxy_server.create_proxy(
+            MockCloudifyContext(node_id='instance_id'))
+        proxy.close()
+        e = self.assertRaises(client.RequestError, client.client_req,
+                              proxy.socket_url, ['instance', 'id'])
+        self.assertIn(proxy.token, e.ex_message)
+
+
+@istest
+class TestLineCtxProxy(TestCtxProxy):
+
+    def setUp(self):
+        if IS_WINDOWS:
+            raise unittest.SkipTest('Test skipped on windows')
+        self.proxy_server_class = LineCtxProxy
+        super(TestLineCtxProxy, self).setUp()
+
+    def start_server(self):
+        pass
+
+    def stop_server_now(self):
+        self.server.close()
+
+    def test_client_request_timeout(self):
+        self.expected_exception = IOError
+        super(TestLineCtxProxy, self).test_client_request_timeout()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(5)
+        sock.connect(self.server.socket_path)
+        self.addCleanup(sock.close)
+        return sock, sock.makefile()
+
+    def test_connection_reuse(self):
+        sock, responses = self._connect()
+        sock.sendall('["node", "properties", "prop1"]\n'
+                     '{"args": ["stub-method", 1]}\n')
+        self.assertEqual({'type': 'result', 'payload': 'value1'},
+                         json.loads(responses.readline()))
+        self.assertEqual({'type': 'result', 'payload': [1]},
+                         json.loads(responses.readline()))
+
+    def test_concurrent_connections(self):
+        # more pending connections than the default listen backlog
+        connections = [self._connect() for _ in range(20)]
+        for sock, responses in connections:
+            sock.sendall('["instance", "id"]\n')
+        for sock, responses in connections:
+            self.assertEqual('instance_id',
+                             json.loads(responses.readline())['payload'])
+
+    def test_text_format(self):
+        sock, _ = self._connect()
+        sock.sendall('{"format": "text", "args": ["node", "properties", '
+                     '"prop1"]}\n'
+                     '{"format": "text", "args": ["node", "properties", '
+                     '"prop2"]}\n'
+                     '{"format": "text", "args": ["no_such_property"]}\n')
+        data = ''
+        while data.count('\0') < 3:
+            data += sock.recv(4096)
+        value, mapping, error, _ = data.split('\0')
+        self.assertEqual('result\tvalue1', value)
+        self.assertEqual("result\t{u'nested_prop1': u'nested_value1'}",
+                         mapping)
+        self.assertTrue(error.startswith('error\tRuntimeError: '))
+
+    def test_format_argument(self):
+        sock, responses = self._connect()
+        # a "format" argument does not make the request a request object
+        sock.sendall('["stub-method", "\\"format\\""]\n'
+                     '{"args": ["stub-method", '
+                     '"\\"format\\": \\"text\\""]}\n')
+        self.assertEqual({'type': 'result', 'payload': ['"format"']},
+                         json.loads(responses.readline()))
+        self.assertEqual({'type': 'result',
+                          'payload': ['"format": "text"']},
+                         json.loads(responses.readline()))
+
+    def test_shell_helper_arguments(self):
+        script = ('source {0}; _ctx_args_json plain "with space" '
+                  '\'q"uo\\te\' $\'new\\nline\' $\'\\x01\\x1b[0m\\x7f\' '
+                  '@1 \'@{{"a": [1]}}\'; '
+                  'printf "%s" "$CTX_ARGS_JSON"'.format(CTX_SH))
+        output = subprocess.check_output(['bash', '-c', script])
+        self.assertEqual(['plain', 'with space', 'q"uo\\te', 'new\nline',
+                          '\x01\x1b[0m\x7f', 1, {'a': [1]}],
+                         json.loads(output))
+
+    def test_shell_helper(self):
+        if not _which('socat'):
+            self.skipTest('socat is not installed')
+        script = ('source {0}; ctx_connect; '
+                  'value=$(ctx_call node properties prop1); '
+                  'ctx_call node properties prop4.key "$value-set"; '
+                  'ctx_call node properties prop4.key; echo; '
+                  'ctx_call no_such_property 2>/dev/null || echo failed; '
+                  'ctx_json stub-method @1; ctx_disconnect'.format(CTX_SH))
+        env = dict(os.environ, CTX_SOCKET_URL=self.server.socket_url)
+        output = subprocess.check_output(['bash', '-c', script], env=env)
+        self.assertEqual('value1-set\nfailed\n'
+                         '{"type": "result", "payload": [1]}\n', output)
+
+
+def _which(program):
+    return any(os.access(os.path.join(directory, program), os.X_OK)
+               for directory in os.environ.get('PATH', '').split(os.pathsep))
+
 
 class TestArgumentParsing(testtools.TestCase):
 
@@ -348,6 +610,282 @@ class TestArgumentParsing(testtools.TestCase):
             sys.stdout = current_stdout
 
 
+class TestBatchArguments(testtools.TestCase):
+
+    def setUp(self):
+        super(TestBatchArguments, self).setUp()
+        self.requests = []
+        self.response = None
+        self.original_client_req = client.client_req
+        client.client_req = self.mock_client_req
+        self.original_stdin, self.original_stdout = sys.stdin, sys.stdout
+        sys.stdout = StringIO()
+        self.addCleanup(self.restore)
+
+    def restore(self):
+        client.client_req = self.original_client_req
+        sys.stdin, sys.stdout = self.original_stdin, self.original_stdout
+
+    def mock_client_req(self, socket_url, args, timeout, batch=False):
+        self.requests.append((args, batch))
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+    def _main(self, commands, *args):
+        sys.stdin = StringIO(commands)
+        client.main(['--batch', '--socket-url', 'stub'] + list(args))
+        return sys.stdout.getvalue()
+
+    def test_batch(self):
+        self.response = ['value', None, {'key': 'value'}]
+        output = self._main('node properties prop1\n'
+                            '\n'
+                            '# a comment\n'
+                            'instance runtime-properties "a key" value\n'
+                            'stub-method \'@{"key": "value"}\'\n',
+                            '-j')
+        self.assertEqual([([['node', 'properties', 'prop1'],
+                            ['instance', 'runtime-properties', 'a key',
+                             'value'],
+                            ['stub-method', {'key': 'value'}]], True)],
+                         self.requests)
+        self.assertEqual('"value"\nnull\n{"key": "value"}\n', output)
+
+    def test_batch_error(self):
+        self.response = client.RequestError('message', 'type', '',
+                                            results=['value'])
+        self.assertRaises(client.RequestError, self._main,
+                          'node properties prop1\nfail\n')
+        self.assertEqual('value\n', sys.stdout.getvalue())
+
+
+class TestCtxProxyCaching(testtools.TestCase):
+
+    class CountingAttribute(object):
+
+        def __init__(self):
+            self.reads = 0
+
+        @property
+        def value(self):
+            self.reads += 1
+            return self.reads
+
+    def setUp(self):
+        super(TestCtxProxyCaching, self).setUp()
+        self.ctx = MockCloudifyContext(node_id='instance_id',
+                                       properties={'prop': 'value'},
+                                       runtime_properties={'key': 'value'})
+        self.ctx.counting_attr = self.CountingAttribute()
+        self.ctx.stub_method = lambda *args: args
+        self.proxy = CtxProxy(self.ctx, 'stub')
+
+    def request(self, *args, **kwargs):
+        request = {'args': list(args)}
+        request.update(kwargs)
+        response = json.loads(self.proxy.process(json.dumps(request)))
+        return response['type'], response['payload']
+
+    def test_reads_cached(self):
+        with patch('cloudify.proxy.server._process_ctx_request',
+                   wraps=server._process_ctx_request) as process:
+            for _ in range(3):
+                self.assertEqual(('result', 'value'),
+                                 self.request('node', 'properties', 'prop'))
+                self.assertEqual(('result', 'instance_id'),
+                                 self.request('instance', 'id'))
+            self.assertEqual(2, process.call_count)
+
+    def test_changing_values_not_cached(self):
+        for reads in range(1, 4):
+            self.assertEqual(('result', reads), self.request('counting-attr',
+                                                             'value'))
+        self.ctx.instance.runtime_properties['key'] = 'changed'
+        self.assertEqual(('result', 'changed'),
+                         self.request('instance', 'runtime-properties',
+                                      'key'))
+
+    def test_repeated_method_calls(self):
+        calls = []
+        self.ctx.stub_method = lambda *args: calls.append(args)
+        for _ in range(3):
+            self.request('stub_method', 'polling')
+        self.assertEqual([('polling',)] * 3, calls)
+
+    def test_repeated_sets(self):
+        self.request('instance', 'runtime-properties', 'key', 'v1')
+        self.ctx.instance.runtime_properties['key'] = 'other'
+        self.request('instance', 'runtime-properties', 'key', 'v1')
+        self.assertEqual('v1', self.ctx.instance.runtime_properties['key'])
+
+    def test_set_drops_cached_reads(self):
+        self.request('instance', 'runtime-properties', 'key')
+        self.request('instance', 'runtime-properties', 'key', 'new')
+        self.assertEqual(('result', 'new'),
+                         self.request('instance', 'runtime-properties',
+                                      'key'))
+
+    def test_call_drops_cached_reads(self):
+        self.request('counting_attr', 'value')
+        self.request('stub_method', 'arg')
+        self.assertEqual(('result', 2), self.request('counting_attr',
+                                                     'value'))
+
+    def test_batch(self):
+        self.assertEqual(
+            ('result', [1, 'instance_id', 2]),
+            self.request(['counting_attr', 'value'], ['instance', 'id'],
+                         ['counting_attr', 'value'], type='batch'))
+        response_type, payload = self.request(
+            ['counting_attr', 'value'], ['no_such_attr'], type='batch')
+        self.assertEqual('error', response_type)
+        self.assertEqual([3], payload['results'])
+
+    def test_parsed_paths(self):
+        segments = PathDictAccess._parse_path('a.b[1]')
+        self.assertEqual((('a', 'a', None), ('b[1]', 'b', 1)), segments)
+        self.assertIs(segments, PathDictAccess._parse_path('a.b[1]'))
+        obj = {'a': {'b': [{}, {}]}}
+        PathDictAccess(obj).set('a.b[1].c', 'value')
+        self.assertEqual('value', PathDictAccess(obj).get('a.b[1].c'))
+        self.assertRaises(RuntimeError, PathDictAccess(obj).get, 'a[0]')
+
+
+class TestCtxSnapshot(testtools.TestCase):
+
+    def setUp(self):
+        super(TestCtxSnapshot, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        ctx = MockCloudifyContext(
+            node_id='instance_id',
+            node_name='node_name',
+            deployment_id='deployment_id',
+            properties={'port': 8080,
+                        'db': {'host-name': 'localhost'},
+                        'hosts': ['a', "it's"],
+                        'enabled': True},
+            runtime_properties={'ip': '10.0.0.1'})
+        self.proxy = CtxProxy(ctx, 'stub')
+        self.addCleanup(self.proxy.close)
+        self.env = self.proxy.write_snapshot(self.directory)
+        self.snapshot = client.load_snapshot(self.env[client.CTX_SNAPSHOT])
+        self.requests = []
+        self.original_client_req = client.client_req
+        client.client_req = self.mock_client_req
+        self.original_stdin, self.original_stdout = sys.stdin, sys.stdout
+        sys.stdout = StringIO()
+        self.addCleanup(self.restore)
+
+    def restore(self):
+        client.client_req = self.original_client_req
+        sys.stdin, sys.stdout = self.original_stdin, self.original_stdout
+
+    def mock_client_req(self, socket_url, args, timeout, batch=False):
+        self.requests.append(args)
+        if batch:
+            return ['remote {0}'.format(i) for i in range(len(args))]
+        return 'remote'
+
+    def _main(self, *args):
+        client.main(['--socket-url', 'stub',
+                     '--snapshot', self.env[client.CTX_SNAPSHOT]] +
+                    list(args))
+        return sys.stdout.getvalue()
+
+    def assert_found(self, expected, *args):
+        self.assertEqual((True, expected),
+                         client.lookup_snapshot(self.snapshot, list(args)))
+
+    def assert_not_found(self, *args):
+        self.assertEqual((False, None),
+                         client.lookup_snapshot(self.snapshot, list(args)))
+
+    def test_lookup(self):
+        self.assert_found('instance_id', 'instance', 'id')
+        self.assert_found('node_name', 'node', 'name')
+        self.assert_found('deployment_id', 'deployment', 'id')
+        self.assert_found('node-instance', 'type')
+        self.assert_found(8080, 'node', 'properties', 'port')
+        self.assert_found('localhost', 'node', 'properties', 'db.host-name')
+        self.assert_found("it's", 'node', 'properties', 'hosts[1]')
+        self.assert_found({'host-name': 'localhost'},
+                          'node', 'properties', 'db')
+        self.assertEqual(4, len(client.lookup_snapshot(
+            self.snapshot, ['node', 'properties'])[1]))
+
+    def test_lookup_not_found(self):
+        self.assert_not_found('instance', 'runtime-properties', 'ip')
+        self.assert_not_found('node', 'properties', 'port', 80)
+        self.assert_not_found('node', 'properties', 'missing')
+        self.assert_not_found('node', 'properties', 'hosts[2]')
+        self.assert_not_found('node', 'properties', 'port.nested')
+        self.assert_not_found('node', 'properties', 1)
+        self.assert_not_found('node')
+        self.assert_not_found('logger', 'info', 'message')
+        self.assert_not_found()
+        self.assertEqual((False, None),
+                         client.lookup_snapshot(None, ['instance', 'id']))
+
+    def test_main(self):
+        self.assertEqual('localhost', self._main(
+            'node', 'properties', 'db.host-name'))
+        self.assertEqual([], self.requests)
+        self._main('instance', 'runtime-properties', 'ip')
+        self.assertEqual([['instance', 'runtime-properties', 'ip']],
+                         self.requests)
+
+    def test_batch(self):
+        sys.stdin = StringIO('instance id\n'
+                             'instance runtime-properties ip\n'
+                             'node properties port\n'
+                             'instance runtime-properties ip 1\n')
+        output = self._main('--batch', '-j')
+        self.assertEqual([[['instance', 'runtime-properties', 'ip'],
+                           ['instance', 'runtime-properties', 'ip', '1']]],
+                         self.requests)
+        self.assertEqual('"instance_id"\n"remote 0"\n8080\n"remote 1"\n',
+                         output)
+
+    def test_batch_error(self):
+        def failing_client_req(socket_url, args, timeout, batch=False):
+            raise client.RequestError('message', 'type', '',
+                                      results=['remote 0'])
+        client.client_req = failing_client_req
+        sys.stdin = StringIO('instance id\n'
+                             'instance runtime-properties ip\n'
+                             'fail\n'
+                             'node properties port\n')
+        self.assertRaises(client.RequestError, self._main, '--batch')
+        # commands after the failed one are not run
+        self.assertEqual('instance_id\nremote 0\n', sys.stdout.getvalue())
+
+    def test_shell_snapshot(self):
+        script = ('source {0}; printf "%s|" "$CTX_NODE_PROPERTIES_PORT" '
+                  '"$CTX_NODE_PROPERTIES_DB_HOST_NAME" "$CTX_INSTANCE_ID" '
+                  '"$CTX_NODE_PROPERTIES_ENABLED" '
+                  '"$CTX_NODE_PROPERTIES_HOSTS"'
+                  .format(self.env[client.CTX_SNAPSHOT_SH]))
+        output = subprocess.check_output(['bash', '-c', script])
+        port, host, instance_id, enabled, hosts, _ = output.split('|')
+        self.assertEqual('8080', port)
+        self.assertEqual('localhost', host)
+        self.assertEqual('instance_id', instance_id)
+        self.assertEqual('true', enabled)
+        self.assertEqual(['a', "it's"], json.loads(hosts))
+
+    def test_close_removes_snapshot(self):
+        self.proxy.close()
+        self.assertEqual([], os.listdir(self.directory))
+        proxy = CtxProxy(MockCloudifyContext(node_id='instance_id'), 'stub')
+        env = proxy.write_snapshot()
+        directory = os.path.dirname(env[client.CTX_SNAPSHOT])
+        self.assertTrue(os.path.isfile(env[client.CTX_SNAPSHOT_SH]))
+        proxy.close()
+        self.assertFalse(os.path.exists(directory))
+
+
 class TestCtxEntryPoint(testtools.TestCase):
 
     def test_ctx_in_path(self):
@@ -0,0 +1,72 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import testtools
+from mock import MagicMock
+
+from cloudify.workflows import events
+from cloudify.workflows.workflow_context import RemoteContextHandler
+
+
+class RoutedTaskEventsTest(testtools.TestCase):
+
+    def test_routing_keys(self):
+        self.assertEqual('task.started.exec1',
+                         events.routed_task_event_routing_key('task-started',
+                                                              'exec1'))
+        self.assertEqual('task.*.exec1',
+                         events.routed_task_events_binding_key('exec1'))
+
+    def test_monitor_routing_key(self):
+        self.assertEqual('#', events.Monitor(None).routing_key)
+        self.assertEqual('task.*.exec1',
+                         events.Monitor(None, execution_id='exec1')
+                         .routing_key)
+
+    def test_publish_routed_task_event(self):
+        app = MagicMock()
+        producer = app.producer_or_acquire.return_value.__enter__.return_value
+        kwargs = {'__cloudify_context': {
+            'execution_id': 'exec1',
+            events.ROUTED_TASK_EVENTS_CONTEXT_KEY: True}}
+        events._publish_routed_task_event(app, 'task-failed', kwargs,
+                                          uuid='task1',
+                                          exception='OperationRetry()')
+        self.assertEqual(1, producer.publish.call_count)
+        args, call_kwargs = producer.publish.call_args
+        self.assertEqual('task.failed.exec1', call_kwargs['routing_key'])
+        self.assertEqual('task-failed', args[0]['type'])
+        self.assertEqual('task1', args[0]['uuid'])
+        self.assertEqual('OperationRetry()', args[0]['exception'])
+
+    def test_publish_routed_task_event_not_requested(self):
+        app = MagicMock()
+        events._publish_routed_task_event(
+            app, 'task-started',
+            {'__cloudify_context': {'execution_id': 'exec1'}},
+            uuid='task1')
+        events._publish_routed_task_event(app, 'task-started', None,
+                                          uuid='task1')
+        self.assertFalse(app.producer_or_acquire.called)
+
+    def test_operation_context_requests_routed_events(self):
+        def operation_context(routed_task_events):
+            handler = RemoteContextHandler(
+                MagicMock(_routed_task_events=routed_task_events))
+            return handler.operation_cloudify_context
+        self.assertNotIn(events.ROUTED_TASK_EVENTS_CONTEXT_KEY,
+                         operation_context(False))
+        self.assertTrue(operation_context(True)[
+            events.ROUTED_TASK_EVENTS_CONTEXT_KEY])
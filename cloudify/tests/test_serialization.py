@@ -0,0 +1,129 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import datetime
+import json
+import time
+
+import testtools
+from mock import patch
+
+from cloudify import amqp_client
+from cloudify import logs
+from cloudify import serialization
+
+
+class TimestampFormatterTest(testtools.TestCase):
+
+    def test_format(self):
+        formatter = serialization.TimestampFormatter()
+        now = time.time()
+        expected = '{0}.{1:03d}{2}'.format(
+            datetime.datetime.fromtimestamp(int(now)),
+            int((now - int(now)) * 1000),
+            time.strftime('%z', time.gmtime()))
+        self.assertEqual(expected, formatter(now))
+
+    def test_whole_second(self):
+        formatter = serialization.TimestampFormatter()
+        self.assertTrue(formatter(1000.0).endswith(':40.000{0}'.format(
+            formatter.timezone_suffix())))
+
+    def test_cached_per_second_and_hour(self):
+        formatter = serialization.TimestampFormatter()
+        with patch('cloudify.serialization.time.strftime',
+                   wraps=time.strftime) as strftime:
+            first = formatter(3600.1)
+            second = formatter(3600.2)
+            self.assertEqual(2, strftime.call_count)
+            formatter(3601.2)
+            self.assertEqual(3, strftime.call_count)
+            formatter(7200.2)
+            self.assertEqual(5, strftime.call_count)
+        self.assertEqual(first[:-9], second[:-9])
+        self.assertNotEqual(first, second)
+
+    def test_populate_base_item(self):
+        item = {}
+        logs.populate_base_item(item, 'cloudify_log')
+        self.assertEqual('cloudify_log', item['type'])
+        self.assertIsNone(item['message_code'])
+        self.assertRegexpMatches(
+            item['timestamp'],
+            r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{3}[+-]\d{4}$')
+
+
+class JsonEncoderTest(testtools.TestCase):
+
+    def test_set_json_encoder(self):
+        self.addCleanup(serialization.set_json_encoder)
+        serialization.set_json_encoder(lambda obj: 'encoded')
+        self.assertEqual('encoded', serialization.dumps({}))
+        serialization.set_json_encoder(json.dumps)
+        self.assertEqual({'key': [1, 'value']}, json.loads(
+            serialization.dumps({'key': [1, 'value']})))
+
+
+class MessageEncodingTest(testtools.TestCase):
+
+    def _event(self):
+        return {'event_type': 'workflow_failed',
+                'message': {'text': 'failed',
+                            'arguments': {'error': 'traceback ' * 100}}}
+
+    def test_small_message_not_compressed(self):
+        body, content_encoding = serialization.encode_message(
+            {'key': 'value'}, compress_threshold=100)
+        self.assertIsNone(content_encoding)
+        self.assertEqual({'key': 'value'}, json.loads(body))
+        self.assertEqual({'key': 'value'},
+                         serialization.decode_message(body))
+
+    def test_large_message_compressed(self):
+        event = self._event()
+        body, content_encoding = serialization.encode_message(
+            event, compress_threshold=100)
+        self.assertEqual(serialization.DEFLATE_CONTENT_ENCODING,
+                         content_encoding)
+        self.assertLess(len(body), len(json.dumps(event)))
+        self.assertEqual(event, serialization.decode_message(
+            body, content_encoding))
+
+    def test_compression_disabled(self):
+        _, content_encoding = serialization.encode_message(self._event())
+        self.assertIsNone(content_encoding)
+
+    def test_unsupported_content_encoding(self):
+        self.assertRaises(ValueError, serialization.decode_message,
+                          '{}', 'br')
+
+    @patch('cloudify.amqp_client.pika.BlockingConnection')
+    def test_amqp_client_content_encoding(self, _):
+        client = amqp_client.AMQPClient(amqp_host='localhost',
+                                        compress_threshold=100)
+        publish = client.events_queue.basic_publish
+        client.publish_event({'key': 'value'})
+        self.assertIsNone(publish.call_args[1]['properties'])
+
+        event = self._event()
+        client.publish_event(event)
+        kwargs = publish.call_args[1]
+        properties = kwargs['properties']
+        self.assertEqual(serialization.DEFLATE_CONTENT_ENCODING,
+                         properties.content_encoding)
+        self.assertEqual('application/json', properties.content_type)
+        self.assertEqual(event, serialization.decode_message(
+            kwargs['body'], properties.content_encoding))
+        client.close()
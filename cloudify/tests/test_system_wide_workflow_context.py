@@ -0,0 +1,244 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import testtools
+from mock import patch
+
+from cloudify import exceptions
+from cloudify.workflows import events
+from cloudify.workflows import deployments_runner
+from cloudify.workflows.workflow_context import (
+    CloudifySystemWideWorkflowContext)
+from cloudify_rest_client.deployments import Deployment
+
+
+class MockDeploymentsRestClient(object):
+
+    def __init__(self, num_deployments, list_delay=0):
+        self.list_delay = list_delay
+        self.deployments = self
+        self.nodes = self
+        self.node_instances = self
+        self.manager = self
+        self._deployments = [
+            Deployment({'id': 'd{0}'.format(i), 'blueprint_id': 'b'})
+            for i in range(num_deployments)]
+        self._lock = threading.Lock()
+        self.concurrent_lists = 0
+        self.max_concurrent_lists = 0
+
+    def list(self, deployment_id=None):
+        if deployment_id is None:
+            return self._deployments
+        with self._lock:
+            self.concurrent_lists += 1
+            self.max_concurrent_lists = max(self.max_concurrent_lists,
+                                            self.concurrent_lists)
+        time.sleep(self.list_delay)
+        with self._lock:
+            self.concurrent_lists -= 1
+        return []
+
+    def get_context(self):
+        return {'context': {}}
+
+
+class SystemWideWorkflowContextTest(testtools.TestCase):
+
+    def _ctx(self, rest, **context):
+        self._patch('cloudify.manager.get_rest_client', rest)
+        self._patch(
+            'cloudify.workflows.workflow_context.get_rest_client', rest)
+        context.update({
+            'execution_id': 'execution',
+            'workflow_id': 'workflow'})
+        return CloudifySystemWideWorkflowContext(context)
+
+    def _patch(self, target, rest):
+        patcher = patch(target, return_value=rest)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_prefetch_deployments_contexts(self):
+        rest = MockDeploymentsRestClient(num_deployments=12, list_delay=0.05)
+        ctx = self._ctx(rest)
+        dep_contexts = ctx.prefetch_deployments_contexts(concurrency=4)
+        self.assertEqual(12, len(dep_contexts))
+        self.assertLessEqual(rest.max_concurrent_lists, 4)
+        self.assertGreater(rest.max_concurrent_lists, 1)
+        for dep_id, dep_ctx in dep_contexts.items():
+            self.assertEqual(dep_id, dep_ctx.deployment.id)
+        # contexts were loaded by the prefetch, no more list calls expected
+        rest.list_delay = 100
+        self.assertEqual('d3', dep_contexts['d3'].deployment.id)
+
+    def test_prefetch_some_deployments_contexts(self):
+        rest = MockDeploymentsRestClient(num_deployments=3)
+        ctx = self._ctx(rest)
+        ctx.prefetch_deployments_contexts(deployment_ids=['d1'])
+        loaders = ctx._dep_contexts_loaders
+        self.assertTrue(hasattr(loaders['d1'], '_cached_ctx'))
+        self.assertFalse(hasattr(loaders['d0'], '_cached_ctx'))
+
+    def test_deployments_contexts_share_event_monitor(self):
+        rest = MockDeploymentsRestClient(num_deployments=2)
+        ctx = self._ctx(rest)
+        monitor = events.Monitor(ctx.internal.task_graph)
+        ctx.internal._event_monitor = monitor
+        dep_ctx = ctx.deployments_contexts['d0']
+        self.assertIs(monitor, dep_ctx.internal.event_monitor)
+
+        dep_ctx.internal.start_event_monitor()
+        graph = dep_ctx.graph_mode()
+        task = dep_ctx.local_task(local_task=lambda: None)
+        graph.add_task(task)
+        self.assertIsNone(ctx.internal.task_graph.get_task(task.id))
+        self.assertIs(task, monitor._get_task(task.id))
+        dep_ctx.internal.stop_event_monitor()
+        self.assertIsNone(monitor._get_task(task.id))
+
+
+class DeploymentsGraphRunnerTest(testtools.TestCase):
+
+    def setUp(self):
+        super(DeploymentsGraphRunnerTest, self).setUp()
+        rest = MockDeploymentsRestClient(num_deployments=3)
+        for target in ['cloudify.manager.get_rest_client',
+                       'cloudify.workflows.workflow_context.get_rest_client']:
+            patcher = patch(target, return_value=rest)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.ctx = CloudifySystemWideWorkflowContext({
+            'execution_id': 'execution',
+            'workflow_id': 'workflow',
+            'task_retries': 0,
+            'local_task_thread_pool_size': 4})
+        self.ctx.internal._event_monitor = events.Monitor(
+            self.ctx.internal.task_graph)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.invocations = []
+
+    def _task(self, deployment_id, index, fail=False, duration=0.05):
+        def task():
+            with self.lock:
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            time.sleep(duration)
+            with self.lock:
+                self.running -= 1
+                self.invocations.append((deployment_id, index))
+            if fail:
+                raise exceptions.NonRecoverableError('failed')
+        return task
+
+    def _build_graph(self, failing_deployment=None):
+        def build_graph(ctx, graph):
+            deployment_id = ctx.deployment.id
+            for i in range(4):
+                graph.add_task(ctx.local_task(
+                    local_task=self._task(
+                        deployment_id, i,
+                        fail=deployment_id == failing_deployment),
+                    send_task_events=False))
+        return build_graph
+
+    def test_global_concurrency(self):
+        reports = []
+        progress = self.ctx.execute_in_deployments(
+            self._build_graph(),
+            concurrency=2,
+            on_progress=reports.append)
+        self.assertEqual(12, len(self.invocations))
+        self.assertLessEqual(self.max_running, 2)
+        self.assertEqual(['d0', 'd1', 'd2'], sorted(progress))
+        for deployment_progress in progress.values():
+            self.assertEqual(deployment_progress.state,
+                             deployments_runner.DEPLOYMENT_SUCCEEDED)
+            self.assertEqual(4, deployment_progress.completed_tasks)
+            self.assertEqual(0, deployment_progress.remaining_tasks)
+        self.assertEqual([progress], reports)
+
+    def test_fair_scheduling(self):
+        self.ctx.execute_in_deployments(self._build_graph(),
+                                        concurrency=3,
+                                        on_progress=lambda _: None)
+        first_round = set(deployment_id for deployment_id, _
+                          in self.invocations[:3])
+        self.assertEqual(set(['d0', 'd1', 'd2']), first_round)
+
+    def test_deployment_failure(self):
+        runner = deployments_runner.DeploymentsGraphRunner(
+            self.ctx,
+            self._build_graph(failing_deployment='d1'),
+            concurrency=12,
+            on_progress=lambda _: None)
+        e = self.assertRaises(RuntimeError, runner.run)
+        self.assertIn('d1', str(e))
+        self.assertEqual(deployments_runner.DEPLOYMENT_FAILED,
+                         runner.progress['d1'].state)
+        for deployment_id in ['d0', 'd2']:
+            self.assertEqual(deployments_runner.DEPLOYMENT_SUCCEEDED,
+                             runner.progress[deployment_id].state)
+
+    def test_failed_deployment_tasks_in_flight(self):
+        def build_graph(ctx, graph):
+            deployment_id = ctx.deployment.id
+
+            def add_task(index, **kwargs):
+                task = ctx.local_task(local_task=self._task(
+                    deployment_id, index, **kwargs), send_task_events=False)
+                graph.add_task(task)
+                return task
+            if deployment_id == 'd0':
+                # fails while its slow task is still running
+                add_task(0, duration=0.5)
+                graph.add_dependency(add_task(2, fail=True),
+                                     add_task(1, duration=0.01))
+            else:
+                for i in range(6):
+                    add_task(i, duration=0.1)
+        runner = deployments_runner.DeploymentsGraphRunner(
+            self.ctx,
+            build_graph,
+            deployment_ids=['d0', 'd1'],
+            concurrency=3,
+            on_progress=lambda _: None)
+        self.assertRaises(RuntimeError, runner.run)
+        self.assertEqual(9, len(self.invocations))
+        self.assertLessEqual(self.max_running, 3)
+        self.assertEqual(0, runner.progress['d1'].in_flight_tasks)
+
+    def test_task_dump_request(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        task_dump = os.path.join(directory, 'dump')
+        open(task_dump, 'w').close()
+        with patch.dict(os.environ, {'WORKFLOW_TASK_DUMP': task_dump}):
+            self.ctx.execute_in_deployments(self._build_graph(),
+                                            on_progress=lambda _: None)
+        self.assertFalse(os.path.exists(task_dump))
+        dumps = os.listdir(directory)
+        self.assertEqual(1, len(dumps))
+        with open(os.path.join(directory, dumps[0])) as f:
+            self.assertIn('tasks', json.load(f))
@@ -0,0 +1,138 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+from os import path
+
+import testtools
+from mock import patch
+
+from cloudify import decorators
+from cloudify import exceptions
+from cloudify.test_utils import workflow_test
+from cloudify.workflows import events as events_api
+
+
+@decorators.operation
+def op(fail, **_):
+    if fail:
+        raise exceptions.NonRecoverableError('failed')
+
+
+@decorators.workflow
+def execute_operation(ctx, fail, **_):
+    graph = ctx.graph_mode()
+    for i, instance in enumerate(next(ctx.nodes).instances):
+        # only the first operation fails
+        graph.add_task(instance.execute_operation('test.op', kwargs={
+            'fail': fail and i == 0
+        }))
+    graph.execute()
+
+
+class TaskEventsVerbosityTests(testtools.TestCase):
+
+    blueprint_path = path.join('resources', 'blueprints',
+                               'test-task-events-verbosity-blueprint.yaml')
+
+    def _execute(self, cfy_local, verbosity, fail=False):
+        events = []
+
+        def event_output(event, ctx=None):
+            events.append(event)
+        with patch('cloudify.logs.stdout_event_out', event_output):
+            try:
+                cfy_local.execute('execute_operation',
+                                  task_retries=0,
+                                  task_events_verbosity=verbosity,
+                                  parameters={'fail': fail})
+            except RuntimeError:
+                if not fail:
+                    raise
+        return [event['event_type'] for event in events], events
+
+    @workflow_test(blueprint_path)
+    def test_full(self, cfy_local):
+        event_types, _ = self._execute(cfy_local, events_api.TASK_EVENTS_FULL)
+        self.assertEqual(4, event_types.count('sending_task'))
+        self.assertEqual(4, event_types.count('task_started'))
+        self.assertEqual(4, event_types.count('task_succeeded'))
+        self.assertNotIn('workflow_progress', event_types)
+
+    @workflow_test(blueprint_path)
+    def test_failures(self, cfy_local):
+        event_types, _ = self._execute(cfy_local,
+                                       events_api.TASK_EVENTS_FAILURES,
+                                       fail=True)
+        for event_type in ['sending_task', 'task_started', 'task_succeeded']:
+            self.assertNotIn(event_type, event_types)
+        self.assertEqual(1, event_types.count('task_failed'))
+        self.assertIn('workflow_started', event_types)
+
+    @workflow_test(blueprint_path)
+    def test_progress(self, cfy_local):
+        event_types, events = self._execute(cfy_local,
+                                            events_api.TASK_EVENTS_PROGRESS)
+        for event_type in ['sending_task', 'task_started', 'task_succeeded']:
+            self.assertNotIn(event_type, event_types)
+        progress = [event for event in events
+                    if event['event_type'] == 'workflow_progress']
+        self.assertEqual(1, len(progress))
+        arguments = progress[0]['message']['arguments']
+        self.assertEqual(4, arguments['total'])
+        self.assertEqual(4, arguments['succeeded'])
+        self.assertEqual(0, arguments['remaining'])
+        self.assertEqual(0, arguments['in_flight'])
+        self.assertGreater(arguments['throughput'], 0)
+        self.assertEqual(0, arguments['eta'])
+
+    @workflow_test(blueprint_path)
+    def test_invalid_verbosity(self, cfy_local):
+        self.assertRaises(ValueError, cfy_local.execute, 'execute_operation',
+                          task_events_verbosity='everything',
+                          parameters={'fail': False})
+
+
+class TaskEventsProgressTest(testtools.TestCase):
+
+    def test_periodic_report(self):
+        sent = []
+
+        class MockInternal(object):
+            def send_workflow_event(self, **kwargs):
+                sent.append(kwargs)
+
+        class MockWorkflowContext(object):
+            workflow_id = 'workflow'
+            internal = MockInternal()
+
+        class MockTask(object):
+            send_task_events = True
+
+        progress = events_api.TaskEventsProgress(MockWorkflowContext(),
+                                                 interval=0)
+        task = MockTask()
+        for _ in range(3):
+            progress.task_added(task)
+        progress.task_state_changed(task, 'sending')
+        self.assertEqual(1, len(sent))
+        self.assertEqual(1, sent[0]['args']['in_flight'])
+        self.assertIsNone(sent[0]['args']['eta'])
+        progress.interval = 3600
+        progress.task_state_changed(task, 'succeeded')
+        self.assertEqual(1, len(sent))
+        progress.report()
+        self.assertEqual(2, sent[1]['args']['remaining'])
+        self.assertEqual(0, sent[1]['args']['in_flight'])
+        self.assertIn('1/3 tasks succeeded', sent[1]['message'])
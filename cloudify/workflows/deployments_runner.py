@@ -0,0 +1,242 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+
+import time
+
+from cloudify.workflows import api
+from cloudify.workflows import tasks
+from cloudify.workflows.tasks_graph import SubgraphTask
+
+DEFAULT_DEPLOYMENTS_TASKS_CONCURRENCY = 50
+DEFAULT_PROGRESS_INTERVAL = 30
+
+DEPLOYMENT_PENDING = 'pending'
+DEPLOYMENT_RUNNING = 'running'
+DEPLOYMENT_SUCCEEDED = 'succeeded'
+DEPLOYMENT_FAILED = 'failed'
+
+
+class DeploymentProgress(object):
+    """Progress of a deployment graph executed by a DeploymentsGraphRunner"""
+
+    def __init__(self, deployment_id):
+        self.deployment_id = deployment_id
+        self.state = DEPLOYMENT_PENDING
+        self.completed_tasks = 0
+        self.remaining_tasks = 0
+        self.in_flight_tasks = 0
+        self.error = None
+
+    @property
+    def is_terminated(self):
+        return self.state in (DEPLOYMENT_SUCCEEDED, DEPLOYMENT_FAILED)
+
+    def __str__(self):
+        return '{0}: {1} [completed={2}, in_flight={3}, remaining={4}]'\
+            .format(self.deployment_id, self.state, self.completed_tasks,
+                    self.in_flight_tasks, self.remaining_tasks)
+
+
+class DeploymentsGraphRunner(object):
+    """
+    Executes a graph per deployment, for many deployments concurrently.
+
+    All graphs are driven by a single scheduling loop which keeps the
+    number of tasks in flight across all deployments under a global
+    budget. Executable tasks are picked round robin across deployments
+    (starting from a different deployment on every round) so a deployment
+    with a big graph can not starve the others.
+
+    A failing deployment graph does not stop the other graphs, failures are
+    reported when all graphs terminated.
+
+    :param ctx: a CloudifySystemWideWorkflowContext instance
+    :param build_graph: a function called with a deployment workflow
+                        context and its task graph (already in graph mode)
+                        that adds the deployment tasks to the graph
+    :param deployment_ids: the deployments to run on (default: all)
+    :param concurrency: the maximum number of tasks in flight across all
+                        deployments
+    :param progress_interval: seconds between progress reports
+    :param on_progress: an optional function called with the progress dict
+                        (deployment id -> DeploymentProgress) on every
+                        progress report and when all graphs terminated.
+                        When not provided, progress is written to the
+                        workflow logger.
+    """
+
+    def __init__(self,
+                 ctx,
+                 build_graph,
+                 deployment_ids=None,
+                 concurrency=DEFAULT_DEPLOYMENTS_TASKS_CONCURRENCY,
+                 progress_interval=DEFAULT_PROGRESS_INTERVAL,
+                 on_progress=None):
+        self.ctx = ctx
+        self.build_graph = build_graph
+        self.deployment_ids = deployment_ids
+        self.concurrency = concurrency
+        self.progress_interval = progress_interval
+        self.on_progress = on_progress or self._log_progress
+        self.progress = {}
+        self._graphs = {}
+        # tasks sent and not terminated yet, by deployment id (including
+        # failed deployments, whose tasks may still be running)
+        self._in_flight = {}
+        self._round = 0
+
+    def run(self):
+        """
+        Build and execute the deployments graphs.
+        Blocks until all graphs terminated.
+
+        :return: a dict of deployment id -> DeploymentProgress
+        """
+        dep_contexts = self.ctx.prefetch_deployments_contexts(
+            deployment_ids=self.deployment_ids)
+        deployment_ids = sorted(self.deployment_ids or dep_contexts.keys())
+        entered = []
+        try:
+            for deployment_id in deployment_ids:
+                dep_ctx = dep_contexts[deployment_id]
+                dep_ctx.__enter__()
+                entered.append(dep_ctx)
+                graph = dep_ctx.graph_mode()
+                self.build_graph(dep_ctx, graph)
+                self._graphs[deployment_id] = graph
+                self._in_flight[deployment_id] = set()
+                self.progress[deployment_id] = \
+                    DeploymentProgress(deployment_id)
+            self._execute()
+        finally:
+            for dep_ctx in entered:
+                dep_ctx.__exit__()
+        self.on_progress(self.progress)
+
+        failed = [progress for progress in self.progress.values()
+                  if progress.state == DEPLOYMENT_FAILED]
+        if failed:
+            raise RuntimeError(
+                'Workflow failed on {0} deployment(s): {1}'.format(
+                    len(failed),
+                    ', '.join('{0} ({1})'.format(p.deployment_id, p.error)
+                              for p in failed)))
+        return self.progress
+
+    def _execute(self):
+        last_report = time.time()
+        while True:
+            if api.has_cancel_request():
+                raise api.ExecutionCancelled()
+
+            running = [deployment_id for deployment_id in sorted(self._graphs)
+                       if not self.progress[deployment_id].is_terminated]
+            for deployment_id in running:
+                self._handle_terminated_tasks(deployment_id)
+            for deployment_id in self._graphs:
+                if self.progress[deployment_id].state == DEPLOYMENT_FAILED:
+                    self._prune_in_flight(deployment_id)
+            running = [deployment_id for deployment_id in running
+                       if not self.progress[deployment_id].is_terminated]
+            if not running:
+                return
+
+            self._schedule(running)
+
+            now = time.time()
+            if now - last_report >= self.progress_interval:
+                self.on_progress(self.progress)
+                last_report = now
+            time.sleep(0.1)
+
+    def _handle_terminated_tasks(self, deployment_id):
+        graph = self._graphs[deployment_id]
+        progress = self.progress[deployment_id]
+        in_flight = self._in_flight[deployment_id]
+        try:
+            terminated = graph.handle_terminated_tasks()
+        except RuntimeError as e:
+            progress.state = DEPLOYMENT_FAILED
+            progress.error = str(e)
+            self.ctx.logger.error('Deployment {0} failed: {1}'
+                                  .format(deployment_id, e))
+            self._prune_in_flight(deployment_id)
+        else:
+            progress.completed_tasks += len(terminated)
+            in_flight.difference_update(terminated)
+            if len(graph.graph.node) == 0:
+                progress.state = DEPLOYMENT_SUCCEEDED
+        progress.remaining_tasks = len(graph.graph.node)
+        progress.in_flight_tasks = len(in_flight)
+
+    def _prune_in_flight(self, deployment_id):
+        """
+        Drop the terminated tasks of a deployment whose graph is not handled
+        anymore from its in flight tasks.
+        """
+        in_flight = self._in_flight[deployment_id]
+        in_flight.difference_update([task for task in in_flight
+                                     if not _is_in_flight(task)])
+        self.progress[deployment_id].in_flight_tasks = len(in_flight)
+
+    def _schedule(self, running):
+        budget = self.concurrency - sum(len(in_flight) for in_flight
+                                        in self._in_flight.values())
+        # rotate the deployment picked first on each round
+        offset = self._round % len(running)
+        self._round += 1
+        ordered = running[offset:] + running[:offset]
+        executable = dict(
+            (deployment_id,
+             self._graphs[deployment_id].executable_tasks())
+            for deployment_id in ordered)
+        while budget > 0 and executable:
+            for deployment_id in ordered:
+                tasks_iter = executable.get(deployment_id)
+                if tasks_iter is None:
+                    continue
+                task = next(tasks_iter, None)
+                if task is None:
+                    del executable[deployment_id]
+                    continue
+                self._graphs[deployment_id].execute_task(task)
+                self.progress[deployment_id].state = DEPLOYMENT_RUNNING
+                if _is_in_flight(task):
+                    self._in_flight[deployment_id].add(task)
+                    self.progress[deployment_id].in_flight_tasks += 1
+                    budget -= 1
+                    if budget <= 0:
+                        break
+
+    def _log_progress(self, progress):
+        counts = {}
+        for deployment_progress in progress.values():
+            counts[deployment_progress.state] = \
+                counts.get(deployment_progress.state, 0) + 1
+        self.ctx.logger.info(
+            'Deployments progress: {0}'.format(', '.join(
+                '{0}={1}'.format(state, counts.get(state, 0))
+                for state in (DEPLOYMENT_PENDING, DEPLOYMENT_RUNNING,
+                              DEPLOYMENT_SUCCEEDED, DEPLOYMENT_FAILED))))
+        for deployment_progress in progress.values():
+            self.ctx.logger.debug(str(deployment_progress))
+
+
+def _is_in_flight(task):
+    return (not isinstance(task, SubgraphTask) and
+            task.get_state() in (tasks.TASK_SENDING,
+                                 tasks.TASK_SENT,
+                                 tasks.TASK_STARTED))
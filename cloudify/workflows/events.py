@@ -14,22 +14,108 @@
 #    * limitations under the License.
 
 
+import logging
+import threading
+import time
+import Queue
+
 from cloudify import logs
 from cloudify.exceptions import OperationRetry
 from cloudify.workflows import tasks as tasks_api
 
+# celery publishes task events to the events exchange with routing keys such
+# as 'task.started'. Routed task events are republished by the workers with
+# the execution id appended so a workflow only receives its own events.
+ALL_TASK_EVENTS_ROUTING_KEY = '#'
+ROUTED_TASK_EVENT_ROUTING_KEY = 'task.{0}.{1}'
+ROUTED_TASK_EVENTS_BINDING_KEY = 'task.*.{0}'
+ROUTED_TASK_EVENTS_CONTEXT_KEY = 'routed_task_events'
+
+# Which task events an execution sends (the 'task_events_verbosity'
+# execution context key)
+TASK_EVENTS_FULL = 'full'
+TASK_EVENTS_FAILURES = 'failures'
+TASK_EVENTS_PROGRESS = 'progress'
+TASK_EVENTS_VERBOSITIES = (TASK_EVENTS_FULL,
+                           TASK_EVENTS_FAILURES,
+                           TASK_EVENTS_PROGRESS)
+DEFAULT_TASK_EVENTS_PROGRESS_INTERVAL = 30
+
+
+def routed_task_event_routing_key(event_type, execution_id):
+    """
+    :param event_type: a celery task event type (e.g. 'task-started')
+    :param execution_id: the execution id of the task
+    :return: the routing key a routed task event is published with
+    """
+    return ROUTED_TASK_EVENT_ROUTING_KEY.format(
+        event_type.split('-', 1)[1], execution_id)
+
+
+def routed_task_events_binding_key(execution_id):
+    """
+    :param execution_id: the execution id
+    :return: the binding key matching all routed task events of the execution
+    """
+    return ROUTED_TASK_EVENTS_BINDING_KEY.format(execution_id)
+
 
 class Monitor(object):
     """Monitor with handlers for different celery events"""
 
-    def __init__(self, tasks_graph):
+    def __init__(self, tasks_graph, execution_id=None):
         """
         :param tasks_graph: The task graph. Used to extract tasks based on the
                             events task id.
+        :param execution_id: When provided, only routed task events of this
+                             execution are received instead of the task
+                             events of the whole cluster.
         """
         self.tasks_graph = tasks_graph
+        self.execution_id = execution_id
         self._receiver = None
         self._should_stop = False
+        # graphs of other workflow contexts sharing this monitor
+        # (replaced, never mutated, so it can be read without locking)
+        self._shared_tasks_graphs = ()
+        self._shared_tasks_graphs_lock = threading.Lock()
+        # received events are handled by a separate thread so slow event
+        # publishing does not hold back the receiver
+        self._events_queue = Queue.Queue()
+        self._events_handler_thread = None
+        self.handled_events = 0
+        self.last_queue_lag = 0
+        self.max_queue_lag = 0
+
+    @property
+    def pending_events(self):
+        """Number of received events not handled yet"""
+        return self._events_queue.qsize()
+
+    def add_tasks_graph(self, tasks_graph):
+        """Handle events of tasks in ``tasks_graph`` as well
+
+        :param tasks_graph: a task graph of another workflow context that
+                            shares this monitor instead of starting its own
+        """
+        with self._shared_tasks_graphs_lock:
+            self._shared_tasks_graphs += (tasks_graph,)
+
+    def remove_tasks_graph(self, tasks_graph):
+        """Stop handling events of tasks in ``tasks_graph``"""
+        with self._shared_tasks_graphs_lock:
+            self._shared_tasks_graphs = tuple(
+                graph for graph in self._shared_tasks_graphs
+                if graph is not tasks_graph)
+
+    def _get_task(self, task_id):
+        task = self.tasks_graph.get_task(task_id)
+        if task is None:
+            for tasks_graph in self._shared_tasks_graphs:
+                task = tasks_graph.get_task(task_id)
+                if task is not None:
+                    break
+        return task
 
     def task_sent(self, event):
         pass
@@ -56,16 +142,53 @@ class Monitor(object):
         pass
 
     def _handle(self, state, event):
+        self._events_queue.put((state, event, time.time()))
+
+    def _handle_event(self, state, event):
         task_id = event['uuid']
-        task = self.tasks_graph.get_task(task_id)
+        task = self._get_task(task_id)
         if task is not None:
-            send_task_event(state, task, send_task_event_func_remote,
-                            event)
-            task.set_state(state)
+            try:
+                send_task_event(state, task, send_task_event_func_remote,
+                                event)
+            finally:
+                # the task state is set even if the event is not published,
+                # as the workflow waits for it
+                task.set_state(state)
+
+    def _start_events_handler(self):
+        thread = threading.Thread(target=self._handle_events)
+        thread.daemon = True
+        thread.start()
+        self._events_handler_thread = thread
+
+    def _handle_events(self):
+        while True:
+            item = self._events_queue.get()
+            if item is None:
+                return
+            state, event, received_at = item
+            lag = time.time() - received_at
+            self.last_queue_lag = lag
+            self.max_queue_lag = max(self.max_queue_lag, lag)
+            try:
+                self._handle_event(state, event)
+            except BaseException as e:
+                logging.getLogger('cloudify_events').warning(
+                    'Error handling task event [state={0}, event={1}, '
+                    'error={2}]'.format(state, event, e))
+            self.handled_events += 1
+
+    @property
+    def routing_key(self):
+        if self.execution_id is None:
+            return ALL_TASK_EVENTS_ROUTING_KEY
+        return routed_task_events_binding_key(self.execution_id)
 
     def capture(self):
         # Only called when celery is used so we import it here
         from cloudify.celery import celery
+        self._start_events_handler()
         with celery.connection() as connection:
             self._receiver = celery.events.Receiver(connection, handlers={
                 'task-sent': self.task_sent,
@@ -75,7 +198,7 @@ class Monitor(object):
                 'task-failed': self.task_failed,
                 'task-revoked': self.task_revoked,
                 'task-retried': self.task_retried
-            })
+            }, routing_key=self.routing_key)
             for _ in self._receiver.itercapture(limit=None,
                                                 timeout=None,
                                                 wakeup=True):
@@ -85,6 +208,148 @@ class Monitor(object):
     def stop(self):
         self._should_stop = True
         self._receiver.should_stop = True
+        self._events_queue.put(None)
+
+
+def connect_routed_task_events(app):
+    """
+    Republish the task events of tasks which requested routed task events
+    (see ``ROUTED_TASK_EVENTS_CONTEXT_KEY``) with the task execution id in the
+    routing key. Called once by the worker process.
+
+    :param app: the worker celery app
+    """
+    from celery import signals
+
+    def on_task_prerun(task_id=None, task=None, kwargs=None, **_):
+        _publish_routed_task_event(app, 'task-started', kwargs,
+                                   uuid=task_id)
+
+    def on_task_success(sender=None, result=None, **_):
+        _publish_routed_task_event(app, 'task-succeeded',
+                                   sender.request.kwargs,
+                                   uuid=sender.request.id,
+                                   result=_safe_repr(result))
+
+    def on_task_failure(task_id=None, exception=None, kwargs=None,
+                        traceback=None, einfo=None, **_):
+        _publish_routed_task_event(app, 'task-failed', kwargs,
+                                   uuid=task_id,
+                                   exception=_safe_repr(exception),
+                                   traceback=str(einfo) if einfo else None)
+
+    signals.task_prerun.connect(on_task_prerun, weak=False,
+                                dispatch_uid='cloudify-routed-task-started')
+    signals.task_success.connect(on_task_success, weak=False,
+                                 dispatch_uid='cloudify-routed-task-success')
+    signals.task_failure.connect(on_task_failure, weak=False,
+                                 dispatch_uid='cloudify-routed-task-failure')
+
+
+def _publish_routed_task_event(app, event_type, task_kwargs, **fields):
+    cloudify_context = (task_kwargs or {}).get('__cloudify_context') or {}
+    if not cloudify_context.get(ROUTED_TASK_EVENTS_CONTEXT_KEY):
+        return
+    from celery.events import Event, get_exchange
+    routing_key = routed_task_event_routing_key(
+        event_type, cloudify_context['execution_id'])
+    with app.producer_or_acquire() as producer:
+        exchange = get_exchange(producer.connection)
+        producer.publish(Event(event_type, **fields),
+                         routing_key=routing_key,
+                         exchange=exchange.name,
+                         declare=[exchange],
+                         serializer='json')
+
+
+def _safe_repr(obj):
+    # same representation celery uses for the result and exception fields
+    from kombu.utils.encoding import safe_repr
+    return safe_repr(obj)
+
+
+class TaskEventsProgress(object):
+    """
+    Aggregated progress of the tasks of an execution, sent as periodic
+    'workflow_progress' events instead of an event per task state change.
+
+    Counts are updated incrementally: ``task_added`` is called when an
+    operation task is added to the tasks graph and ``task_state_changed``
+    for every task event. Tasks which do not send task events (e.g. state
+    and event bookkeeping tasks) are not counted.
+
+    :param workflow_context: the workflow context (used to send the events)
+    :param interval: minimum seconds between progress events
+    """
+
+    def __init__(self, workflow_context,
+                 interval=DEFAULT_TASK_EVENTS_PROGRESS_INTERVAL):
+        self.workflow_context = workflow_context
+        self.interval = interval
+        self.total = 0
+        self.counts = dict((state, 0) for state in (
+            tasks_api.TASK_SENDING,
+            tasks_api.TASK_STARTED,
+            tasks_api.TASK_SUCCEEDED,
+            tasks_api.TASK_FAILED,
+            tasks_api.TASK_RESCHEDULED))
+        self.started_at = time.time()
+        self._last_report = self.started_at
+        self._lock = threading.Lock()
+
+    def task_added(self, task):
+        if not task.send_task_events:
+            return
+        with self._lock:
+            self.total += 1
+
+    def task_state_changed(self, task, state):
+        with self._lock:
+            if state in self.counts:
+                self.counts[state] += 1
+            should_report = time.time() - self._last_report >= self.interval
+        if should_report:
+            self.report()
+
+    def report(self):
+        """Send a progress event now"""
+        with self._lock:
+            self._last_report = time.time()
+            progress = self._progress()
+        self.workflow_context.internal.send_workflow_event(
+            event_type='workflow_progress',
+            message="'{0}' workflow progress: {1}/{2} tasks succeeded, {3} "
+                    "failed, {4} rescheduled, {5} in flight "
+                    "({6:.2f} tasks/sec, ETA {7})".format(
+                        self.workflow_context.workflow_id,
+                        progress['succeeded'],
+                        progress['total'],
+                        progress['failed'],
+                        progress['rescheduled'],
+                        progress['in_flight'],
+                        progress['throughput'],
+                        '{0:.0f}s'.format(progress['eta'])
+                        if progress['eta'] is not None else 'unknown'),
+            args=progress)
+
+    def _progress(self):
+        terminated = (self.counts[tasks_api.TASK_SUCCEEDED] +
+                      self.counts[tasks_api.TASK_FAILED] +
+                      self.counts[tasks_api.TASK_RESCHEDULED])
+        remaining = max(self.total - terminated, 0)
+        elapsed = time.time() - self.started_at
+        throughput = terminated / elapsed if elapsed > 0 else 0.0
+        return {
+            'total': self.total,
+            'succeeded': self.counts[tasks_api.TASK_SUCCEEDED],
+            'failed': self.counts[tasks_api.TASK_FAILED],
+            'rescheduled': self.counts[tasks_api.TASK_RESCHEDULED],
+            'in_flight': max(
+                self.counts[tasks_api.TASK_SENDING] - terminated, 0),
+            'remaining': remaining,
+            'throughput': throughput,
+            'eta': remaining / throughput if throughput > 0 else None
+        }
 
 
 def send_task_event_func_remote(task, event_type, message,
@@ -114,7 +379,8 @@ def _send_task_event_func(task, event_type, message, out_func,
                              event_type=event_type,
                              message=message,
                              out_func=out_func,
-                             additional_context=additional_context)
+                             additional_context=additional_context,
+                             message_context=task.message_context)
 
 
 def _filter_task(task, state):
@@ -138,6 +404,15 @@ def send_task_event(state, task, send_event_func, event):
     if _filter_task(task, state):
         return
 
+    workflow_context = task.workflow_context
+    progress = workflow_context.internal.task_events_progress
+    if progress is not None:
+        progress.task_state_changed(task, state)
+    if (workflow_context.task_events_verbosity != TASK_EVENTS_FULL and
+            state not in (tasks_api.TASK_FAILED,
+                          tasks_api.TASK_RESCHEDULED)):
+        return
+
     if state in (tasks_api.TASK_FAILED, tasks_api.TASK_RESCHEDULED,
                  tasks_api.TASK_SUCCEEDED) and event is None:
         raise RuntimeError('Event for task {0} is None'.format(task.name))
@@ -14,6 +14,7 @@
 #    * limitations under the License.
 
 import os
+import sys
 import tempfile
 import copy
 import importlib
@@ -26,6 +27,9 @@ from contextlib import contextmanager
 from cloudify_rest_client.nodes import Node
 from cloudify_rest_client.node_instances import NodeInstance
 
+from cloudify import logs
+from cloudify import serialization
+from cloudify.workflows.events import TASK_EVENTS_FULL
 from cloudify.workflows.workflow_context import (
     DEFAULT_LOCAL_TASK_THREAD_POOL_SIZE)
 
@@ -41,6 +45,10 @@ except ImportError as e:
     dsl_functions = None
     HOST_TYPE = None
 
+DEFAULT_EVENTS_FILE_MAX_BYTES = 100 * 1024 * 1024
+DEFAULT_EVENTS_FILE_BACKUP_COUNT = 5
+DEFAULT_EVENTS_BUFFER_SIZE = 1000
+
 
 class _Environment(object):
 
@@ -53,9 +61,11 @@ class _Environment(object):
                  ignored_modules=None,
                  provider_context=None,
                  resolver=None,
-                 validate_version=True):
+                 validate_version=True,
+                 event_sink=None):
         self.storage = storage
         self.storage.env = self
+        self.event_sink = event_sink
 
         if load_existing:
             self.storage.load(name)
@@ -103,7 +113,11 @@ class _Environment(object):
                 task_retries=-1,
                 task_retry_interval=30,
                 subgraph_retries=0,
-                task_thread_pool_size=DEFAULT_LOCAL_TASK_THREAD_POOL_SIZE):
+                task_thread_pool_size=DEFAULT_LOCAL_TASK_THREAD_POOL_SIZE,
+                task_events_verbosity=TASK_EVENTS_FULL,
+                logging_level=None,
+                event_sink=None,
+                prefetch_context=False):
         workflows = self.plan['workflows']
         workflow_name = workflow
         if workflow_name not in workflows:
@@ -127,13 +141,24 @@ class _Environment(object):
             'task_retries': task_retries,
             'task_retry_interval': task_retry_interval,
             'subgraph_retries': subgraph_retries,
-            'local_task_thread_pool_size': task_thread_pool_size
+            'local_task_thread_pool_size': task_thread_pool_size,
+            'task_events_verbosity': task_events_verbosity,
+            'logging_level': logging_level,
+            'prefetch_context': prefetch_context
         }
+        event_sink = event_sink or self.event_sink
+        if event_sink is not None:
+            ctx['event_sink'] = event_sink
 
         merged_parameters = _merge_and_validate_execution_parameters(
             workflow, workflow_name, parameters, allow_custom_parameters)
 
-        return workflow_method(__cloudify_context=ctx, **merged_parameters)
+        try:
+            return workflow_method(__cloudify_context=ctx,
+                                   **merged_parameters)
+        finally:
+            if event_sink is not None:
+                event_sink.flush()
 
 
 def init_env(blueprint_path,
@@ -143,7 +168,8 @@ def init_env(blueprint_path,
              ignored_modules=None,
              provider_context=None,
              resolver=None,
-             validate_version=True):
+             validate_version=True,
+             event_sink=None):
     if storage is None:
         storage = InMemoryStorage()
     return _Environment(storage=storage,
@@ -154,14 +180,16 @@ def init_env(blueprint_path,
                         ignored_modules=ignored_modules,
                         provider_context=provider_context,
                         resolver=resolver,
-                        validate_version=validate_version)
+                        validate_version=validate_version,
+                        event_sink=event_sink)
 
 
-def load_env(name, storage, resolver=None):
+def load_env(name, storage, resolver=None, event_sink=None):
     return _Environment(storage=storage,
                         name=name,
                         load_existing=True,
-                        resolver=resolver)
+                        resolver=resolver,
+                        event_sink=event_sink)
 
 
 def _parse_plan(blueprint_path, inputs, ignored_modules, resolver,
@@ -348,10 +376,48 @@ class _Storage(object):
             else:
                 instance['version'] += 1
             if runtime_properties is not None:
-                instance['runtime_properties'] = runtime_properties
+                # a copy, as callers keep changing their runtime properties
+                instance['runtime_properties'] = copy.deepcopy(
+                    dict(runtime_properties))
             if state is not None:
                 instance['state'] = state
             self._store_instance(instance)
+            return copy.deepcopy(instance)
+
+    def patch_node_instance(self,
+                            node_instance_id,
+                            version,
+                            changed_runtime_properties=None,
+                            deleted_runtime_properties=None):
+        """
+        Update some of the runtime properties of a node instance, keeping
+        the others.
+
+        :param node_instance_id: the node instance id
+        :param version: the node instance version the changes were made to
+        :param changed_runtime_properties: the runtime properties to set
+        :param deleted_runtime_properties: the runtime properties (keys) to
+                                           remove
+        :return: the updated node instance
+        """
+        with self._lock(node_instance_id):
+            instance = self._get_node_instance(node_instance_id)
+            if version != instance['version']:
+                raise StorageConflictError('version {0} does not match '
+                                           'current version of '
+                                           'node instance {1} which is {2}'
+                                           .format(version,
+                                                   node_instance_id,
+                                                   instance['version']))
+            instance['version'] += 1
+            runtime_properties = instance.get('runtime_properties') or {}
+            runtime_properties.update(
+                copy.deepcopy(changed_runtime_properties or {}))
+            for key in deleted_runtime_properties or []:
+                runtime_properties.pop(key, None)
+            instance['runtime_properties'] = runtime_properties
+            self._store_instance(instance)
+            return copy.deepcopy(instance)
 
     def _get_node_instance(self, node_instance_id):
         instance = self._load_instance(node_instance_id)
@@ -531,3 +597,101 @@ class FileStorage(_Storage):
 
 class StorageConflictError(Exception):
     pass
+
+
+class JsonLinesEventSink(object):
+    """
+    Writes the logs and events of local executions to a file, one JSON
+    object per line, instead of printing them to stdout.
+
+    Lines are buffered in memory and written every ``buffer_size`` lines,
+    and when the execution ends (``_Environment.execute`` flushes the sink
+    whether the workflow succeeded or failed). The file is rotated when it
+    grows over ``max_bytes``, keeping ``backup_count`` rotated files
+    (``<path>.1`` being the most recent).
+
+    :param path: the events file path
+    :param max_bytes: rotate the file when it would grow over this size
+                      (0: never rotate)
+    :param backup_count: number of rotated files to keep
+    :param buffer_size: number of lines buffered before writing
+    :param human_readable: also write the human readable form of logs and
+                           events (as printed without a sink) to ``stream``
+    :param stream: the human readable output stream (default: stdout)
+    """
+
+    def __init__(self,
+                 path,
+                 max_bytes=DEFAULT_EVENTS_FILE_MAX_BYTES,
+                 backup_count=DEFAULT_EVENTS_FILE_BACKUP_COUNT,
+                 buffer_size=DEFAULT_EVENTS_BUFFER_SIZE,
+                 human_readable=False,
+                 stream=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.buffer_size = buffer_size
+        self.human_readable = human_readable
+        self.stream = stream
+        self._lines = []
+        self._file = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def log_out(self, log, ctx=None):
+        self._write_item(log, 'cloudify_log')
+
+    def event_out(self, event, ctx=None):
+        self._write_item(event, 'cloudify_event')
+
+    def flush(self):
+        """Write the buffered lines and flush the file"""
+        with self._lock:
+            self._write_lines()
+            if self._file is not None:
+                self._file.flush()
+        if self.human_readable:
+            (self.stream or sys.stdout).flush()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _write_item(self, item, message_type):
+        logs.populate_base_item(item, message_type)
+        line = '{0}\n'.format(serialization.dumps(item))
+        with self._lock:
+            self._lines.append(line)
+            if len(self._lines) >= self.buffer_size:
+                self._write_lines()
+        if self.human_readable:
+            (self.stream or sys.stdout).write('{0}\n'.format(
+                logs.create_event_message_prefix(item)))
+
+    def _write_lines(self):
+        if not self._lines:
+            return
+        data = ''.join(self._lines)
+        self._lines = []
+        if self._file is None:
+            self._file = open(self.path, 'a')
+            self._size = self._file.tell()
+        if (self.max_bytes and self._size and
+                self._size + len(data) > self.max_bytes):
+            self._rotate()
+        self._file.write(data)
+        self._size += len(data)
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            source = '{0}.{1}'.format(self.path, i)
+            if os.path.exists(source):
+                os.rename(source, '{0}.{1}'.format(self.path, i + 1))
+        if self.backup_count > 0:
+            os.rename(self.path, '{0}.1'.format(self.path))
+        self._file = open(self.path, 'w')
+        self._size = 0
@@ -20,6 +20,7 @@ import uuid
 import Queue
 
 from cloudify import exceptions
+from cloudify import logs
 from cloudify.workflows import api
 
 INFINITE_TOTAL_RETRIES = -1
@@ -93,6 +94,7 @@ class WorkflowTask(object):
         self.workflow_context = workflow_context
         self.send_task_events = send_task_events
         self.containing_subgraph = None
+        self._message_context = None
 
         self.current_retries = 0
         # timestamp for which the task should not be executed
@@ -256,6 +258,17 @@ class WorkflowTask(object):
     def cloudify_context(self):
         raise NotImplementedError('Implemented by subclasses')
 
+    @property
+    def message_context(self):
+        """
+        The message context of this task's events. Built from the cloudify
+        context on first use (when the first event of the task is sent).
+        """
+        if self._message_context is None:
+            self._message_context = logs.message_context_from_task_context(
+                self.cloudify_context)
+        return self._message_context
+
     @property
     def name(self):
         """
@@ -45,6 +45,11 @@ class TaskDependencyGraph(object):
         """
         self.ctx.logger.debug('adding task: {0}'.format(task))
         self.graph.add_node(task.id, task=task)
+        progress = self.ctx.internal.task_events_progress
+        if (progress is not None and
+                not isinstance(task, SubgraphTask) and
+                not task.is_nop()):
+            progress.task_added(task)
 
     def get_task(self, task_id):
         """Get a task instance that was inserted to this graph by its id
@@ -122,27 +127,59 @@ class TaskDependencyGraph(object):
             if self._is_execution_cancelled():
                 raise api.ExecutionCancelled()
 
-            self._check_dump_request()
-
             # handle all terminated tasks
             # it is important this happens before handling
             # executable tasks so we get to make tasks executable
             # and then execute them in this iteration (otherwise, it would
             # be the next one)
-            for task in self._terminated_tasks():
-                self._handle_terminated_task(task)
+            self.handle_terminated_tasks()
 
             # handle all executable tasks
-            for task in self._executable_tasks():
-                self._handle_executable_task(task)
+            for task in self.executable_tasks():
+                self.execute_task(task)
 
             # no more tasks to process, time to move on
             if len(self.graph.node) == 0:
+                progress = self.ctx.internal.task_events_progress
+                if progress is not None:
+                    progress.report()
                 return
             # sleep some and do it all over again
             else:
                 time.sleep(0.1)
 
+    def handle_terminated_tasks(self):
+        """
+        Handle the terminated tasks of the graph (and task dump requests),
+        as done by ``execute`` on every iteration. Used along with
+        ``executable_tasks`` and ``execute_task`` to execute the graph
+        together with other graphs.
+
+        :return: the terminated tasks handled
+        :raises RuntimeError: if a task failed
+        """
+        self._check_dump_request()
+        handled = []
+        for task in self._terminated_tasks():
+            self._handle_terminated_task(task)
+            handled.append(task)
+        return handled
+
+    def executable_tasks(self):
+        """
+        :return: An iterator for the tasks which can be executed now (see
+                 ``execute_task``)
+        """
+        return self._executable_tasks()
+
+    def execute_task(self, task):
+        """
+        Execute an executable task of the graph.
+
+        :param task: The task
+        """
+        self._handle_executable_task(task)
+
     @staticmethod
     def _is_execution_cancelled():
         return api.has_cancel_request()
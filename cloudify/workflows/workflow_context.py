@@ -23,6 +23,7 @@ import Queue
 
 from proxy_tools import proxy
 
+from cloudify import constants
 from cloudify import context
 from cloudify.manager import (get_node_instance,
                               update_node_instance,
@@ -40,17 +41,22 @@ from cloudify.workflows.tasks import (RemoteWorkflowTask,
 from cloudify import exceptions
 from cloudify.workflows import events
 from cloudify.workflows.tasks_graph import TaskDependencyGraph
+from cloudify.workflows.deployments_runner import (
+    DeploymentsGraphRunner,
+    DEFAULT_DEPLOYMENTS_TASKS_CONCURRENCY)
 from cloudify import logs
 from cloudify.logs import (CloudifyWorkflowLoggingHandler,
                            CloudifyWorkflowNodeLoggingHandler,
                            SystemWideWorkflowLoggingHandler,
                            init_cloudify_logger,
+                           release_cloudify_logger,
                            send_workflow_event,
                            send_sys_wide_wf_event,
                            send_workflow_node_event)
 
 
 DEFAULT_LOCAL_TASK_THREAD_POOL_SIZE = 1
+DEFAULT_DEPLOYMENTS_PREFETCH_CONCURRENCY = 10
 
 
 class CloudifyWorkflowRelationshipInstance(object):
@@ -190,8 +196,15 @@ class CloudifyWorkflowNodeInstance(object):
         self.ctx = ctx
         self._node = node
         self._node_instance = node_instance
+        self._nodes_and_instances = nodes_and_instances
         # Directly contained node instances. Filled in the context's __init__()
         self._contained_instances = []
+        # The instance this instance is contained in and the [entry, exit)
+        # positions of this instance in the containment tree DFS order.
+        # Filled in the context's __init__()
+        self._contained_in = None
+        self._containment_entry = None
+        self._containment_exit = None
         self._relationship_instances = dict(
             (relationship_instance['target_id'],
                 CloudifyWorkflowRelationshipInstance(
@@ -300,7 +313,12 @@ class CloudifyWorkflowNodeInstance(object):
         logger_name = '{0}-{1}'.format(self.ctx.execution_id, self.id)
         logging_handler = self.ctx.internal.handler.get_node_logging_handler(
             self)
-        return init_cloudify_logger(logging_handler, logger_name)
+        return init_cloudify_logger(logging_handler, logger_name,
+                                    **self.ctx._logger_settings)
+
+    def _release_logger(self):
+        logger, self._logger = self._logger, None
+        release_cloudify_logger(logger)
 
     @property
     def contained_instances(self):
@@ -309,18 +327,46 @@ class CloudifyWorkflowNodeInstance(object):
         """
         return self._contained_instances
 
+    @property
+    def contained_in(self):
+        """
+        Returns the node instance this instance is directly contained in
+        (parent) or None if it is not contained in any instance
+        """
+        return self._contained_in
+
     def _add_contained_node_instance(self, node_instance):
         self._contained_instances.append(node_instance)
+        node_instance._contained_in = self
 
     def get_contained_subgraph(self):
         """
         Returns a set containing this instance and all nodes that are
         contained directly and transitively within it
         """
-        result = set([self])
-        for child in self.contained_instances:
-            result.update(child.get_contained_subgraph())
-        return result
+        return set(self.get_contained_subgraph_list())
+
+    def get_contained_subgraph_list(self):
+        """
+        Returns a list containing this instance followed by all nodes that
+        are contained directly and transitively within it (in DFS order)
+        """
+        return self._nodes_and_instances._contained_order[
+            self._containment_entry:self._containment_exit]
+
+    def is_contained_in(self, node_instance):
+        """
+        Returns whether this instance is contained directly or transitively
+        within ``node_instance``. An instance is considered to be
+        contained in itself.
+
+        :param node_instance: a CloudifyWorkflowNodeInstance instance
+        """
+        return (node_instance._nodes_and_instances is
+                self._nodes_and_instances and
+                node_instance._containment_entry <=
+                self._containment_entry <
+                node_instance._containment_exit)
 
 
 class CloudifyWorkflowNode(object):
@@ -340,6 +386,7 @@ class CloudifyWorkflowNode(object):
                 self.ctx, self, nodes_and_instances, relationship))
             for relationship in node.relationships)
         self._node_instances = {}
+        self._prefetch_data = None
 
     @property
     def id(self):
@@ -399,6 +446,15 @@ class CloudifyWorkflowNode(object):
         """Get a node relationship by its target id"""
         return self._relationships.get(target_id)
 
+    @property
+    def prefetch_data(self):
+        """The node data passed to operations prefetching nodes"""
+        if self._prefetch_data is None:
+            self._prefetch_data = dict(
+                (key, self._node[key]) for key in
+                constants.PREFETCHED_NODE_KEYS if key in self._node)
+        return self._prefetch_data
+
 
 class _WorkflowContextBase(object):
 
@@ -414,11 +470,32 @@ class _WorkflowContextBase(object):
                                      DEFAULT_TOTAL_RETRIES)
         self._subgraph_retries = ctx.get('subgraph_retries',
                                          DEFAULT_SUBGRAPH_TOTAL_RETRIES)
+        self._routed_task_events = ctx.get(
+            events.ROUTED_TASK_EVENTS_CONTEXT_KEY, False)
+        self._task_events_verbosity = ctx.get('task_events_verbosity',
+                                              events.TASK_EVENTS_FULL)
+        if self._task_events_verbosity not in events.TASK_EVENTS_VERBOSITIES:
+            raise ValueError(
+                'Invalid task_events_verbosity: {0} (expected one of {1})'
+                .format(self._task_events_verbosity,
+                        events.TASK_EVENTS_VERBOSITIES))
+        self._task_events_progress_interval = ctx.get(
+            'task_events_progress_interval',
+            events.DEFAULT_TASK_EVENTS_PROGRESS_INTERVAL)
+        self._prefetch_context = ctx.get(constants.PREFETCH_CONTEXT_KEY,
+                                         False)
+        self._logger_settings = logs.logger_settings(ctx)
+        # passed on to operations, so their loggers use the same settings
+        self._logging_context = dict(
+            (key, ctx[key]) for key in logs.LOGGING_CONTEXT_KEYS
+            if ctx.get(key) is not None)
         self._logger = None
 
         if self.local:
             storage = ctx.pop('storage')
-            handler = LocalCloudifyWorkflowContextHandler(self, storage)
+            event_sink = ctx.pop('event_sink', None)
+            handler = LocalCloudifyWorkflowContextHandler(self, storage,
+                                                          event_sink)
         else:
             handler = remote_ctx_handler_cls(self)
 
@@ -460,6 +537,15 @@ class _WorkflowContextBase(object):
         """Is the workflow running in a local or remote context"""
         return self._context.get('local', False)
 
+    @property
+    def task_events_verbosity(self):
+        """
+        Which task events are sent: all of them ('full'), only failures
+        ('failures') or only failures and periodic aggregated progress
+        events ('progress')
+        """
+        return self._task_events_verbosity
+
     @property
     def logger(self):
         """A logger for this workflow"""
@@ -470,7 +556,12 @@ class _WorkflowContextBase(object):
     def _init_cloudify_logger(self):
         logger_name = self.execution_id
         logging_handler = self.internal.handler.get_context_logging_handler()
-        return init_cloudify_logger(logging_handler, logger_name)
+        return init_cloudify_logger(logging_handler, logger_name,
+                                    **self._logger_settings)
+
+    def _release_loggers(self):
+        logger, self._logger = self._logger, None
+        release_cloudify_logger(logger)
 
     def send_event(self, event, event_type='workflow_stage',
                    args=None,
@@ -543,6 +634,10 @@ class _WorkflowContextBase(object):
                 'is_target': related_node_instance.id in relationships
             }
 
+        if self._prefetch_context:
+            node_context[constants.PREFETCHED_NODES_CONTEXT_KEY] = \
+                self._prefetched_nodes(node_instance, related_node_instance)
+
         final_kwargs = self._merge_dicts(merged_from=kwargs,
                                          merged_into=operation_properties,
                                          allow_override=allow_kwargs_override)
@@ -555,6 +650,25 @@ class _WorkflowContextBase(object):
                                  total_retries=total_retries,
                                  retry_interval=operation_retry_interval)
 
+    @staticmethod
+    def _prefetched_nodes(*node_instances):
+        """
+        The data of the nodes an operation of ``node_instances`` may read:
+        their nodes, host nodes and relationship target nodes.
+        """
+        nodes = {}
+        for node_instance in node_instances:
+            if node_instance is None:
+                continue
+            node = node_instance.node
+            related_nodes = [node, node.host_node] + [
+                relationship.target_node
+                for relationship in node.relationships]
+            for related_node in related_nodes:
+                if related_node is not None and related_node.id not in nodes:
+                    nodes[related_node.id] = related_node.prefetch_data
+        return nodes
+
     @staticmethod
     def _merge_dicts(merged_from, merged_into, allow_override=False):
         result = copy.copy(merged_into)
@@ -594,6 +708,7 @@ class _WorkflowContextBase(object):
             'workflow_id': self.workflow_id,
         }
         context.update(node_context)
+        context.update(self._logging_context)
         context.update(self.internal.handler.operation_cloudify_context)
         return context
 
@@ -758,6 +873,29 @@ class WorkflowNodesAndInstancesContainer(object):
                         "cloudify.relationships.contained_in"):
                     rel.target_node_instance._add_contained_node_instance(inst)
 
+        self._contained_order = []
+        self._index_containment_tree()
+
+    def _index_containment_tree(self):
+        # number the contained_in forest once in DFS order so that whole
+        # subtrees are contiguous slices of self._contained_order and
+        # containment checks are a simple comparison of positions
+        order = self._contained_order
+        roots = [inst for inst in self._node_instances.itervalues()
+                 if inst.contained_in is None]
+        for root in roots:
+            stack = [(root, False)]
+            while stack:
+                inst, visited = stack.pop()
+                if visited:
+                    inst._containment_exit = len(order)
+                    continue
+                inst._containment_entry = len(order)
+                order.append(inst)
+                stack.append((inst, True))
+                for child in reversed(inst.contained_instances):
+                    stack.append((child, False))
+
     @property
     def nodes(self):
         return self._nodes.itervalues()
@@ -831,6 +969,11 @@ class CloudifyWorkflowContext(
         })
         return context
 
+    def _release_loggers(self):
+        super(CloudifyWorkflowContext, self)._release_loggers()
+        for instance in self.node_instances:
+            instance._release_logger()
+
 
 class CloudifySystemWideWorkflowContext(_WorkflowContextBase):
 
@@ -840,6 +983,7 @@ class CloudifySystemWideWorkflowContext(_WorkflowContextBase):
             SystemWideWfRemoteContextHandler
         )
         self._dep_contexts = None
+        self._dep_contexts_loaders = None
 
     class _ManagedCloudifyWorkflowContext(CloudifyWorkflowContext):
         def __enter__(self):
@@ -854,6 +998,7 @@ class CloudifySystemWideWorkflowContext(_WorkflowContextBase):
     def deployments_contexts(self):
         if self._dep_contexts is None:
             self._dep_contexts = {}
+            self._dep_contexts_loaders = {}
             rest = get_rest_client()
             for dep in rest.deployments.list():
                 dep_ctx = self._context.copy()
@@ -861,17 +1006,102 @@ class CloudifySystemWideWorkflowContext(_WorkflowContextBase):
                 dep_ctx['blueprint_id'] = dep.blueprint_id
 
                 def lazily_loaded_ctx(dep_ctx):
+                    lock = threading.Lock()
+
                     def lazy_ctx():
-                        if not hasattr(lazy_ctx, '_cached_ctx'):
-                            lazy_ctx._cached_ctx = \
-                                self._ManagedCloudifyWorkflowContext(dep_ctx)
+                        with lock:
+                            if not hasattr(lazy_ctx, '_cached_ctx'):
+                                lazy_ctx._cached_ctx = \
+                                    self._build_deployment_context(dep_ctx)
                         return lazy_ctx._cached_ctx
 
-                    return proxy(lazy_ctx)
+                    return lazy_ctx
 
-                self._dep_contexts[dep.id] = lazily_loaded_ctx(dep_ctx)
+                loader = lazily_loaded_ctx(dep_ctx)
+                self._dep_contexts_loaders[dep.id] = loader
+                self._dep_contexts[dep.id] = proxy(loader)
         return self._dep_contexts
 
+    def prefetch_deployments_contexts(
+            self,
+            deployment_ids=None,
+            concurrency=DEFAULT_DEPLOYMENTS_PREFETCH_CONCURRENCY):
+        """
+        Load deployment contexts in parallel instead of lazily and serially
+        when they are first accessed.
+
+        :param deployment_ids: ids of the deployments whose contexts should
+                               be loaded (default: all deployments)
+        :param concurrency: maximum number of contexts loaded concurrently
+        :return: the ``deployments_contexts`` dict
+        """
+        dep_contexts = self.deployments_contexts
+        if deployment_ids is None:
+            deployment_ids = dep_contexts.keys()
+        loaders = [self._dep_contexts_loaders[dep_id]
+                   for dep_id in deployment_ids]
+        pending = Queue.Queue()
+        for loader in loaders:
+            pending.put(loader)
+        errors = []
+
+        def load():
+            while not errors:
+                try:
+                    loader = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    loader()
+                except BaseException as e:
+                    errors.append(e)
+
+        threads = []
+        for _ in range(max(1, min(concurrency, len(loaders)))):
+            thread = threading.Thread(target=load)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return dep_contexts
+
+    def execute_in_deployments(
+            self,
+            build_graph,
+            deployment_ids=None,
+            concurrency=DEFAULT_DEPLOYMENTS_TASKS_CONCURRENCY,
+            **kwargs):
+        """
+        Build and execute a task graph per deployment, for all deployments
+        concurrently, keeping the number of tasks in flight across all
+        deployments under ``concurrency``.
+
+        :param build_graph: a function called with a deployment workflow
+                            context and its task graph, adding the
+                            deployment tasks to the graph
+        :param deployment_ids: the deployments to run on (default: all)
+        :param concurrency: the maximum number of tasks in flight across all
+                            deployments
+        :param kwargs: additional ``DeploymentsGraphRunner`` arguments
+        :return: a dict of deployment id -> DeploymentProgress
+        """
+        return DeploymentsGraphRunner(self,
+                                      build_graph,
+                                      deployment_ids=deployment_ids,
+                                      concurrency=concurrency,
+                                      **kwargs).run()
+
+    def _build_deployment_context(self, dep_ctx):
+        dep_context = self._ManagedCloudifyWorkflowContext(dep_ctx)
+        # all deployment contexts share the system-wide workflow event
+        # monitor (if it is running) instead of starting one each
+        dep_context.internal.shared_event_monitor = \
+            self.internal.event_monitor
+        return dep_context
+
 
 class CloudifyWorkflowContextInternal(object):
 
@@ -890,6 +1120,13 @@ class CloudifyWorkflowContextInternal(object):
         # events related
         self._event_monitor = None
         self._event_monitor_thread = None
+        self.shared_event_monitor = None
+        self.task_events_progress = None
+        if (workflow_context.task_events_verbosity ==
+                events.TASK_EVENTS_PROGRESS):
+            self.task_events_progress = events.TaskEventsProgress(
+                workflow_context,
+                interval=workflow_context._task_events_progress_interval)
 
         # local task processing
         thread_pool_size = self.workflow_context._local_task_thread_pool_size
@@ -934,13 +1171,25 @@ class CloudifyWorkflowContextInternal(object):
     def graph_mode(self, graph_mode):
         self._graph_mode = graph_mode
 
+    @property
+    def event_monitor(self):
+        return self._event_monitor or self.shared_event_monitor
+
     def start_event_monitor(self):
         """
         Start an event monitor in its own thread for handling task events
-        defined in the task dependency graph
+        defined in the task dependency graph.
+        If a shared event monitor is set, the task dependency graph is
+        registered with it instead.
 
         """
-        monitor = events.Monitor(self.task_graph)
+        if self.shared_event_monitor is not None:
+            self.shared_event_monitor.add_tasks_graph(self.task_graph)
+            return
+        execution_id = None
+        if self.workflow_context._routed_task_events:
+            execution_id = self.workflow_context.execution_id
+        monitor = events.Monitor(self.task_graph, execution_id=execution_id)
         thread = threading.Thread(target=monitor.capture)
         thread.daemon = True
         thread.start()
@@ -948,6 +1197,9 @@ class CloudifyWorkflowContextInternal(object):
         self._event_monitor_thread = thread
 
     def stop_event_monitor(self):
+        if self.shared_event_monitor is not None:
+            self.shared_event_monitor.remove_tasks_graph(self.task_graph)
+            return
         self._event_monitor.stop()
 
     def send_task_event(self, state, task, event=None):
@@ -968,6 +1220,10 @@ class CloudifyWorkflowContextInternal(object):
     def add_local_task(self, task):
         self.local_tasks_processor.add_task(task)
 
+    def release_loggers(self):
+        """Release the loggers of the workflow and its node instances"""
+        self.workflow_context._release_loggers()
+
 
 class LocalTasksProcessing(object):
 
@@ -1135,7 +1391,10 @@ class RemoteContextHandler(CloudifyWorkflowContextHandler):
 
     @property
     def operation_cloudify_context(self):
-        return {'local': False}
+        context = {'local': False}
+        if self.workflow_ctx._routed_task_events:
+            context[events.ROUTED_TASK_EVENTS_CONTEXT_KEY] = True
+        return context
 
     def get_set_state_task(self,
                            workflow_node_instance,
@@ -1245,26 +1504,36 @@ class SystemWideWfRemoteContextHandler(RemoteContextHandler):
 
 class LocalCloudifyWorkflowContextHandler(CloudifyWorkflowContextHandler):
 
-    def __init__(self, workflow_ctx, storage):
+    def __init__(self, workflow_ctx, storage, event_sink=None):
         super(LocalCloudifyWorkflowContextHandler, self).__init__(
             workflow_ctx)
         self.storage = storage
+        self.event_sink = event_sink
+        self._log_out, self._event_out = logs.local_out_funcs(event_sink)
         self._send_task_event_func = None
 
     def get_context_logging_handler(self):
         return CloudifyWorkflowLoggingHandler(self.workflow_ctx,
-                                              out_func=logs.stdout_log_out)
+                                              out_func=self._log_out)
 
     def get_node_logging_handler(self, workflow_node_instance):
         return CloudifyWorkflowNodeLoggingHandler(workflow_node_instance,
-                                                  out_func=logs.stdout_log_out)
+                                                  out_func=self._log_out)
 
     @property
     def bootstrap_context(self):
         return {}
 
     def get_send_task_event_func(self, task):
-        return events.send_task_event_func_local
+        if self.event_sink is None:
+            return events.send_task_event_func_local
+        return self._send_task_event_to_sink
+
+    def _send_task_event_to_sink(self, task, event_type, message,
+                                 additional_context=None):
+        events._send_task_event_func(task, event_type, message,
+                                     out_func=self.event_sink.event_out,
+                                     additional_context=additional_context)
 
     def get_update_execution_status_task(self, new_status):
         raise NotImplementedError(
@@ -1279,7 +1548,7 @@ class LocalCloudifyWorkflowContextHandler(CloudifyWorkflowContextHandler):
                                      event_type='workflow_node_event',
                                      message=event,
                                      additional_context=additional_context,
-                                     out_func=logs.stdout_event_out)
+                                     out_func=self._event_out)
         return send_event_task
 
     def get_send_workflow_event_task(self, event, event_type, args,
@@ -1291,7 +1560,7 @@ class LocalCloudifyWorkflowContextHandler(CloudifyWorkflowContextHandler):
                                 message=event,
                                 args=args,
                                 additional_context=additional_context,
-                                out_func=logs.stdout_event_out)
+                                out_func=self._event_out)
         return send_event_task
 
     def get_task(self, workflow_task, queue=None, target=None):
@@ -1299,8 +1568,11 @@ class LocalCloudifyWorkflowContextHandler(CloudifyWorkflowContextHandler):
 
     @property
     def operation_cloudify_context(self):
-        return {'local': True,
-                'storage': self.storage}
+        context = {'local': True,
+                   'storage': self.storage}
+        if self.event_sink is not None:
+            context['event_sink'] = self.event_sink
+        return context
 
     def get_set_state_task(self,
                            workflow_node_instance,
@@ -1328,7 +1600,7 @@ class LocalCloudifyWorkflowContextHandler(CloudifyWorkflowContextHandler):
                             message=message,
                             args=args,
                             additional_context=additional_context,
-                            out_func=logs.stdout_event_out)
+                            out_func=self._event_out)
 
     def download_blueprint_resource(self,
                                     resource_path,
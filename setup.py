@@ -46,6 +46,7 @@ setup(
               'cloudify.plugins',
               'cloudify.proxy',
               'cloudify.test_utils'],
+    package_data={'cloudify.proxy': ['ctx.sh']},
     license='LICENSE',
     description='Contains necessary decorators and utility methods for '
                 'writing Cloudify plugins',